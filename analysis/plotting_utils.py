@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+import json
 import os
 
 import matplotlib.pyplot as plt
@@ -9,6 +10,10 @@ import seaborn as sns
 REWARD_QUANTILES = [f"rq_{i/10}" for i in range(1, 10)]
 GATING_QUANTILES = [f"gq_{i/10}" for i in range(1, 10)]
 
+## result files written by each run, and the columns the consolidated results are indexed on
+RESULT_GROUPS = ['train_results', 'test_results', 'left_eval_results']
+INDEX_COLS = ['run_name', 'result_group', 'training_task']
+
 ## color palette
 
 # for algorithms
@@ -53,7 +58,11 @@ TIER_DICT = {
 ### classes to handle reading of data
 class resultsManager:
 
-    def __init__(self, experiment_log_loc, environment, setting='random'):
+    def __init__(self, experiment_log_loc, environment, setting='random', use_cache=True, cache_loc=None):
+        """
+        use_cache: keep the results of all runs in one parquet file (per environment / setting),
+        so only runs whose result files changed since are read again
+        """
         self.experiments = (
             pd.read_csv(experiment_log_loc)
             .query(f'(environment=="{environment}") & (latest=="Y") & (setting=="{setting}") & (~file_location.isna())')
@@ -63,26 +72,47 @@ class resultsManager:
         )
         self.environment = environment
         self.setting = setting
-        self.data = {name: resultSet(root = os.path.join('../logs', file), name = name) \
-            for name, file in self.experiments.items()}
+        if use_cache:
+            if cache_loc is None:
+                cache_loc = os.path.join('../logs', f'results_cache_{environment}_{setting}.parquet')
+            cache = resultsCache(cache_loc)
+            self.data = {name: cache.get_result_set(root = os.path.join('../logs', file), name = name) \
+                for name, file in self.experiments.items()}
+            cache.save()
+        else:
+            self.data = {name: resultSet(root = os.path.join('../logs', file), name = name) \
+                for name, file in self.experiments.items()}
+
+        ## all results, indexed for fast selection of runs / result groups / tasks
+        self.results = (
+            pd.concat([result_set.data for result_set in self.data.values()])
+            .set_index(INDEX_COLS)
+            .sort_index()
+        )
 
         self.random_baseline = self.calculate_baseline('random')
         self.right_only_single_baseline = self.calculate_baseline('right_only')
         # self.right_only_double_baseline = None ## need to create this still
 
+    def select(self, run_name=slice(None), result_group=slice(None), training_task=slice(None)):
+        """ Selects results via the index (instead of a query over all rows), with the index columns as columns again """
+        try:
+            selected = self.results.loc[(run_name, result_group, training_task), :]
+        except KeyError:
+            ## nothing logged for this selection
+            selected = self.results.iloc[:0]
+        return selected.reset_index()
+
     def calculate_baseline(self, name):
         # assumes right_only / random have only train data
+        train_results = self.select(run_name=name, result_group='train_results')
         reward_mean = (
-            self.data[name]
-            .data
-            .query('result_group=="train_results"')
+            train_results
             .loc[:, 'reward_mean']
             .mean()
         )
         success_rate = (
-            self.data[name]
-            .data
-            .query('result_group=="train_results"')
+            train_results
             .loc[:, 'num_successes']
             .mean()
         )
@@ -90,19 +120,21 @@ class resultsManager:
 
     def get_result_group_data(self, result_group):
         return (
-            pd.concat(
-                [self.data[k].data.query(f'result_group=="{result_group}"') for k in self.data.keys()]
-                )
+            self.select(result_group=result_group)
             .drop(['num_episodes', 'evaluation_task'], axis =1) 
         )
             
 class resultSet:
 
-    def __init__(self, root, name):
+    def __init__(self, root, name, data=None):
+        """ data: results of the run that were already read (e.g. from the resultsCache) """
         self.root = root
         self.name = name
-        self.contents = os.listdir(self.root)
-        self.data = self.collect_results()
+        if data is None:
+            self.contents = os.listdir(self.root)
+            self.data = self.collect_results()
+        else:
+            self.data = data
 
     def collect_results(self):
         train_results = self.read_if_exists('train_results.csv')
@@ -118,16 +150,71 @@ class resultSet:
 
     def read_if_exists(self, path):
         
-        if path in self.contents:
-            result = (
-                pd.read_csv(os.path.join(self.root, path))
-                .assign(result_group = path.replace('.csv', ''))
-            )
-        else:
-            result = None
+        ## prefer the columnar copies of the results if they were written (much faster to load)
+        name = path.replace('.csv', '')
+        result = None
+        for ext, read_fn in [('.parquet', pd.read_parquet), ('.arrow', pd.read_feather), ('.csv', pd.read_csv)]:
+            if name + ext in self.contents:
+                try:
+                    result = read_fn(os.path.join(self.root, name + ext))
+                except Exception:
+                    ## columnar files are incomplete if the run didn't finish, the csv is always readable
+                    continue
+                result = result.assign(result_group = name)
+                break
         
         return result
 
+class resultsCache:
+    """
+    Results of many runs consolidated in a single parquet file (sorted by run_name / result_group / training_task),
+    next to a json manifest with the modification times of each run's result files.
+    A run is only read from its own files again if these changed (or the run folder moved).
+    """
+
+    def __init__(self, cache_loc):
+        self.cache_loc = cache_loc
+        self.manifest_loc = cache_loc.replace('.parquet', '') + '_manifest.json'
+        self.changed = False
+
+        if os.path.exists(self.cache_loc) and os.path.exists(self.manifest_loc):
+            with open(self.manifest_loc) as f:
+                self.manifest = json.load(f)
+            cached = pd.read_parquet(self.cache_loc)
+            self.results = {name: run_results for name, run_results in cached.groupby('run_name', sort=False)}
+        else:
+            self.manifest = {}
+            self.results = {}
+
+    @staticmethod
+    def result_file_mtimes(root):
+        return {
+            file: os.path.getmtime(os.path.join(root, file)) for file in os.listdir(root) \
+                if file.split('.')[0] in RESULT_GROUPS
+        }
+
+    def get_result_set(self, root, name):
+        source = {'root': root, 'mtimes': self.result_file_mtimes(root)}
+        if (self.manifest.get(name) != source) or (name not in self.results):
+            self.results[name] = resultSet(root = root, name = name).data
+            self.manifest[name] = source
+            self.changed = True
+        return resultSet(root = root, name = name, data = self.results[name])
+
+    def save(self):
+        if not self.changed:
+            return
+        (
+            pd.concat(list(self.results.values()))
+            .sort_values(INDEX_COLS, kind='mergesort')
+            .reset_index(drop=True)
+            .to_parquet(self.cache_loc + '.tmp')
+        )
+        os.replace(self.cache_loc + '.tmp', self.cache_loc)
+        with open(self.manifest_loc, 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        self.changed = False
+
 
 ## Plotting functions
 def create_lineplot(data, title, ax):
@@ -21,6 +21,7 @@ def get_args(rest_args):
     parser.add_argument('--pass_state_to_policy', type=boolean_argument, default=True, help='condition policy on state')
     parser.add_argument('--pass_latent_to_policy', type=boolean_argument, default=False, help='condition policy on VAE latent')
     parser.add_argument('--pass_belief_to_policy', type=boolean_argument, default=True, help='condition policy on ground-truth belief')
+    parser.add_argument('--batched_env', type=boolean_argument, default=False, help='step all processes at once in the main process (batched env) instead of in subprocesses')
     parser.add_argument('--pass_task_to_policy', type=boolean_argument, default=False, help='condition policy on ground-truth task description')
 
     # using separate encoders for the different inputs ("None" uses no encoder)
@@ -33,6 +33,7 @@ def get_args(rest_args):
     # note: because we use RL2 here, we do not pass the state again after the encoder
     parser.add_argument('--pass_latent_to_policy', type=boolean_argument, default=True, help='condition policy on VAE latent')
     parser.add_argument('--pass_belief_to_policy', type=boolean_argument, default=False, help='condition policy on ground-truth belief')
+    parser.add_argument('--batched_env', type=boolean_argument, default=False, help='step all processes at once in the main process (batched env) instead of in subprocesses')
     parser.add_argument('--pass_task_to_policy', type=boolean_argument, default=False, help='condition policy on ground-truth task description')
 
     # using separate encoders for the different inputs ("None" uses no encoder)
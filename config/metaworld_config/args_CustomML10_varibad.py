@@ -33,6 +33,7 @@ def get_args(rest_args):
     parser.add_argument('--pass_latent_to_policy', type=boolean_argument, default=True, help='condition policy on VAE latent')
     parser.add_argument('--pass_belief_to_policy', type=boolean_argument, default=False, help='condition policy on ground-truth belief')
     parser.add_argument('--pass_task_to_policy', type=boolean_argument, default=False, help='condition policy on ground-truth task description')
+    parser.add_argument('--fold_task_into_step', type=boolean_argument, default=False, help='envs send task / belief along with each step, instead of extra round trips to all processes')
 
     # using separate encoders for the different inputs ("None" uses no encoder)
     parser.add_argument('--policy_state_embedding_dim', type=int, default=128)
@@ -103,6 +104,22 @@ def get_args(rest_args):
                         help='how many frames to pre-collect before training begins (useful to fill VAE buffer)')
     parser.add_argument('--vae_buffer_add_thresh', type=float, default=1,
                         help='probability of adding a new trajectory to buffer')
+    parser.add_argument('--vae_buffer_dir', type=str, default=None,
+                        help='keep the VAE buffer in memory-mapped files in this folder (re-used across runs); None keeps it in RAM')
+    parser.add_argument('--vae_buffer_flush_interval', type=float, default=60,
+                        help='seconds between flushes of the memory-mapped VAE buffer to disk (it is also flushed when saving the models)')
+    parser.add_argument('--vae_prefetch_batches', type=int, default=0,
+                        help='how many VAE mini-batches to sample ahead on a background thread (0 samples synchronously)')
+    parser.add_argument('--encoder_staleness', type=int, default=None,
+                        help='re-use the running encodings until the VAE was updated this many times; None re-encodes every iteration')
+    parser.add_argument('--vae_pack_sequences', type=boolean_argument, default=False,
+                        help='encode VAE batches as packed sequences (skips the zero-padding of shorter trajectories); not with --tbptt_stepsize')
+    parser.add_argument('--vae_decode_chunk_size', type=int, default=None,
+                        help='decode this many ELBO terms at a time (saves memory for long trajectories); None decodes all at once')
+    parser.add_argument('--vae_train_in_background', type=boolean_argument, default=False,
+                        help='update the VAE continuously on a background thread, overlapping with the rollouts')
+    parser.add_argument('--vae_publish_interval', type=int, default=10,
+                        help='with vae_train_in_background, how many VAE updates between syncing the rollout encoder')
     parser.add_argument('--vae_batch_num_trajs', type=int, default=10,
                         help='how many trajectories to use for VAE update')
     parser.add_argument('--tbptt_stepsize', type=int, default=None,
@@ -182,9 +199,12 @@ def get_args(rest_args):
     parser.add_argument('--log_interval', type=int, default=25, help='log interval, one log per n updates')
     parser.add_argument('--save_interval', type=int, default=500, help='save interval, one save per n updates')
     parser.add_argument('--save_intermediate_models', type=boolean_argument, default=False, help='save all models')
+    parser.add_argument('--keep_last_models', type=int, default=None, help='only keep the last n intermediate models (None keeps all)')
     parser.add_argument('--eval_interval', type=int, default=25, help='eval interval, one eval per n updates')
     parser.add_argument('--vis_interval', type=int, default=500, help='visualisation interval, one eval per n updates')
     parser.add_argument('--results_log_dir', default=None, help='directory to save results (None uses ./logs)')
+    parser.add_argument('--time_env_workers', type=boolean_argument, default=False,
+                        help='have the env workers time their steps, for the worker idle fraction / step duration in the throughput metrics')
 
     # general settings
     parser.add_argument('--seed',  nargs='+', type=int, default=[73])
@@ -1,4 +1,6 @@
+import multiprocessing
 import os
+import random
 import time
 
 import gym
@@ -17,8 +19,17 @@ from algorithms.custom_storage import CustomOnlineStorage, BiHemOnlineStorage
 from utils import helpers as utl
 from utils.custom_helpers import get_args_from_config, freeze_parameters
 from utils.custom_logger import CustomLogger
-from environments.custom_env_utils import prepare_parallel_envs, prepare_base_envs
-from environments.custom_metaworld_benchmark import ML3
+from utils.quantile_sketch import QuantileSketch
+from utils.throughput_metrics import ThroughputMetrics
+from utils.memory_report import storage_memory, projected_latent_memory, latent_tensors, graph_memory, \
+    recurrent_encoders, estimate_graph_memory, model_memory, process_memory, report_totals, format_memory_report
+from environments.custom_env_utils import prepare_parallel_envs, prepare_base_envs, prepare_synthetic_envs
+
+try:
+    from environments.custom_metaworld_benchmark import ML3
+except ImportError:
+    # metaworld is not installed, only the synthetic envs can be used (--synthetic_env)
+    ML3 = None
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
@@ -53,11 +64,7 @@ class ContinualLearner:
         self.normalise_rewards = normalise_rewards
 
         ## initialise the envs
-        self.raw_train_envs = prepare_base_envs(
-            task_names, 
-            benchmark=ML3(),
-            task_set = self.args.task_set,#'test', # we train on the test set of ML3 for bicameral
-            randomization=randomization)
+        self.raw_train_envs = self.make_base_envs(task_names, randomization=randomization)
 
         ## get unique task names in order:
         _, idx = np.unique(task_names, return_index=True)
@@ -113,15 +120,98 @@ class ContinualLearner:
                 )
         
         self.quantiles = quantiles
+        ## size of the quantile sketches for the reward / gating value quantiles
+        self.quantile_sketch_size = getattr(self.args, 'quantile_sketch_size', 200)
         self.log_dir = log_dir
+
+        ## resume from a training state checkpoint (e.g. if the run was pre-empted), logging into the folder of that run
+        self.start_eps = 0
+        training_state, run_dir, purge_step = None, None, None
+        if getattr(self.args, 'resume_from', None) is not None:
+            training_state_path = self.args.resume_from
+            if os.path.isdir(training_state_path):
+                training_state_path = os.path.join(training_state_path, 'training_state.pt')
+            print(f"resuming training from {training_state_path}")
+            training_state = torch.load(training_state_path, map_location=device)
+            run_dir = os.path.dirname(os.path.abspath(training_state_path))
+            ## (the first update after the checkpoint is logged at the checkpoint's frame + num_processes * rollout_len)
+            purge_step = training_state['eps'] * self.num_processes * self.rollout_len + 1
+
         self.logger = CustomLogger(
             self.log_dir, 
             self.quantiles, 
             args = self.args, 
             left_args = self.left_init_args,
-            right_args = self.right_init_args)
+            right_args = self.right_init_args,
+            run_dir = run_dir,
+            purge_step = purge_step)
         self.eval_every = eval_every
 
+        if training_state is not None:
+            self.load_training_state(training_state)
+
+        ## evaluate in a separate process, on snapshots of the agent (so training doesn't wait for the evaluation)
+        self.background_eval = getattr(self.args, 'background_eval', False)
+        if self.background_eval:
+            self.eval_snapshot_dir = os.path.join(self.logger.log_dir, 'eval_snapshots')
+            os.makedirs(self.eval_snapshot_dir, exist_ok=True)
+            self.eval_process = multiprocessing.get_context('spawn').Process(
+                target=run_background_evaluation,
+                args=(self.eval_snapshot_dir, self.logger.log_dir, seed, task_names, num_processes, rollout_len,
+                      normalise_rewards, gamma, quantiles, self.args)
+            )
+            self.eval_process.start()
+
+        ## log the memory used by the storage / models / env workers every n updates (it's always printed at the start and after the first update)
+        self.memory_report_every = getattr(self.args, 'memory_report_every', 0)
+        print(format_memory_report(self.memory_report()))
+
+        ## log throughput / latency metrics (fps, policy / encoder / update / eval durations, worker idle time) every n updates (0: never)
+        self.metrics_every = getattr(self.args, 'metrics_every', 0)
+        ## (the env workers only time their steps if asked to)
+        self.metrics = ThroughputMetrics(self.envs, time_workers=(self.metrics_every > 0) and getattr(self.args, 'time_env_workers', False))
+
+    def memory_report(self):
+        """
+        Bytes held by the rollout storage (incl. the latents when full, and the autograd graph they hold on to
+        after recomputing the embeddings), the models (incl. optimiser state) and the resident memory of the processes
+        """
+        report = {}
+        if self.storage is not None:
+            report['storage'] = storage_memory(self.storage)
+            report['storage latents (full)'] = projected_latent_memory(self.storage)
+            num_nodes, graph_bytes = graph_memory(
+                latent_tensors(self.storage), exclude=list(self.agent.actor_critic.parameters()))
+            if graph_bytes is not None:
+                report['autograd graph'] = {f'saved tensors ({num_nodes} nodes)': graph_bytes}
+            else:
+                ## older torch (or no graph yet): estimate it from the sizes of the encoders
+                report['autograd graph'] = {f'saved tensors ({num_nodes} nodes, estimate)': estimate_graph_memory(
+                    recurrent_encoders(self.agent.actor_critic), self.rollout_len, self.num_processes)}
+        if self.agent is not None:
+            report['model'] = model_memory(self.agent.actor_critic, self.agent.optimiser)
+        report['processes (rss)'] = process_memory(self.envs)
+        return report
+
+    def make_base_envs(self, task_names, randomization = 'random_init_fixed20'):
+        """
+        Base envs for the continual env: metaworld tasks, or synthetic stand-ins with --synthetic_env
+        """
+        if getattr(self.args, 'synthetic_env', False):
+            return prepare_synthetic_envs(
+                task_names,
+                obs_dim=getattr(self.args, 'synthetic_obs_dim', 39),
+                action_dim=getattr(self.args, 'synthetic_action_dim', 4),
+                max_episode_steps=getattr(self.args, 'synthetic_episode_len', 500),
+                step_latency=getattr(self.args, 'synthetic_step_latency', 0.),
+                seed=self.seed)
+
+        return prepare_base_envs(
+            task_names,
+            benchmark=ML3(),
+            task_set = self.args.task_set,#'test', # we train on the test set of ML3 for bicameral
+            randomization=randomization)
+
     def init_agent(self, args):
         ## update if relevant
         left_init_args = None
@@ -254,8 +344,17 @@ class ContinualLearner:
     
     def train(self):
         """ Main Training loop """
+        try:
+            self.run_training()
+        except BaseException:
+            ## don't leave the evaluation process behind if training fails (the run would never exit)
+            if self.background_eval:
+                self.eval_process.terminate()
+            raise
+
+    def run_training(self):
         start_time = time.time() 
-        eps = 0
+        eps = self.start_eps
 
         # steps limit is parameter for whole continual env
         while self.envs.get_env_attr('cur_step') < self.envs.get_env_attr('steps_limit'):
@@ -263,9 +362,10 @@ class ContinualLearner:
             step = 0
             obs = self.envs.reset() # we reset all at once as metaworld is time limited
             current_task = self.envs.get_env_attr("cur_seq_idx")
-            episode_reward = []
-            successes = []
-            gating_values = []
+            ## rewards / gating values are summarised as we go (quantile sketches), not stored
+            episode_reward = QuantileSketch(self.quantile_sketch_size)
+            successes = torch.zeros(self.num_processes)
+            gating_values = QuantileSketch(self.quantile_sketch_size)
             done = [False for _ in range(self.num_processes)]
 
             if self.args.algorithm != 'random':
@@ -289,30 +389,35 @@ class ContinualLearner:
                         self.storage.latent.append(latent)
 
             while not all(done):
+                policy_start = time.perf_counter()
                 with torch.no_grad():
                     if self.args.algorithm == 'bicameral':
                         ## TODO: don't like unsqueeze obs but ok for now
                         (value, left_value, right_value), action, gate_values = \
                             self.agent.act(obs.unsqueeze(0), latent, None, None)
                         ## collect gating values
-                        gating_values.append(gate_values[0].detach())
+                        gating_values.update(gate_values[0])
                     elif self.args.algorithm == 'random':
                         action = torch.tensor(
                             np.array(
                                 [self.envs.action_space.sample() for _ in range(self.num_processes)]
                             )
                         )
-                        gating_values.append(torch.tensor(0.))
+                        gating_values.update(0.)
                     elif self.args.algorithm == 'right_only':
                         value, action = self.agent.act(obs, latent, None, None, deterministic=True)
                         ## dummy gating value
-                        gating_values.append(torch.tensor(0.))
+                        gating_values.update(0.)
                     else:
                         value, action = self.agent.act(obs, latent, None, None)
                         ## dummy gating value
-                        gating_values.append(torch.tensor(0.))
+                        gating_values.update(0.)
+                self.metrics.add_duration('policy_forward', policy_start)
 
+                env_start = time.perf_counter()
                 next_obs, (rew_raw, rew_normalised), done, info = self.envs.step(action)
+                self.metrics.add_duration('env_step', env_start)
+                self.metrics.add_frames(self.num_processes)
                 assert all(done) == any(done), "Metaworld envs should all end simultaneously"
                 
                 ## calculate value errors for left/right
@@ -326,10 +431,11 @@ class ContinualLearner:
                 masks_done = torch.FloatTensor([[0.0] if _done else [1.0] for _done in done]).to(device)
 
                 ## combine all rewards
-                episode_reward.append(rew_raw)
+                episode_reward.update(rew_raw)
                 # if we succeed at all then the task is successful
-                successes.append(torch.tensor([i['success'] for i in info]))
+                successes = torch.max(successes, torch.tensor([float(i['success']) for i in info]))
                 if self.args.algorithm != 'random':
+                    encoder_start = time.perf_counter()
                     with torch.no_grad():
                         if self.args.algorithm == 'bicameral':
                             latent, hidden_state = self.agent.get_latent(
@@ -341,6 +447,7 @@ class ContinualLearner:
                             latent, hidden_state = self.agent.get_latent(
                                 action, next_obs, rew_raw, hidden_state, return_prior = False
                             )
+                    self.metrics.add_duration('encoder_update', encoder_start)
                     
                     self.storage.next_state[step] = next_obs.clone()
 
@@ -418,13 +525,16 @@ class ContinualLearner:
                 )
 
             ## Update
+            update_start = time.perf_counter()
             if self.args.algorithm == 'bicameral':
                 value_loss_epoch, action_loss_epoch, dist_entropy_epoch, gating_penalty_epoch, loss_epoch = \
                     self.agent.update(self.storage)
+                self.metrics.add_duration('update', update_start)
             elif self.args.algorithm == 'left_only':
                 value_loss_epoch, action_loss_epoch, dist_entropy_epoch, loss_epoch = \
                     self.agent.update(self.storage)
                 gating_penalty_epoch = np.nan
+                self.metrics.add_duration('update', update_start)
             else:
                 value_loss_epoch, action_loss_epoch, dist_entropy_epoch, gating_penalty_epoch, loss_epoch = \
                     np.nan, np.nan, np.nan, np.nan, np.nan
@@ -439,9 +549,9 @@ class ContinualLearner:
             self.logger.add_tensorboard('losses/total_loss', loss_epoch, frames)
             
             # log training results
-            task_rewards = torch.stack(episode_reward).cpu()
-            task_successes = torch.stack(successes).max(0)[0].mean()
-            task_gating_values = torch.stack(gating_values).cpu()
+            task_rewards = episode_reward
+            task_successes = successes.mean()
+            task_gating_values = gating_values
             self.logger.add_tensorboard('train_results/episode_rewards',task_rewards.mean(), frames)
             self.logger.add_tensorboard('train_results/episode_success',task_successes, frames)
             self.logger.add_tensorboard('train_results/left_gating_values', task_gating_values.mean(), frames)
@@ -459,24 +569,38 @@ class ContinualLearner:
                 frames,
                 'train')
             
+            ## (before clearing the storage, while the latents still hold the graph of the update)
+            if (eps == self.start_eps) or ((self.memory_report_every > 0) and ((eps+1) % self.memory_report_every == 0)):
+                memory_report = self.memory_report()
+                if eps == self.start_eps:
+                    print(format_memory_report(memory_report))
+                for section, total in report_totals(memory_report).items():
+                    self.logger.add_tensorboard(f'memory/{section}', total / 2 ** 20, frames)
+
             if self.storage is not None:
                 # clears out old data
                 self.storage.after_update()
 
             if (eps+1) % self.eval_every == 0:
 
-                if self.args.algorithm not in ['right_only', 'random']:
+                eval_start = time.perf_counter()
+                if self.background_eval:
+                    ## hand a snapshot of the agent over to the evaluation process
+                    self.save_eval_snapshot(current_task, frames)
+
+                elif self.args.algorithm not in ['right_only', 'random']:
                     print(f"Running eval on full model at {eps + 1}")
                     ## run eval on full network
                     self.evaluate(current_task, frames, 'test')
                     
 
-                if self.args.algorithm == 'bicameral':
+                if (self.args.algorithm == 'bicameral') and (not self.background_eval):
                     print(f"Running eval on left only at {eps + 1}")
                     ## run eval on left network
                     self.evaluate(current_task, frames, 'left')
                     ## run eval on right network
                     # self.evaluate(current_task, frames, 'right')
+                self.metrics.add_duration('eval', eval_start)
 
                 if self.args.algorithm != 'random':
                     ## save the network
@@ -486,16 +610,130 @@ class ContinualLearner:
             if (self.args.use_gating_schedule) and ((eps+1) % self.args.step_gate_every == 0):
                  self.agent.actor_critic.gating_network.step()
 
+            ## save everything needed to resume training from here
+            if (eps+1) % self.eval_every == 0:
+                self.save_training_state(eps+1)
+
+            if (self.metrics_every > 0) and ((eps+1) % self.metrics_every == 0):
+                self.metrics.log(self.logger.add_tensorboard, frames)
+
             eps+=1
         end_time = time.time()
         print(f"completed in {end_time - start_time}")
         self.envs.close()
+        if self.background_eval:
+            self.finish_background_eval()
+        self.logger.close()
+
+    def save_training_state(self, eps):
+        """
+        Saves the full training state (position in the task sequence, networks, optimiser,
+        reward normalisation, gating schedule and RNG states) after eps updates.
+        Written in the background, so training doesn't wait for it.
+        """
+        state = {
+            'eps': eps,
+            'cur_step': self.envs.get_env_attr('cur_step'),
+            'cur_seq_idx': self.envs.get_env_attr('cur_seq_idx'),
+            'ret_rms': self.envs.venv.ret_rms if self.normalise_rewards else None,
+            'rng_states': {
+                'python': random.getstate(),
+                'numpy': np.random.get_state(),
+                'torch': torch.get_rng_state(),
+                'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+            },
+        }
+        if self.agent is not None:
+            state['actor_critic'] = self.agent.actor_critic.state_dict()
+            state['optimiser'] = self.agent.optimiser.state_dict()
+            ## the step gating schedule is not part of the state dict
+            if self.args.algorithm == 'bicameral' and self.args.use_gating_schedule:
+                state['gating_right'] = self.agent.actor_critic.gating_network.right
+        ## so the results on disk match the saved state when resuming
+        self.logger.flush()
+        self.logger.checkpoint_writer.save(state, os.path.join(self.logger.log_dir, 'training_state.pt'))
+
+    def load_training_state(self, state):
+        """
+        Restores a training state saved by save_training_state, and drops what was logged after it from the run folder:
+        the results (they are logged again), and the evaluation snapshots taken after it.
+        Snapshots taken before it that were not evaluated yet are evaluated again, and their results dropped as well.
+        (Results that were still buffered in memory when the run stopped are lost.)
+        """
+        self.start_eps = state['eps']
+        ## (ContinualEnv can be wrapped)
+        self.envs.set_env_attr('cur_step', state['cur_step'], unwrapped=True)
+        self.envs.set_env_attr('cur_seq_idx', state['cur_seq_idx'], unwrapped=True)
+        if self.normalise_rewards:
+            self.envs.venv.ret_rms = state['ret_rms']
+
+        if self.agent is not None:
+            self.agent.actor_critic.load_state_dict(state['actor_critic'])
+            self.agent.optimiser.load_state_dict(state['optimiser'])
+            if 'gating_right' in state:
+                self.agent.actor_critic.gating_network.right = state['gating_right']
+                self.agent.actor_critic.gating_network.left = 1 - state['gating_right']
+
+        random.setstate(state['rng_states']['python'])
+        np.random.set_state(state['rng_states']['numpy'])
+        torch.set_rng_state(state['rng_states']['torch'].cpu())
+        if state['rng_states']['cuda'] is not None and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all([s.cpu() for s in state['rng_states']['cuda']])
+
+        frames = state['eps'] * self.num_processes * self.rollout_len
+        eval_frames = frames
+        eval_snapshot_dir = os.path.join(self.logger.log_dir, 'eval_snapshots')
+        if os.path.exists(eval_snapshot_dir):
+            if os.path.exists(os.path.join(eval_snapshot_dir, 'done')):
+                os.remove(os.path.join(eval_snapshot_dir, 'done'))
+            for snapshot_file in sorted(f for f in os.listdir(eval_snapshot_dir) if f.endswith('.pt')):
+                snapshot_frames = int(snapshot_file[len('snapshot_'):-len('.pt')])
+                if snapshot_frames > frames:
+                    os.remove(os.path.join(eval_snapshot_dir, snapshot_file))
+                else:
+                    eval_frames = min(eval_frames, snapshot_frames - 1)
+        self.logger.drop_results_after(frames, csvs=['train'])
+        self.logger.drop_results_after(eval_frames, csvs=[c for c in self.logger.result_paths if c != 'train'])
+
+    def save_eval_snapshot(self, current_task, frames):
+        """ Drops a snapshot of the agent (stamped with the current frame) for the evaluation process """
+        eval_runs = []
+        if self.args.algorithm not in ['right_only', 'random']:
+            eval_runs.append('test')
+        if self.args.algorithm == 'bicameral':
+            eval_runs.append('left')
+        if len(eval_runs) == 0:
+            return
+
+        ## only the weights, the evaluation process rebuilds the agent around them
+        snapshot = {
+            'actor_critic': self.agent.actor_critic.state_dict(),
+            'current_task': current_task,
+            'frames': frames,
+            'eval_runs': eval_runs,
+        }
+        ## the step gating schedule is not part of the state dict
+        if self.args.algorithm == 'bicameral' and self.args.use_gating_schedule:
+            snapshot['gating_right'] = self.agent.actor_critic.gating_network.right
+        ## zero-padded so that the snapshots are evaluated in order
+        self.logger.checkpoint_writer.save(snapshot, os.path.join(self.eval_snapshot_dir, f'snapshot_{frames:012d}.pt'))
+
+    def finish_background_eval(self):
+        """ Waits until the evaluation process has gone through all snapshots """
+        self.logger.checkpoint_writer.flush()
+        open(os.path.join(self.eval_snapshot_dir, 'done'), 'w').close()
+        print('waiting for the evaluation process to finish')
+        self.eval_process.join()
+
+    def evaluate(self, current_task, frames, eval_run, agent=None):
+
+        ## evaluate the current agent, unless given a snapshot
+        if agent is None:
+            agent = self.agent
 
-    def evaluate(self, current_task, frames, eval_run):
-        
         ## create agent
         if eval_run == 'left':
-            ac = self.agent.actor_critic.left_actor_critic
+            ac = agent.actor_critic.left_actor_critic
             eval_agent = CustomPPO(
                     actor_critic=ac,
                     value_loss_coef = self.args.value_loss_coef,
@@ -511,7 +749,7 @@ class ContinualLearner:
                     context_window=self.args.context_window
                 )
         elif eval_run == 'test':
-            eval_agent = deepcopy(self.agent)
+            eval_agent = deepcopy(agent)
         else:
             raise NotImplementedError
             eval_run = 'right'
@@ -519,11 +757,7 @@ class ContinualLearner:
 
 
         ## create eval environments
-        raw_test_envs = prepare_base_envs(
-            self.task_names, 
-            benchmark=ML3(),
-            task_set = self.args.task_set,
-        )
+        raw_test_envs = self.make_base_envs(self.task_names)
         test_envs = prepare_parallel_envs(
             envs=raw_test_envs, 
             steps_per_env=self.rollout_len,
@@ -543,9 +777,9 @@ class ContinualLearner:
 
             obs = test_envs.reset() # we reset all at once as metaworld is time limited
             current_task = test_envs.get_env_attr("cur_seq_idx")
-            episode_reward = []
-            successes = []
-            gating_values = []
+            episode_reward = QuantileSketch(self.quantile_sketch_size)
+            successes = torch.zeros(self.num_processes)
+            gating_values = QuantileSketch(self.quantile_sketch_size)
 
             done = [False for _ in range(self.num_processes)]
 
@@ -557,21 +791,21 @@ class ContinualLearner:
                     if (self.args.algorithm == 'bicameral') and (eval_run != 'left'):
                         ## TODO: don't like unsqueeze obs but ok for now
                         (_, left_value, right_value), action, gate_values = \
-                            self.agent.act(obs.unsqueeze(0), latent, None, None, deterministic=True)
+                            agent.act(obs.unsqueeze(0), latent, None, None, deterministic=True)
                         ## collect gating values
-                        gating_values.append(gate_values[0].detach())
+                        gating_values.update(gate_values[0])
                     else:
                         _, action = eval_agent.act(obs, latent, None, None, deterministic=True)
                         ## dummy gating value
-                        gating_values.append(torch.tensor(0.))
+                        gating_values.update(0.)
 
                 next_obs, (rew_raw, _), done, info = test_envs.step(action)
                 assert all(done) == any(done), "Metaworld envs should all end simultaneously"
 
                 ## combine all rewards
-                episode_reward.append(rew_raw)
+                episode_reward.update(rew_raw)
                 # if we succeed at all then the task is successful
-                successes.append(torch.tensor([i['success'] for i in info]))
+                successes = torch.max(successes, torch.tensor([float(i['success']) for i in info]))
 
                 with torch.no_grad():
                     if (self.args.algorithm == 'bicameral') and (eval_run != 'left'):
@@ -579,7 +813,7 @@ class ContinualLearner:
                             rew_raw - left_value,
                             rew_raw - right_value
                         )
-                        latent, hidden_state = self.agent.get_latent(
+                        latent, hidden_state = agent.get_latent(
                             action, next_obs, rew_raw, 
                             value_errors, gate_values, hidden_state, 
                             return_prior = False
@@ -592,9 +826,9 @@ class ContinualLearner:
                 obs = next_obs
 
             # log eval results
-            task_rewards = torch.stack(episode_reward).cpu()
-            task_successes = torch.stack(successes).max(0)[0].mean()
-            task_gating_values = torch.stack(gating_values).cpu()
+            task_rewards = episode_reward
+            task_successes = successes.mean()
+            task_gating_values = gating_values
             self.logger.add_tensorboard(f'{eval_run}/episode_rewards',task_rewards.mean(), frames)
             self.logger.add_tensorboard(f'{eval_run}/episode_success',task_successes, frames)
             self.logger.add_tensorboard(f'{eval_run}/left_gating_values', task_gating_values.mean(), frames)
@@ -666,14 +900,14 @@ class ContinualLearner:
     #         while not all(done):
     #             # with torch.no_grad():
     #             #     # be deterministic in eval
-    #             #     _, action = self.agent.act(obs, latent, None, None, deterministic = True)
+    #             #     _, action = agent.act(obs, latent, None, None, deterministic = True)
     #             with torch.no_grad():
     #                 if self.args.algorithm == 'bicameral':
-    #                     value, action, (left_gating_value, _) = self.agent.act(obs.unsqueeze(0), latent, None, None, deterministic=True)
+    #                     value, action, (left_gating_value, _) = agent.act(obs.unsqueeze(0), latent, None, None, deterministic=True)
     #                     ## collect gating values
     #                     gating_values.append(left_gating_value.detach())
     #                 else:
-    #                     value, action = self.agent.act(obs, latent, None, None, deterministic=True)
+    #                     value, action = agent.act(obs, latent, None, None, deterministic=True)
     #                     ## dummy gating value
     #                     gating_values.append(torch.tensor(0.))
                 
@@ -688,7 +922,7 @@ class ContinualLearner:
     #             successes.append(torch.tensor([i['success'] for i in info]))
 
     #             with torch.no_grad():
-    #                 latent, hidden_state = self.agent.get_latent(
+    #                 latent, hidden_state = agent.get_latent(
     #                 action, next_obs, rew_raw, hidden_state, return_prior = False
     #                 )
 
@@ -716,27 +950,96 @@ class ContinualLearner:
     #     test_envs.close()
 
     def log_results(self, task_name, rewards, successes, gating_values, processes, current_task, frame, csv_to_do):
+        """ rewards and gating_values are the QuantileSketches of the episode """
 
         ## log csv also
-        reward_quantiles = torch.quantile(
-            rewards,
-            torch.tensor(self.quantiles)
-        ).numpy().tolist()
+        reward_quantiles = rewards.quantiles(self.quantiles)
 
-        gating_value_quantiles = torch.quantile(
-            gating_values,
-            torch.tensor(self.quantiles)
-        ).numpy().tolist()
+        gating_value_quantiles = gating_values.quantiles(self.quantiles)
 
         to_write = (
             current_task,
             task_name,
             successes.numpy(),
             processes, # record number tasks per env
-            rewards.mean().numpy(),
+            rewards.mean(),
             *reward_quantiles,
             *gating_value_quantiles,
             frame
         )
         self.logger.add_csv(to_write, csv_to_do)
 
+
+class BackgroundEvaluator(ContinualLearner):
+    """
+    Runs ContinualLearner.evaluate in a separate process, on the agent snapshots that the learner drops
+    into snapshot_dir (stamped with the frame they were taken at), and writes to the same csvs / tensorboard logs.
+    Stops once the learner marks the run as done and all snapshots have been evaluated, or if the learner is gone.
+    """
+    def __init__(self, snapshot_dir, log_dir, seed, task_names, num_processes, rollout_len,
+                 normalise_rewards, gamma, quantiles, args):
+
+        self.args = args
+
+        utl.seed(seed, False)
+        self.seed = seed
+
+        self.gamma = gamma
+        self.normalise_rewards = normalise_rewards
+        self.num_processes = num_processes
+        self.rollout_len = rollout_len
+        self.quantiles = quantiles
+        self.quantile_sketch_size = getattr(self.args, 'quantile_sketch_size', 200)
+
+        ## get unique task names in order:
+        _, idx = np.unique(task_names, return_index=True)
+        self.task_names = [task_names[i] for i in np.sort(idx)]
+        self.env_id_to_name = {(i+1):task for i, task in enumerate(self.task_names)}
+
+        self.snapshot_dir = snapshot_dir
+        self.logger = CustomLogger(log_dir, self.quantiles, args = self.args, run_dir = log_dir)
+
+        ## if the learner dies without marking the run as done, we get re-parented
+        self.parent_pid = os.getppid()
+
+        ## the snapshots only hold the weights: build an agent to load them into
+        ## (init_agent takes the observation / action spaces from the envs)
+        self.envs = prepare_parallel_envs(
+            envs=self.make_base_envs(self.task_names[:1]),
+            steps_per_env=self.rollout_len,
+            num_processes=1,
+            seed=self.seed,
+            gamma=self.gamma,
+            normalise_rew=self.normalise_rewards,
+            device=device,
+            rank_offset=2*self.num_processes+1 # the eval envs use num_processes+1 onwards
+        )
+        self.agent, _, _ = self.init_agent(self.args)
+        self.envs.close()
+        self.envs = None
+
+    def run(self):
+        while os.getppid() == self.parent_pid:
+            snapshots = sorted([f for f in os.listdir(self.snapshot_dir) if f.endswith('.pt')])
+            if len(snapshots) == 0:
+                if os.path.exists(os.path.join(self.snapshot_dir, 'done')):
+                    break
+                time.sleep(1)
+                continue
+
+            snapshot_path = os.path.join(self.snapshot_dir, snapshots[0])
+            snapshot = torch.load(snapshot_path, map_location=device)
+            self.agent.actor_critic.load_state_dict(snapshot['actor_critic'])
+            if 'gating_right' in snapshot:
+                self.agent.actor_critic.gating_network.right = snapshot['gating_right']
+                self.agent.actor_critic.gating_network.left = 1 - snapshot['gating_right']
+            for eval_run in snapshot['eval_runs']:
+                print(f"Running {eval_run} eval at frame {snapshot['frames']}")
+                self.evaluate(snapshot['current_task'], snapshot['frames'], eval_run)
+            os.remove(snapshot_path)
+
+        self.logger.close()
+
+
+def run_background_evaluation(*args):
+    BackgroundEvaluator(*args).run()
@@ -4,12 +4,18 @@ Based on https://github.com/ikostrikov/pytorch-a2c-ppo-acktr
 import gym
 import torch
 
-from continualworld_utils.wrappers import RandomizationWrapper
-from continualworld_utils.utils import get_subtasks
-from continualworld_utils.constants import MT50
 from environments.env_utils.vec_env import VecEnvWrapper
 from environments.env_utils.vec_env.subproc_vec_env import SubprocVecEnv
 from environments.env_utils.vec_env.custom_vec_normalize import CustomVecNormalize
+from environments.metaworld_envs.synthetic_env import SyntheticMetaWorldEnv
+
+try:
+    from continualworld_utils.wrappers import RandomizationWrapper
+    from continualworld_utils.utils import get_subtasks
+    from continualworld_utils.constants import MT50
+except ImportError:
+    # metaworld is not installed, only the synthetic envs can be used
+    MT50 = None
 
 
 def make_continual_env(env_id, seed, rank, **kwargs):
@@ -42,6 +48,24 @@ def prepare_base_envs(task_names, benchmark = MT50, task_set = 'train', randomiz
         envs.append(env)
     return envs
 
+def prepare_synthetic_envs(task_names, obs_dim=39, action_dim=4, max_episode_steps=500, step_latency=0., seed=0):
+    """
+    Same as prepare_base_envs, but with synthetic MetaWorld-shaped envs (no MuJoCo needed)
+    task_names: any list of task names, each name gets its own (deterministic) dynamics and goals
+    step_latency: seconds each env step takes, to mimic the simulation cost
+    """
+    envs = []
+    for task_name in task_names:
+        env = SyntheticMetaWorldEnv(
+            task_name,
+            obs_dim=obs_dim,
+            action_dim=action_dim,
+            max_episode_steps=max_episode_steps,
+            step_latency=step_latency,
+            seed=seed)
+        envs.append(env)
+    return envs
+
 def prepare_parallel_envs(envs, steps_per_env, num_processes, seed, gamma, normalise_rew, device,rank_offset = 0):
     subproc_envs = SubprocVecEnv(
         [make_continual_env(
@@ -64,7 +88,8 @@ class PyTorchVecEnvCont(VecEnvWrapper):
         self.device = device
   
     def step_async(self, actions):
-        actions = actions.squeeze().cpu().numpy()
+        # (not squeeze, which would also drop the process dim with a single process)
+        actions = actions.reshape(self.num_envs, *self.action_space.shape).cpu().numpy()
         self.venv.step_async(actions)
 
     def step_wait(self):
@@ -82,10 +107,11 @@ class PyTorchVecEnvCont(VecEnvWrapper):
             reward = torch.from_numpy(reward).unsqueeze(dim=1).reshape(1, -1, 1).float().to(self.device)
         return state, reward, done, info
     
-    def reset(self):
+    def reset(self, indices=None):
         # if task is not None:
         #     assert isinstance(task, list)
-        state = self.venv.reset()
+        # (with indices, only these envs are reset and only their states are returned)
+        state = self.venv.reset(indices=indices)
         ## permute state to have dimensions T X B X D .permute(1,0,2)
         if isinstance(state, list):
             # .permute(1, 0, 2)
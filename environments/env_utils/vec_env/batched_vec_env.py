@@ -0,0 +1,123 @@
+import torch
+
+from . import VecEnv
+from environments.wrappers import VariBadWrapper
+
+
+class BatchedVecEnv(VecEnv):
+    """
+    Base class for envs that step all processes at once in the main process, with the env state of all
+    processes in (num_processes, ...) tensors - instead of one env per subprocess (SubprocVecEnv).
+    Implements the VariBadWrapper BAMDP logic (several episodes per task, done info in the state,
+    resetting the MDP in-between episodes) and the time limit for all processes at once.
+
+    Subclasses keep the states in self.state and implement
+     - reset_task(indices, task): sample new tasks (or set the given ones) for the envs given by indices
+     - reset_state(indices): reset the MDPs of the envs given by indices to their start state
+     - transition(actions): step all MDPs, returns the rewards and a list of info dicts
+     - get_task() / get_belief()
+    """
+
+    def __init__(self, env, num_processes, episodes_per_task, seed=None, rank_offset=0, add_done_info=None,
+                 time_limit=False):
+        """
+        :param env: a single (unwrapped) env, to get the spaces and env attributes from
+        :param time_limit: the env is registered with a time limit (mark the last transitions like TimeLimitMask)
+        """
+
+        self.env = VariBadWrapper(env=env, episodes_per_task=episodes_per_task, add_done_info=add_done_info)
+        VecEnv.__init__(self, num_processes, self.env.observation_space, self.env.action_space)
+
+        self.episodes_per_task = episodes_per_task
+        self.add_done_info = self.env.add_done_info
+        self._max_episode_steps = env._max_episode_steps
+        self.time_limit = time_limit
+
+        self.generator = torch.Generator()
+        if seed is not None:
+            self.generator.manual_seed(seed + rank_offset)
+        else:
+            self.generator.seed()
+
+        self.step_count = torch.zeros(num_processes, dtype=torch.long)
+        self.episode_count = torch.zeros(num_processes, dtype=torch.long)
+        self.step_count_bamdp = torch.zeros(num_processes, dtype=torch.long)
+
+        self.state = None
+        self.actions = None
+
+    def reset_task(self, indices, task=None):
+        raise NotImplementedError
+
+    def reset_state(self, indices):
+        raise NotImplementedError
+
+    def transition(self, actions):
+        raise NotImplementedError
+
+    def obs(self, done_mdp, indices=None):
+        state = self.state if indices is None else self.state[indices]
+        if self.add_done_info:
+            state = torch.cat((state, done_mdp.to(state.dtype).view(-1, 1)), dim=1)
+        # (copy, so the observations don't change with the env state)
+        return state.numpy().copy()
+
+    def reset(self, task=None, indices=None):
+        """
+        Resets the BAMDPs (new task, start state) of all envs or the ones given by indices.
+        :param task: list with one task per env that is reset
+        """
+        indices = torch.arange(self.num_envs) if indices is None else torch.as_tensor(indices, dtype=torch.long)
+        self.reset_task(indices, task)
+        self.reset_state(indices)
+        self.step_count[indices] = 0
+        self.episode_count[indices] = 0
+        self.step_count_bamdp[indices] = 0
+        return self.obs(torch.zeros(len(indices), dtype=torch.bool), indices)
+
+    def reset_mdp(self):
+        """ Resets the underlying MDPs only (*not* the tasks). """
+        self.reset_state(torch.arange(self.num_envs))
+        self.step_count[:] = 0
+        return self.obs(torch.zeros(self.num_envs, dtype=torch.bool))
+
+    def step_async(self, actions):
+        self.actions = torch.as_tensor(actions)
+
+    def step_wait(self):
+
+        reward, infos = self.transition(self.actions)
+
+        # check if maximum step limit is reached
+        self.step_count += 1
+        done_mdp = self.step_count >= self._max_episode_steps
+        if self.time_limit:
+            for i in torch.nonzero(done_mdp).view(-1).tolist():
+                infos[i]['TimeLimit.truncated'] = True
+                infos[i]['bad_transition'] = True
+
+        # only say "done" when we collected enough episodes in this task
+        self.step_count_bamdp += 1
+        self.episode_count += done_mdp.long()
+        done = done_mdp & (self.episode_count == self.episodes_per_task)
+        for i in range(self.num_envs):
+            infos[i]['done_mdp'] = bool(done_mdp[i])
+
+        obs = self.obs(done_mdp)
+
+        # reset the MDPs that are done (if the BAMDP isn't)
+        reset_indices = torch.nonzero(done_mdp & ~done).view(-1)
+        if len(reset_indices) > 0:
+            self.reset_state(reset_indices)
+            self.step_count[reset_indices] = 0
+            start_states = self.obs(torch.zeros(len(reset_indices), dtype=torch.bool), reset_indices)
+            for i, start_state in zip(reset_indices.tolist(), start_states):
+                infos[i]['start_state'] = start_state
+
+        return obs, reward.numpy(), done.numpy(), infos
+
+    def get_env_attr(self, attr):
+        return getattr(self.env.unwrapped, attr)
+
+    def get_images(self):
+        raise NotImplementedError(f'{self.__class__.__name__} does not render')
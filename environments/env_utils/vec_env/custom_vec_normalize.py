@@ -72,16 +72,15 @@ class CustomVecNormalize(VecEnvWrapper):
     #         obs = self.venv.remotes[index].recv()
     #     return obs
 
-    def reset(self, index=None, task=None):
+    def reset(self, index=None, task=None, indices=None):
         self.ret = np.zeros(self.num_envs)
-        if index is None:
+        if indices is not None:
+            # batched partial reset
+            obs = self.venv.reset(indices=indices)
+        elif index is None:
             obs = self.venv.reset()
         else:
-            try:
-                self.venv.remotes[index].send(('reset', None))
-                obs = self.venv.remotes[index].recv()
-            except AttributeError:
-                obs = self.venv.envs[index].reset()
+            obs = self.venv.reset(indices=[index])[0]
         return obs
 
     def __getattr__(self, attr):
@@ -64,13 +64,25 @@ class DummyVecEnv(VecEnv):
         return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
                 self.buf_infos.copy())
 
-    def reset_mdp(self):
+    def reset_mdp(self, index=None):
+        if index is not None:
+            # only reset this env, and only return its observation
+            obs = self.envs[index].reset_mdp()
+            self._save_obs(index, obs)
+            return obs
         for e in range(self.num_envs):
             obs = self.envs[e].reset_mdp()
             self._save_obs(e, obs)
         return self._obs_from_buf()
 
-    def reset(self, task=None):
+    def reset(self, task=None, indices=None):
+        if indices is not None:
+            # only reset these envs (task[i] is the task of env indices[i]), and only return their observations
+            obs = []
+            for i, e in enumerate(indices):
+                obs.append(self.envs[e].reset(task=task[i]) if task is not None else self.envs[e].reset())
+                self._save_obs(e, obs[-1])
+            return np.stack(obs)
         for e in range(self.num_envs):
             if task is not None:
                 obs = self.envs[e].reset(task=task[e])
@@ -112,3 +124,7 @@ class DummyVecEnv(VecEnv):
 
     def get_env_attr(self, attr):
         return getattr(self.envs[0].unwrapped, attr)
+
+    def set_env_attr(self, attr, value, unwrapped=False):
+        for env in self.envs:
+            setattr(env.unwrapped if unwrapped else env, attr, value)
@@ -1,6 +1,7 @@
 """
 Taken from https://github.com/openai/baselines
 """
+import time
 from multiprocessing import Process, Pipe
 
 import numpy as np
@@ -8,21 +9,44 @@ import numpy as np
 from . import VecEnv, CloudpickleWrapper
 
 
+def get_extras(env, extras):
+    return [env.get_task() if extra == 'task' else env.get_belief() for extra in extras]
+
+
 def worker(remote, parent_remote, env_fn_wrapper):
     parent_remote.close()
     env = env_fn_wrapper.x()
+    # task / belief to send along with every step / reset reply (see SubprocVecEnv.set_step_extras)
+    extras = []
+    # total duration and number of the env steps since the last pop_timing, without the communication
+    # (see SubprocVecEnv.set_timing); step_time is None if not timed
+    step_time, num_steps = None, 0
     try:
         while True:
             cmd, data = remote.recv()
             if cmd == 'step':
+                if step_time is not None:
+                    start = time.perf_counter()
                 ob, reward, done, info = env.step(data)
-                remote.send((ob, reward, done, info))
+                if step_time is not None:
+                    step_time += time.perf_counter() - start
+                    num_steps += 1
+                if extras:
+                    remote.send((ob, reward, done, info, get_extras(env, extras)))
+                else:
+                    remote.send((ob, reward, done, info))
             elif cmd == 'reset':
-                ob = env.reset()
-                remote.send(ob)
+                ob = env.reset() if data is None else env.reset(task=data)
+                if extras:
+                    remote.send((ob, get_extras(env, extras)))
+                else:
+                    remote.send(ob)
             elif cmd == 'reset_mdp':
                 ob = env.reset_mdp()
-                remote.send(ob)
+                if extras:
+                    remote.send((ob, get_extras(env, extras)))
+                else:
+                    remote.send(ob)
             elif cmd == 'render':
                 remote.send(env.render(mode='rgb_array'))
             elif cmd == 'close':
@@ -40,8 +64,20 @@ def worker(remote, parent_remote, env_fn_wrapper):
                 remote.send(env.belief_dim)
             elif cmd == 'reset_task':
                 env.unwrapped.reset_task(data)
+            elif cmd == 'set_step_extras':
+                extras = data
+                remote.send(None)
+            elif cmd == 'set_timing':
+                step_time, num_steps = (0., 0) if data else (None, 0)
+                remote.send(None)
+            elif cmd == 'pop_timing':
+                remote.send((step_time, num_steps))
+                if step_time is not None:
+                    step_time, num_steps = 0., 0
             elif cmd == "set_attr":
                 remote.send(setattr(env, data[0], data[1]))
+            elif cmd == 'set_unwrapped_attr':
+                remote.send(setattr(env.unwrapped, data[0], data[1]))
             else:
                 # try to get the attribute directly
                 remote.send(getattr(env.unwrapped, cmd))
@@ -80,6 +116,11 @@ class SubprocVecEnv(VecEnv):
         self.viewer = None
         VecEnv.__init__(self, len(env_fns), observation_space, action_space)
 
+        # task / belief sent along with the step / reset replies, kept in preallocated arrays
+        self.step_extras = []
+        self.extras_buf = {}
+        self.extras_valid = False
+
     def step_async(self, actions):
         self._assert_not_closed()
         for remote, action in zip(self.remotes, actions):
@@ -90,14 +131,94 @@ class SubprocVecEnv(VecEnv):
         self._assert_not_closed()
         results = [remote.recv() for remote in self.remotes]
         self.waiting = False
-        obs, rews, dones, infos = zip(*results)
+        if self.step_extras:
+            obs, rews, dones, infos, extras = zip(*results)
+            self.store_extras(range(self.num_envs), extras)
+            self.extras_valid = True
+        else:
+            obs, rews, dones, infos = zip(*results)
         return np.stack(obs), np.stack(rews), np.stack(dones), infos
 
-    def reset(self, task=None):
+    def reset(self, task=None, indices=None):
+        """
+        task: list with one task per env that is reset (None: new tasks are sampled)
+        indices: only reset these envs (all reset commands are sent before waiting for any reply)
+        """
+        self._assert_not_closed()
+        remotes = self.remotes if indices is None else [self.remotes[i] for i in indices]
+        for i, remote in enumerate(remotes):
+            remote.send(('reset', task[i] if task is not None else None))
+        obs = [remote.recv() for remote in remotes]
+        if self.step_extras:
+            obs, extras = zip(*obs)
+            self.store_extras(range(self.num_envs) if indices is None else indices, extras)
+            # after a full reset, the extras of all envs are known
+            self.extras_valid = self.extras_valid or (indices is None)
+        return np.stack(obs)
+
+    def reset_mdp(self, index=None):
+        """ Resets the MDPs (not the tasks) of all envs, or only of env index (then only its observation is returned) """
+        self._assert_not_closed()
+        indices = range(self.num_envs) if index is None else [index]
+        for i in indices:
+            self.remotes[i].send(('reset_mdp', None))
+        obs = [self.remotes[i].recv() for i in indices]
+        if self.step_extras:
+            obs, extras = zip(*obs)
+            self.store_extras(indices, extras)
+        return np.stack(obs) if index is None else obs[0]
+
+    def reset_task(self, task=None):
+        """ task: list with one task per env (None: new tasks are sampled) """
+        self._assert_not_closed()
+        for i, remote in enumerate(self.remotes):
+            remote.send(('reset_task', task[i] if task is not None else None))
+        # (the workers don't reply, so the new tasks / beliefs are only known after the next reset / step)
+        self.extras_valid = False
+
+    def set_step_extras(self, extras):
+        """
+        Makes the workers send their task and/or belief (extras: list of 'task', 'belief') with every step / reset
+        reply, so that get_task / get_belief don't need another round trip to all workers.
+        """
         self._assert_not_closed()
         for remote in self.remotes:
-            remote.send(('reset', task))
-        return np.stack([remote.recv() for remote in self.remotes])
+            remote.send(('set_step_extras', list(extras)))
+        for remote in self.remotes:
+            remote.recv()
+        self.step_extras = list(extras)
+        self.extras_buf = {}
+        self.extras_valid = False
+
+    def store_extras(self, indices, extras):
+        for i, env_extras in zip(indices, extras):
+            for name, value in zip(self.step_extras, env_extras):
+                if name not in self.extras_buf:
+                    value = np.asarray(value)
+                    self.extras_buf[name] = np.zeros((self.num_envs,) + value.shape, dtype=value.dtype)
+                self.extras_buf[name][i] = value
+
+    def set_timing(self, enabled=True):
+        """ Makes the workers time their env steps (the simulation time, without the communication) """
+        self._assert_not_closed()
+        for remote in self.remotes:
+            remote.send(('set_timing', enabled))
+        for remote in self.remotes:
+            remote.recv()
+
+    def pop_timing(self):
+        """
+        Returns the total duration (seconds) and the number of the env steps of each worker since timing was
+        enabled / the last call, as two arrays of length num_envs (only while timing is enabled)
+        """
+        self._assert_not_closed()
+        for remote in self.remotes:
+            remote.send(('pop_timing', None))
+        step_times, num_steps = zip(*[remote.recv() for remote in self.remotes])
+        return np.array(step_times), np.array(num_steps)
+
+    def worker_pids(self):
+        return [p.pid for p in self.ps]
 
     def close_extras(self):
         self.closed = True
@@ -125,17 +246,24 @@ class SubprocVecEnv(VecEnv):
 
     def get_task(self):
         self._assert_not_closed()
+        if self.extras_valid and ('task' in self.step_extras):
+            return self.extras_buf['task'].copy()
         for remote in self.remotes:
             remote.send(('get_task', None))
         return np.stack([remote.recv() for remote in self.remotes])
     
     def get_belief(self):
         self._assert_not_closed()
+        if self.extras_valid and ('belief' in self.step_extras):
+            return self.extras_buf['belief'].copy()
         for remote in self.remotes:
             remote.send(('get_belief', None))
         return np.stack([remote.recv() for remote in self.remotes])
     
-    # def set_env_attr(self, attr, value) -> None:
-    #     """Set attribute inside vectorized environments (see base class)."""
-    #     self.remotes[0].send((attr, value))
-    #     self.remotes[0].recv()
+    def set_env_attr(self, attr, value, unwrapped=False):
+        """ Sets an attribute of all environments (of the unwrapped environments if unwrapped=True) """
+        self._assert_not_closed()
+        for remote in self.remotes:
+            remote.send(('set_unwrapped_attr' if unwrapped else 'set_attr', (attr, value)))
+        for remote in self.remotes:
+            remote.recv()
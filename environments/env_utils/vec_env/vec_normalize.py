@@ -68,20 +68,19 @@ class VecNormalize(VecEnvWrapper):
         if index is None:
             obs = self.venv.reset_mdp()
         else:
-            self.venv.remotes[index].send(('reset_mdp', None))
-            obs = self.venv.remotes[index].recv()
+            obs = self.venv.reset_mdp(index=index)
         return obs
 
-    def reset(self, index=None, task=None):
+    def reset(self, index=None, task=None, indices=None):
         self.ret = np.zeros(self.num_envs)
-        if index is None:
+        if indices is not None:
+            # batched partial reset
+            obs = self.venv.reset(task=task, indices=indices)
+        elif index is None:
             obs = self.venv.reset(task=task)
         else:
-            try:
-                self.venv.remotes[index].send(('reset', task))
-                obs = self.venv.remotes[index].recv()
-            except AttributeError:
-                obs = self.venv.envs[index].reset(task=task)
+            # (the vec env takes one task per env that is reset)
+            obs = self.venv.reset(task=[task] if task is not None else None, indices=[index])[0]
         return obs
 
     def __getattr__(self, attr):
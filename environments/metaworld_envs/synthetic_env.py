@@ -0,0 +1,79 @@
+import time
+import zlib
+
+import gym
+import numpy as np
+from gym.spaces import Box
+
+
+class SyntheticMetaWorldEnv(gym.Env):
+    """
+    Stand-in for a (randomization wrapped) MetaWorld task with the same interface as seen by ContinualEnv,
+    so the learner can be run / profiled without MuJoCo and MetaWorld installed.
+    The dynamics are a fixed random linear map from actions to observations, the reward is dense
+    (in [0, 10], like MetaWorld v2) and 'success' is given within success_radius of the goal.
+    Everything (dynamics, start states and goals) is seeded from the task name and seed, so runs are deterministic.
+    """
+
+    def __init__(self, name, obs_dim=39, action_dim=4, max_episode_steps=500, step_latency=0.,
+                 num_variations=20, success_radius=0.05, seed=0):
+        """
+        :param obs_dim: observation dim of the task (ContinualEnv appends the done flag)
+        :param step_latency: seconds each step takes (sleeps), to mimic the simulation cost
+        :param num_variations: number of fixed start / goal pairs a reset samples from (cf. random_init_fixed20)
+        """
+        self.name = name
+        self.max_episode_steps = max_episode_steps
+        self.step_latency = step_latency
+        self.success_radius = success_radius
+
+        self.observation_space = Box(low=-1., high=1., shape=(obs_dim,), dtype=np.float64)
+        self.action_space = Box(low=-1., high=1., shape=(action_dim,), dtype=np.float32)
+
+        rng = np.random.RandomState((zlib.crc32(name.encode()) + seed) % 2 ** 32)
+        # each action moves the observation along a fixed direction
+        self.dynamics = rng.randn(obs_dim, action_dim) / np.sqrt(obs_dim)
+        # goals are reachable from their start states, within about 100 steps at full speed
+        self.start_states = rng.uniform(-0.5, 0.5, size=(num_variations, obs_dim))
+        self.goals = np.clip(
+            self.start_states + (self.dynamics @ rng.uniform(-1., 1., size=(action_dim, num_variations))).T,
+            -1., 1.)
+        self.reset_rng = np.random.RandomState(rng.randint(2 ** 31))
+
+        self.variation = 0
+        self.state = self.start_states[0].copy()
+        self.curr_path_length = 0
+
+    def seed(self, seed=None):
+        self.reset_rng.seed(seed)
+        return [seed]
+
+    def reset(self):
+        self.variation = self.reset_rng.randint(len(self.start_states))
+        self.state = self.start_states[self.variation].copy()
+        self.curr_path_length = 0
+        return self.state.copy(), {}
+
+    def step(self, action):
+        if self.step_latency > 0:
+            time.sleep(self.step_latency)
+
+        action = np.clip(action, self.action_space.low, self.action_space.high)
+        self.state = np.clip(self.state + 0.01 * self.dynamics @ action, -1., 1.)
+        self.curr_path_length += 1
+
+        distance = np.linalg.norm(self.state - self.goals[self.variation])
+        reward = 10. * np.exp(-distance)
+        info = {
+            'success': float(distance < self.success_radius),
+            'goal_distance': distance,
+        }
+        truncated = self.curr_path_length >= self.max_episode_steps
+
+        return self.state.copy(), reward, False, truncated, info
+
+    def render(self, mode='human'):
+        raise NotImplementedError(f'{self.__class__.__name__} does not render')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name})'
@@ -0,0 +1,97 @@
+import numpy as np
+import torch
+
+from environments.env_utils.vec_env.batched_vec_env import BatchedVecEnv
+from environments.navigation.gridworld import GridNavi
+
+
+class BatchedGridNavi(BatchedVecEnv):
+    """
+    All num_processes GridNavi envs in one vec-env, stepped together in the main process:
+    positions, goals and beliefs are (num_processes, ...) tensors.
+    Drop-in replacement for SubprocVecEnv / DummyVecEnv over GridNavi (see make_vec_envs).
+    """
+
+    def __init__(self, num_processes, episodes_per_task, seed=None, rank_offset=0, tasks=None, add_done_info=None,
+                 num_cells=5, num_steps=15):
+
+        grid = GridNavi(num_cells=num_cells, num_steps=num_steps)
+        super().__init__(grid, num_processes, episodes_per_task, seed=seed, rank_offset=rank_offset,
+                         add_done_info=add_done_info)
+
+        self.num_cells = num_cells
+
+        # ids of all possible goals, and of the goals tasks are sampled from
+        self.possible_goal_ids = grid.task_to_id(grid.possible_goals)
+        self.task_ids = self.possible_goal_ids if tasks is None else grid.task_to_id(np.array(tasks))
+        # for every goal (id), the other possible goals - the wrong hints
+        self.hint_ids = torch.stack([self.possible_goal_ids[self.possible_goal_ids != goal_id][:len(self.possible_goal_ids) - 1]
+                                     for goal_id in range(grid.num_states)])
+
+        # (x, y) changes of the actions: noop, up, right, down, left
+        self.moves = torch.tensor([[0., 0.], [0., 1.], [1., 0.], [0., -1.], [-1., 0.]], dtype=torch.float64)
+
+        self.start_state = torch.tensor(grid.starting_state, dtype=torch.float64)
+        self.state = self.start_state.repeat(num_processes, 1)
+        self.goal_ids = torch.zeros(num_processes, dtype=torch.long)
+        self.belief = torch.zeros((num_processes, grid.num_states), dtype=torch.float64)
+
+        self.reset_task(torch.arange(num_processes))
+
+    def id_to_goal(self, ids):
+        return torch.stack((ids // self.num_cells, ids % self.num_cells), dim=-1)
+
+    def state_ids(self):
+        state = self.state.long()
+        return state[:, 0] * self.num_cells + state[:, 1]
+
+    def reset_task(self, indices, task=None):
+        if task is None:
+            sampled = torch.randint(len(self.task_ids), (len(indices),), generator=self.generator)
+            self.goal_ids[indices] = self.task_ids[sampled]
+        else:
+            self.goal_ids[indices] = self.env.unwrapped.task_to_id(np.array(task)).view(-1)
+        # uniform belief over all possible goals
+        self.belief[indices] = 0.
+        self.belief[indices.view(-1, 1), self.possible_goal_ids.view(1, -1)] = 1.0 / len(self.possible_goal_ids)
+
+    def reset_state(self, indices):
+        self.state[indices] = self.start_state
+
+    def transition(self, actions):
+        actions = actions.long().view(-1)
+        batch_idx = torch.arange(self.num_envs)
+
+        # perform state transitions
+        self.state = (self.state + self.moves[actions]).clamp(0, self.num_cells - 1)
+
+        # compute reward
+        state_ids = self.state_ids()
+        on_goal = state_ids == self.goal_ids
+        reward = torch.where(on_goal, torch.tensor(1.0, dtype=torch.float64), torch.tensor(-0.1, dtype=torch.float64))
+
+        # update ground-truth belief: on the goal we get a hint (the goal and a random other goal) ...
+        hint_idx = torch.randint(self.hint_ids.shape[1], (self.num_envs,), generator=self.generator)
+        hint_belief = torch.zeros_like(self.belief)
+        hint_belief[batch_idx, self.goal_ids] = 0.5
+        hint_belief[batch_idx, self.hint_ids[self.goal_ids, hint_idx]] = 0.5
+        # ... otherwise the current cell is ruled out
+        belief = self.belief.clone()
+        belief[batch_idx, state_ids] = 0
+        belief = torch.ceil(belief)
+        belief /= belief.sum(dim=1, keepdim=True)
+        self.belief = torch.where(on_goal.view(-1, 1), hint_belief, belief)
+
+        task = self.get_task()
+        belief = self.get_belief()
+        infos = [{'task': task[i],
+                  'task_id': self.goal_ids[i:i + 1].clone(),
+                  'belief': belief[i]} for i in range(self.num_envs)]
+
+        return reward, infos
+
+    def get_task(self):
+        return self.id_to_goal(self.goal_ids).numpy()
+
+    def get_belief(self):
+        return self.belief.numpy().copy()
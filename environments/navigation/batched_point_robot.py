@@ -0,0 +1,102 @@
+import numpy as np
+import torch
+
+from environments.env_utils.vec_env.batched_vec_env import BatchedVecEnv
+from environments.navigation.point_robot import PointEnv, SparsePointEnv
+
+# goals are sampled on the unit circle, with an angle between 0 and ...
+GOAL_ANGLES = {
+    'semi-circle': np.pi,
+    'circle': 2 * np.pi,
+}
+
+
+class BatchedPointEnv(BatchedVecEnv):
+    """
+    All num_processes PointEnvs in one vec-env, stepped together in the main process:
+    positions and goals are (num_processes, 2) tensors.
+    Drop-in replacement for SubprocVecEnv / DummyVecEnv over PointEnv (see make_vec_envs).
+    """
+
+    def __init__(self, num_processes, episodes_per_task, seed=None, rank_offset=0, tasks=None, add_done_info=None,
+                 max_episode_steps=100, goal_sampler=None, goal_radius=None):
+
+        super().__init__(self.make_env(max_episode_steps, goal_sampler, goal_radius), num_processes, episodes_per_task,
+                         seed=seed, rank_offset=rank_offset, add_done_info=add_done_info, time_limit=True)
+
+        # custom goal samplers are called once per env
+        if callable(goal_sampler):
+            self.goal_sampler = goal_sampler
+        else:
+            self.goal_sampler = None
+            self.max_goal_angle = GOAL_ANGLES['semi-circle' if goal_sampler is None else goal_sampler]
+        self.tasks = None if tasks is None else torch.tensor(np.array(tasks), dtype=torch.float64)
+
+        # we convert the actions from [-1, 1] to [-0.1, 0.1] in the step
+        self.action_low = torch.from_numpy(self.action_space.low)
+        self.action_high = torch.from_numpy(self.action_space.high)
+
+        self.state = torch.zeros((num_processes, 2), dtype=torch.float64)
+        self.goal = torch.zeros((num_processes, 2), dtype=torch.float64)
+
+        self.reset_task(torch.arange(num_processes))
+
+    def make_env(self, max_episode_steps, goal_sampler, goal_radius):
+        return PointEnv(max_episode_steps=max_episode_steps, goal_sampler=goal_sampler)
+
+    def sample_goals(self, num_goals):
+        if self.tasks is not None:
+            return self.tasks[torch.randint(len(self.tasks), (num_goals,), generator=self.generator)]
+        if self.goal_sampler is not None:
+            return torch.tensor(np.array([self.goal_sampler() for _ in range(num_goals)]), dtype=torch.float64)
+        angle = torch.rand(num_goals, generator=self.generator, dtype=torch.float64) * self.max_goal_angle
+        return torch.stack((torch.cos(angle), torch.sin(angle)), dim=-1)
+
+    def reset_task(self, indices, task=None):
+        if task is None:
+            self.goal[indices] = self.sample_goals(len(indices))
+        else:
+            self.goal[indices] = torch.tensor(np.array(task), dtype=torch.float64).view(-1, 2)
+
+    def reset_state(self, indices):
+        self.state[indices] = 0.
+
+    def transition(self, actions):
+        actions = torch.max(torch.min(actions.float().view(self.num_envs, -1), self.action_high), self.action_low)
+
+        self.state = self.state + (0.1 * actions).double()
+        reward = - torch.norm(self.state - self.goal, p=2, dim=1)
+
+        task = self.get_task()
+        infos = [{'task': task[i]} for i in range(self.num_envs)]
+        return reward, infos
+
+    def get_task(self):
+        return self.goal.numpy().copy()
+
+    def get_belief(self):
+        # there is no ground-truth belief for this env
+        return None
+
+
+class BatchedSparsePointEnv(BatchedPointEnv):
+    """ Batched SparsePointEnv: the reward is L2 distance given only within goal radius """
+
+    def __init__(self, num_processes, episodes_per_task, seed=None, rank_offset=0, tasks=None, add_done_info=None,
+                 max_episode_steps=100, goal_sampler='semi-circle', goal_radius=0.2):
+        self.goal_radius = goal_radius
+        super().__init__(num_processes, episodes_per_task, seed=seed, rank_offset=rank_offset, tasks=tasks,
+                         add_done_info=add_done_info, max_episode_steps=max_episode_steps,
+                         goal_sampler=goal_sampler, goal_radius=goal_radius)
+
+    def make_env(self, max_episode_steps, goal_sampler, goal_radius):
+        return SparsePointEnv(goal_radius=goal_radius, max_episode_steps=max_episode_steps, goal_sampler=goal_sampler)
+
+    def transition(self, actions):
+        reward, infos = super().transition(actions)
+        # zero out rewards when outside the goal radius, and make sparse rewards positive
+        sparse_reward = torch.where(reward >= -self.goal_radius, reward + 1, torch.zeros_like(reward))
+        for i in range(self.num_envs):
+            infos[i]['sparse_reward'] = sparse_reward[i].item()
+            infos[i]['dense_reward'] = reward[i].item()
+        return sparse_reward, infos
@@ -415,6 +415,18 @@ def plot_bb(env, args, episode_all_obs, episode_goals, reward_decoder,
     rew_pred_means = [[] for _ in range(num_episodes)]
     rew_pred_vars = [[] for _ in range(num_episodes)]
 
+    if reward_decoder is not None:
+        # compute the beliefs of all episodes / timesteps at once
+        all_rew_pred_means, all_rew_pred_vars = compute_beliefs_batched(
+            env,
+            args,
+            reward_decoder,
+            torch.cat([m[:num_steps] for m in episode_latent_means]),
+            torch.cat([l[:num_steps] for l in episode_latent_logvars]),
+            [goal for goal in episode_goals for _ in range(num_steps)])
+        all_rew_pred_means = all_rew_pred_means.view(num_episodes, num_steps, -1)
+        all_rew_pred_vars = all_rew_pred_vars.view(num_episodes, num_steps, -1)
+
     # loop through the experiences
     for episode_idx in range(num_episodes):
         for step_idx in range(num_steps):
@@ -422,10 +434,6 @@ def plot_bb(env, args, episode_all_obs, episode_goals, reward_decoder,
             curr_obs = episode_all_obs[episode_idx][:step_idx + 1]
             curr_goal = episode_goals[episode_idx]
 
-            if episode_latent_means is not None:
-                curr_means = episode_latent_means[episode_idx][:step_idx + 1]
-                curr_logvars = episode_latent_logvars[episode_idx][:step_idx + 1]
-
             # choose correct subplot
             plt.subplot(args.max_rollouts_per_task,
                         math.ceil(env._max_episode_steps) + 1,
@@ -436,12 +444,8 @@ def plot_bb(env, args, episode_all_obs, episode_goals, reward_decoder,
 
             if reward_decoder is not None:
                 # visualise belief in env
-                rm, rv = compute_beliefs(env,
-                                         args,
-                                         reward_decoder,
-                                         curr_means[-1],
-                                         curr_logvars[-1],
-                                         curr_goal)
+                rm = all_rew_pred_means[episode_idx, step_idx]
+                rv = all_rew_pred_vars[episode_idx, step_idx]
                 rew_pred_means[episode_idx].append(rm)
                 rew_pred_vars[episode_idx].append(rv)
                 plot_belief(env, rm, args)
@@ -503,42 +507,57 @@ def plot_behaviour(env, observations, goal):
 
 
 def compute_beliefs(env, args, reward_decoder, latent_mean, latent_logvar, goal):
-    num_cells = env.observation_space.high[0] + 1
-    unwrapped_env = env.venv.unwrapped.envs[0]
+    rew_pred_means, rew_pred_vars = compute_beliefs_batched(env, args, reward_decoder,
+                                                            latent_mean.view(1, -1), latent_logvar.view(1, -1), [goal])
+    return rew_pred_means[0], rew_pred_vars[0]
 
-    if not args.disable_stochasticity_in_latent:
-        # take several samples fromt he latent distribution
-        samples = utl.sample_gaussian(latent_mean.view(-1), latent_logvar.view(-1), 100)
-    else:
-        samples = torch.cat((latent_mean.view(-1), latent_logvar.view(-1))).unsqueeze(0)
-
-    # compute reward predictions for those
-    if reward_decoder.multi_head:
-        rew_pred = reward_decoder(samples, None)
-        if args.rew_pred_type == 'categorical':
-            rew_pred = F.softmax(rew_pred, dim=-1)
-        elif args.rew_pred_type == 'bernoulli':
-            rew_pred = torch.sigmoid(rew_pred)
-        rew_pred_means = torch.mean(rew_pred, dim=0)  # .reshape((1, -1))
-        rew_pred_vars = torch.var(rew_pred, dim=0)  # .reshape((1, -1))
-    else:
-        tsm = []
-        tsv = []
-        for st in range(num_cells ** 2):
-            task_id = unwrapped_env.id_to_task(torch.tensor([st]))
-            curr_state = unwrapped_env.goal_to_onehot_id(task_id).expand((samples.shape[0], 2))
-            if unwrapped_env.oracle:
-                if isinstance(goal, np.ndarray):
-                    goal = torch.from_numpy(goal)
-                curr_state = torch.cat((curr_state, goal.repeat(curr_state.shape[0], 1).float()), dim=1)
+
+def compute_beliefs_batched(env, args, reward_decoder, latent_means, latent_logvars, goals, num_samples=100):
+    """
+    Computes the reward predictions (mean / variance over samples from the latent distribution) for all cells,
+    for a batch of latent distributions (e.g. all timesteps of a rollout) with a single decoder call.
+    :param latent_means, latent_logvars: (batch, latent_dim)
+    :param goals: the goal for every element of the batch (only used by oracle envs)
+    :return: predicted reward means and variances, (batch, num_cells ** 2)
+    """
+    num_cells = int(env.observation_space.high[0] + 1)
+    unwrapped_env = env.venv.unwrapped.envs[0]
+    batch_size = latent_means.shape[0]
+
+    with torch.no_grad():
+        if not args.disable_stochasticity_in_latent:
+            # take several samples from the latent distribution, (batch, num_samples, latent_dim)
+            std = torch.exp(0.5 * latent_logvars).unsqueeze(1)
+            samples = latent_means.unsqueeze(1) + std * torch.randn((batch_size, num_samples, latent_means.shape[-1]),
+                                                                    device=latent_means.device)
+        else:
+            samples = torch.cat((latent_means, latent_logvars), dim=-1).unsqueeze(1)
+
+        # compute reward predictions for those
+        if reward_decoder.multi_head:
+            rew_pred = reward_decoder(samples, None)
+            if args.rew_pred_type == 'categorical':
+                rew_pred = F.softmax(rew_pred, dim=-1)
+            elif args.rew_pred_type == 'bernoulli':
+                rew_pred = torch.sigmoid(rew_pred)
+            rew_pred_means = torch.mean(rew_pred, dim=1)
+            rew_pred_vars = torch.var(rew_pred, dim=1)
+        else:
+            # decode all cells at once, (batch, cells, samples, ...)
+            num_states = num_cells ** 2
+            cells = unwrapped_env.id_to_task(torch.arange(num_states)).to(samples.device)
+            curr_state = cells.view(1, num_states, 1, -1).expand((batch_size, num_states, samples.shape[1], -1))
+            if getattr(unwrapped_env, 'oracle', False):
+                goals = torch.from_numpy(np.array(goals)).float().to(samples.device)
+                goals = goals.view(batch_size, 1, 1, -1).expand((batch_size, num_states, samples.shape[1], -1))
+                curr_state = torch.cat((curr_state, goals), dim=-1)
+            samples = samples.unsqueeze(1).expand((batch_size, num_states, samples.shape[1], samples.shape[-1]))
             rew_pred = reward_decoder(samples, curr_state)
             if args.rew_pred_type == 'bernoulli':
                 rew_pred = torch.sigmoid(rew_pred)
-            tsm.append(torch.mean(rew_pred))
-            tsv.append(torch.var(rew_pred))
-        rew_pred_means = torch.stack(tsm).reshape((1, -1))
-        rew_pred_vars = torch.stack(tsv).reshape((1, -1))
-    # rew_pred_means = rew_pred_means[-1][0]
+            rew_pred = rew_pred.view(batch_size, num_states, -1)
+            rew_pred_means = torch.mean(rew_pred, dim=-1)
+            rew_pred_vars = torch.var(rew_pred, dim=-1)
 
     return rew_pred_means, rew_pred_vars
 
@@ -551,16 +570,11 @@ def plot_belief(env, beliefs, args):
     num_cells = int(env.observation_space.high[0] + 1)
     unwrapped_env = env.venv.unwrapped.envs[0]
 
-    # draw probabilities for each grid cell
-    alphas = []
-    for i in range(num_cells):
-        for j in range(num_cells):
-            pos_i = i
-            pos_j = j
-            idx = unwrapped_env.task_to_id(torch.tensor([[pos_i, pos_j]]))
-            alpha = beliefs[idx]
-            alphas.append(alpha.item())
-    alphas = np.array(alphas)
+    # draw probabilities for each grid cell (cells in the order they're drawn below)
+    if torch.is_tensor(beliefs):
+        beliefs = beliefs.detach().cpu().numpy()
+    cells = np.array(list(itertools.product(range(num_cells), repeat=2)))
+    alphas = np.array(beliefs).reshape(-1)[unwrapped_env.task_to_id(cells).numpy()].astype(np.float64)
     # cut off values (this only happens if we don't use sigmoid/softmax)
     alphas[alphas < 0] = 0
     alphas[alphas > 1] = 1
@@ -4,6 +4,7 @@ Based on https://github.com/ikostrikov/pytorch-a2c-ppo-acktr
 import gym
 import torch
 import random
+from gym.envs.registration import load
 
 from environments.env_utils.vec_env import VecEnvWrapper
 from environments.env_utils.vec_env.dummy_vec_env import DummyVecEnv
@@ -11,6 +12,13 @@ from environments.env_utils.vec_env.subproc_vec_env import SubprocVecEnv
 from environments.env_utils.vec_env.vec_normalize import VecNormalize
 from environments.wrappers import TimeLimitMask, VariBadWrapper
 
+# envs with a batched implementation (a VecEnv that steps all processes at once in the main process)
+BATCHED_ENVS = {
+    'GridNavi-v0': 'environments.navigation.batched_gridworld:BatchedGridNavi',
+    'PointEnv-v0': 'environments.navigation.batched_point_robot:BatchedPointEnv',
+    'SparsePointEnv-v0': 'environments.navigation.batched_point_robot:BatchedSparsePointEnv',
+}
+
 
 def make_env(env_id, seed, rank, episodes_per_task, tasks, add_done_info, **kwargs):
     def _thunk():
@@ -77,10 +85,21 @@ def make_vec_envs(env_name, seed, num_processes, gamma,
                   normalise_rew, ret_rms, tasks,
                   rank_offset=0,
                   add_done_info=None,
+                  step_extras=None,
+                  batched=False,
                   **kwargs):
     """
     :param ret_rms: running return and std for rewards
+    :param step_extras: if given (list of 'task', 'belief'), parallel workers send these along with every step / reset
+    :param batched: use the batched implementation of the env if there is one (see BATCHED_ENVS)
     """
+    if batched and (env_name in BATCHED_ENVS):
+        env_kwargs = {**gym.envs.registry.spec(env_name)._kwargs, **kwargs}
+        envs = load(BATCHED_ENVS[env_name])(num_processes=num_processes, episodes_per_task=episodes_per_task,
+                                            seed=seed, rank_offset=rank_offset, tasks=tasks,
+                                            add_done_info=add_done_info, **env_kwargs)
+        return wrap_vec_envs(envs, device, gamma, normalise_rew, ret_rms)
+
     ## hacky work around
     if ('ML10' in env_name) or ('ML3' in env_name):
         # print('making metaworld env')
@@ -101,9 +120,16 @@ def make_vec_envs(env_name, seed, num_processes, gamma,
 
     if len(envs) > 1:
         envs = SubprocVecEnv(envs)
+        if step_extras:
+            envs.set_step_extras(step_extras)
     else:
         envs = DummyVecEnv(envs)
 
+    return wrap_vec_envs(envs, device, gamma, normalise_rew, ret_rms)
+
+
+def wrap_vec_envs(envs, device, gamma, normalise_rew, ret_rms):
+    """ Adds reward normalisation and conversion to torch """
     if len(envs.observation_space.shape) == 1:
         if gamma is None:
             envs = VecNormalize(envs, normalise_rew=normalise_rew, ret_rms=ret_rms)
@@ -130,10 +156,10 @@ class VecPyTorch(VecEnvWrapper):
             obs = torch.from_numpy(obs).float().to(self.device)
         return obs
 
-    def reset(self, index=None, task=None):
+    def reset(self, index=None, task=None, indices=None):
         if task is not None:
             assert isinstance(task, list)
-        state = self.venv.reset(index=index, task=task)
+        state = self.venv.reset(index=index, task=task, indices=indices)
         if isinstance(state, list):
             state = [torch.from_numpy(s).float().to(self.device) for s in state]
         else:
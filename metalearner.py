@@ -1,3 +1,4 @@
+import functools
 import os
 import time
 
@@ -12,7 +13,11 @@ from environments.parallel_envs import make_vec_envs
 from models.policy import Policy
 from utils import evaluation as utl_eval
 from utils import helpers as utl
+from utils.checkpoint_writer import AsyncCheckpointWriter
+from utils.memory_report import storage_memory, estimate_graph_memory, model_memory, optimiser_memory, \
+    process_memory, format_memory_report
 from utils.tb_logger import TBLogger
+from utils.throughput_metrics import ThroughputMetrics
 from vae import VaribadVAE
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
@@ -40,7 +45,8 @@ class MetaLearner:
                                   gamma=args.policy_gamma, device=device,
                                   episodes_per_task=self.args.max_rollouts_per_task,
                                   normalise_rew=args.norm_rew_for_policy, ret_rms=None,
-                                  tasks=None
+                                  tasks=None, step_extras=utl.get_step_extras(args),
+                                  batched=args.batched_env if hasattr(args, 'batched_env') else False
                                   )
 
         if self.args.single_task_mode:
@@ -55,7 +61,8 @@ class MetaLearner:
                                       gamma=args.policy_gamma, device=device,
                                       episodes_per_task=self.args.max_rollouts_per_task,
                                       normalise_rew=args.norm_rew_for_policy, ret_rms=None,
-                                      tasks=self.train_tasks
+                                      tasks=self.train_tasks, step_extras=utl.get_step_extras(args),
+                                      batched=args.batched_env if hasattr(args, 'batched_env') else False
                                       )
             # save the training tasks so we can evaluate on the same envs later
             utl.save_obj(self.train_tasks, self.logger.full_output_folder, "train_tasks")
@@ -83,6 +90,46 @@ class MetaLearner:
         self.policy_storage = self.initialise_policy_storage()
         self.policy = self.initialise_policy()
 
+        # write models to disk in the background (optionally only keeping the last few intermediate models)
+        self.checkpoint_writer = AsyncCheckpointWriter(
+            keep_last=self.args.keep_last_models if hasattr(self.args, 'keep_last_models') else None)
+
+        # the encoding of the current timestep of each process (carried over from the last rollout),
+        # and the VAE version (number of VAE updates) at which the running trajectories were last fully re-encoded
+        self.encoder_staleness = self.args.encoder_staleness if hasattr(self.args, 'encoder_staleness') else None
+        self.running_encoding = None
+        self.running_encoding_vae_version = None
+
+        # throughput / latency metrics, logged every log_interval updates (the env workers only time their steps if asked to)
+        time_env_workers = self.args.time_env_workers if hasattr(self.args, 'time_env_workers') else False
+        self.metrics = ThroughputMetrics(self.envs, time_workers=time_env_workers)
+
+        print(format_memory_report(self.memory_report()))
+
+    def memory_report(self):
+        """
+        Bytes held by the policy storage, the VAE buffer (0 for the trajectories in memory-mapped files),
+        the models (incl. optimiser state) and the resident memory of the processes
+        """
+        report = {
+            'policy storage': storage_memory(self.policy_storage),
+            'vae storage': storage_memory(self.vae.rollout_storage),
+            'policy': model_memory(self.policy.actor_critic, self.policy.optimiser),
+            'vae': {f'{name} parameters': model_memory(model)['parameters'] for name, model in [
+                ['encoder', self.vae.encoder],
+                ['state_decoder', self.vae.state_decoder],
+                ['reward_decoder', self.vae.reward_decoder],
+                ['task_decoder', self.vae.task_decoder],
+            ] if model is not None},
+        }
+        report['vae']['optimiser_state'] = optimiser_memory(self.vae.optimiser_vae)
+        if self.args.rlloss_through_encoder:
+            # the embeddings are recomputed with gradients for the policy update
+            report['autograd graph'] = {'saved tensors (estimate)': estimate_graph_memory(
+                [self.vae.encoder], self.args.policy_num_steps, self.args.num_processes)}
+        report['processes (rss)'] = process_memory(self.envs)
+        return report
+
     def initialise_policy_storage(self):
         return OnlineStorage(args=self.args,
                              num_steps=self.args.policy_num_steps,
@@ -136,7 +183,7 @@ class MetaLearner:
                 policy_optimiser=self.args.policy_optimiser,
                 policy_anneal_lr=self.args.policy_anneal_lr,
                 train_steps=self.num_updates,
-                optimiser_vae=self.vae.optimiser_vae,
+                optimiser_vae=self.vae.optimiser_vae if not self.vae.train_in_background else None,
                 lr=self.args.lr_policy,
                 eps=self.args.policy_eps,
             )
@@ -156,7 +203,7 @@ class MetaLearner:
                 use_huber_loss=self.args.ppo_use_huberloss,
                 use_clipped_value_loss=self.args.ppo_use_clipped_value_loss,
                 clip_param=self.args.ppo_clip_param,
-                optimiser_vae=self.vae.optimiser_vae,
+                optimiser_vae=self.vae.optimiser_vae if not self.vae.train_in_background else None,
             )
         else:
             raise NotImplementedError
@@ -179,6 +226,10 @@ class MetaLearner:
 
         for self.iter_idx in range(self.num_updates):
 
+            # pick up the newest VAE weights if it is trained in the background
+            if self.vae.train_in_background:
+                self.vae.sync_rollout_encoder()
+
             # First, re-compute the hidden states given the current rollouts (since the VAE might've changed)
             with torch.no_grad():
                 latent_sample, latent_mean, latent_logvar, hidden_state = self.encode_running_trajectory()
@@ -194,6 +245,7 @@ class MetaLearner:
             for step in range(self.args.policy_num_steps):
 
                 # sample actions from policy
+                policy_start = time.perf_counter()
                 with torch.no_grad():
                     value, action = utl.select_action(
                         args=self.args,
@@ -206,9 +258,13 @@ class MetaLearner:
                         latent_mean=latent_mean,
                         latent_logvar=latent_logvar,
                     )
+                self.metrics.add_duration('policy_forward', policy_start)
 
                 # take step in the environment
+                env_start = time.perf_counter()
                 [next_state, belief, task], (rew_raw, rew_normalised), done, infos = utl.env_step(self.envs, action, self.args)
+                self.metrics.add_duration('env_step', env_start)
+                self.metrics.add_frames(self.args.num_processes)
 
                 done = torch.from_numpy(np.array(done, dtype=int)).to(device).float().view((-1, 1))
                 # create mask for episode ends
@@ -216,15 +272,17 @@ class MetaLearner:
                 # bad_mask is true if episode ended because time limit was reached
                 bad_masks = torch.FloatTensor([[0.0] if 'bad_transition' in info.keys() else [1.0] for info in infos]).to(device)
 
+                encoder_start = time.perf_counter()
                 with torch.no_grad():
                     # compute next embedding (for next loop and/or value prediction bootstrap)
                     latent_sample, latent_mean, latent_logvar, hidden_state = utl.update_encoding(
-                        encoder=self.vae.encoder,
+                        encoder=self.vae.rollout_encoder,
                         next_obs=next_state,
                         action=action,
                         reward=rew_raw,
                         done=done,
                         hidden_state=hidden_state)
+                self.metrics.add_duration('encoder_update', encoder_start)
 
                 # before resetting, update the embedding and add to vae buffer
                 # (last state might include useful task info)
@@ -271,24 +329,35 @@ class MetaLearner:
 
                 self.frames += self.args.num_processes
 
+            # keep the current encoding so we don't have to re-encode the running trajectories next iteration
+            if self.encoder_staleness is not None:
+                with torch.no_grad():
+                    self.cache_running_encoding(latent_sample, latent_mean, latent_logvar, hidden_state, done)
+
             # --- UPDATE ---
 
             if self.args.precollect_len <= self.frames:
 
+                # from here on, the VAE can be updated continuously in the background
+                if self.vae.train_in_background:
+                    self.vae.start_background_training()
+
                 # check if we are pre-training the VAE
                 if self.args.pretrain_len > self.iter_idx:
-                    for p in range(self.args.num_vae_updates_per_pretrain):
+                    for p in range(self.args.num_vae_updates_per_pretrain if not self.vae.train_in_background else 0):
                         self.vae.compute_vae_loss(update=True,
                                                   pretrain_index=self.iter_idx * self.args.num_vae_updates_per_pretrain + p)
                 # otherwise do the normal update (policy + vae)
                 else:
 
+                    update_start = time.perf_counter()
                     train_stats = self.update(state=prev_state,
                                               belief=belief,
                                               task=task,
                                               latent_sample=latent_sample,
                                               latent_mean=latent_mean,
                                               latent_logvar=latent_logvar)
+                    self.metrics.add_duration('update', update_start)
 
                     # log
                     run_stats = [action, self.policy_storage.action_log_probs, value]
@@ -299,32 +368,56 @@ class MetaLearner:
             self.policy_storage.after_update()
 
         self.envs.close()
+        self.vae.close()
+        self.checkpoint_writer.close()
 
     def encode_running_trajectory(self):
         """
         (Re-)Encodes (for each process) the entire current trajectory.
         Returns sample/mean/logvar and hidden state (if applicable) for the current timestep.
+        If encoder_staleness is set, the encoding from the end of the last rollout is re-used
+        until the VAE has been updated encoder_staleness times since the last full re-encoding.
         :return:
         """
 
+        if self.running_encoding is not None and \
+                self.vae.rollout_encoder_version - self.running_encoding_vae_version < self.encoder_staleness:
+            return self.running_encoding
+
         # for each process, get the current batch (zero-padded obs/act/rew + length indicators)
         prev_obs, next_obs, act, rew, lens = self.vae.rollout_storage.get_running_batch()
 
         # get embedding - will return (1+sequence_len) * batch * input_size -- includes the prior!
-        all_latent_samples, all_latent_means, all_latent_logvars, all_hidden_states = self.vae.encoder(actions=act,
-                                                                                                       states=next_obs,
-                                                                                                       rewards=rew,
-                                                                                                       hidden_state=None,
-                                                                                                       return_prior=True)
+        all_latent_samples, all_latent_means, all_latent_logvars, all_hidden_states = self.vae.rollout_encoder(actions=act,
+                                                                                                               states=next_obs,
+                                                                                                               rewards=rew,
+                                                                                                               hidden_state=None,
+                                                                                                               return_prior=True)
 
         # get the embedding / hidden state of the current time step (need to do this since we zero-padded)
-        latent_sample = (torch.stack([all_latent_samples[lens[i]][i] for i in range(len(lens))])).to(device)
-        latent_mean = (torch.stack([all_latent_means[lens[i]][i] for i in range(len(lens))])).to(device)
-        latent_logvar = (torch.stack([all_latent_logvars[lens[i]][i] for i in range(len(lens))])).to(device)
-        hidden_state = (torch.stack([all_hidden_states[lens[i]][i] for i in range(len(lens))])).to(device)
+        lens = lens.to(device)
+        process_idx = self.vae.rollout_storage.process_idx
+        latent_sample = all_latent_samples[lens, process_idx].to(device)
+        latent_mean = all_latent_means[lens, process_idx].to(device)
+        latent_logvar = all_latent_logvars[lens, process_idx].to(device)
+        hidden_state = all_hidden_states[lens, process_idx].to(device)
+
+        self.running_encoding_vae_version = self.vae.rollout_encoder_version
 
         return latent_sample, latent_mean, latent_logvar, hidden_state
 
+    def cache_running_encoding(self, latent_sample, latent_mean, latent_logvar, hidden_state, done):
+        """
+        Stores the encoding of the current timestep (computed step-by-step during the rollout).
+        Processes that just finished their BAMDP start again from the prior.
+        """
+        prior_sample, prior_mean, prior_logvar, prior_hidden_state = self.vae.rollout_encoder.prior(self.args.num_processes)
+        done = done.view(-1, 1).bool()
+        self.running_encoding = (torch.where(done, prior_sample[0], latent_sample),
+                                 torch.where(done, prior_mean[0], latent_mean),
+                                 torch.where(done, prior_logvar[0], latent_logvar),
+                                 torch.where(done, prior_hidden_state[0], hidden_state.reshape(prior_hidden_state[0].shape)))
+
     def get_value(self, state, belief, task, latent_sample, latent_mean, latent_logvar):
         latent = utl.get_latent_for_policy(self.args, latent_sample=latent_sample, latent_mean=latent_mean, latent_logvar=latent_logvar)
         return self.policy.actor_critic.get_value(state=state, belief=belief, task=task, latent=latent).detach()
@@ -362,7 +455,7 @@ class MetaLearner:
             policy_train_stats = 0, 0, 0, 0
 
             # pre-train the VAE
-            if self.iter_idx < self.args.pretrain_len:
+            if self.iter_idx < self.args.pretrain_len and not self.vae.train_in_background:
                 self.vae.compute_vae_loss(update=True)
 
         return policy_train_stats
@@ -378,13 +471,19 @@ class MetaLearner:
                                          image_folder=self.logger.full_output_folder,
                                          iter_idx=self.iter_idx,
                                          ret_rms=ret_rms,
-                                         encoder=self.vae.encoder,
-                                         reward_decoder=self.vae.reward_decoder,
-                                         state_decoder=self.vae.state_decoder,
-                                         task_decoder=self.vae.task_decoder,
-                                         compute_rew_reconstruction_loss=self.vae.compute_rew_reconstruction_loss,
-                                         compute_state_reconstruction_loss=self.vae.compute_state_reconstruction_loss,
-                                         compute_task_reconstruction_loss=self.vae.compute_task_reconstruction_loss,
+                                         encoder=self.vae.rollout_encoder,
+                                         reward_decoder=self.vae.rollout_reward_decoder,
+                                         state_decoder=self.vae.rollout_state_decoder,
+                                         task_decoder=self.vae.rollout_task_decoder,
+                                         compute_rew_reconstruction_loss=functools.partial(
+                                             self.vae.compute_rew_reconstruction_loss,
+                                             reward_decoder=self.vae.rollout_reward_decoder),
+                                         compute_state_reconstruction_loss=functools.partial(
+                                             self.vae.compute_state_reconstruction_loss,
+                                             state_decoder=self.vae.rollout_state_decoder),
+                                         compute_task_reconstruction_loss=functools.partial(
+                                             self.vae.compute_task_reconstruction_loss,
+                                             task_decoder=self.vae.rollout_task_decoder),
                                          compute_kl_loss=self.vae.compute_kl_loss,
                                          tasks=self.train_tasks,
                                          )
@@ -394,13 +493,15 @@ class MetaLearner:
         if (self.iter_idx + 1) % self.args.eval_interval == 0:
 
             ret_rms = self.envs.venv.ret_rms if self.args.norm_rew_for_policy else None
+            eval_start = time.perf_counter()
             returns_per_episode = utl_eval.evaluate(args=self.args,
                                                     policy=self.policy,
                                                     ret_rms=ret_rms,
-                                                    encoder=self.vae.encoder,
+                                                    encoder=self.vae.rollout_encoder,
                                                     iter_idx=self.iter_idx,
                                                     tasks=self.train_tasks,
                                                     )
+            self.metrics.add_duration('eval', eval_start)
 
             # log the return avg/std across tasks (=processes)
             returns_avg = returns_per_episode.mean(dim=0)
@@ -430,14 +531,18 @@ class MetaLearner:
 
             for idx_label in idx_labels:
 
-                torch.save(self.policy.actor_critic, os.path.join(save_path, f"policy{idx_label}.pt"))
-                torch.save(self.vae.encoder, os.path.join(save_path, f"encoder{idx_label}.pt"))
-                if self.vae.state_decoder is not None:
-                    torch.save(self.vae.state_decoder, os.path.join(save_path, f"state_decoder{idx_label}.pt"))
-                if self.vae.reward_decoder is not None:
-                    torch.save(self.vae.reward_decoder, os.path.join(save_path, f"reward_decoder{idx_label}.pt"))
-                if self.vae.task_decoder is not None:
-                    torch.save(self.vae.task_decoder, os.path.join(save_path, f"task_decoder{idx_label}.pt"))
+                # (intermediate models are grouped by name, so that only the last few are kept if requested;
+                # the rollout copies are the trained VAE models unless it is trained in the background)
+                for [model, name] in [
+                    [self.policy.actor_critic, 'policy'],
+                    [self.vae.rollout_encoder, 'encoder'],
+                    [self.vae.rollout_state_decoder, 'state_decoder'],
+                    [self.vae.rollout_reward_decoder, 'reward_decoder'],
+                    [self.vae.rollout_task_decoder, 'task_decoder']
+                ]:
+                    if model is not None:
+                        self.checkpoint_writer.save(model, os.path.join(save_path, f"{name}{idx_label}.pt"),
+                                                    group=name if idx_label != '' else None)
 
                 # save normalisation params of envs
                 if self.args.norm_rew_for_policy:
@@ -448,10 +553,15 @@ class MetaLearner:
                 #     obs_rms = self.envs.venv.obs_rms
                 #     utl.save_obj(obs_rms, save_path, f"env_obs_rms{idx_label}")
 
+            # so that a resumed run finds the VAE buffer as it was when the models were saved
+            self.vae.rollout_storage.checkpoint()
+
         # --- log some other things ---
 
         if ((self.iter_idx + 1) % self.args.log_interval == 0) and (train_stats is not None):
 
+            self.metrics.log(self.logger.add, self.iter_idx)
+
             self.logger.add('environment/state_max', self.policy_storage.prev_state.max(), self.iter_idx)
             self.logger.add('environment/state_min', self.policy_storage.prev_state.min(), self.iter_idx)
 
@@ -475,10 +585,10 @@ class MetaLearner:
             # log the average weights and gradients of all models (where applicable)
             for [model, name] in [
                 [self.policy.actor_critic, 'policy'],
-                [self.vae.encoder, 'encoder'],
-                [self.vae.reward_decoder, 'reward_decoder'],
-                [self.vae.state_decoder, 'state_transition_decoder'],
-                [self.vae.task_decoder, 'task_decoder']
+                [self.vae.rollout_encoder, 'encoder'],
+                [self.vae.rollout_reward_decoder, 'reward_decoder'],
+                [self.vae.rollout_state_decoder, 'state_transition_decoder'],
+                [self.vae.rollout_task_decoder, 'task_decoder']
             ]:
                 if model is not None:
                     param_list = list(model.parameters())
@@ -21,6 +21,7 @@ class StateTransitionDecoder(nn.Module):
         super(StateTransitionDecoder, self).__init__()
 
         self.args = args
+        self.latent_dim = latent_dim
 
         self.state_encoder = utl.FeatureExtractor(state_dim, state_embed_dim, F.relu)
         self.action_encoder = utl.FeatureExtractor(action_dim, action_embed_dim, F.relu)
@@ -51,6 +52,25 @@ class StateTransitionDecoder(nn.Module):
 
         return self.fc_out(h)
 
+    def embed_inputs(self, state, actions):
+        """
+        Returns the contribution of state/actions to the first layer (without bias).
+        This only has to be computed once per trajectory, and can then be combined with many latents (forward_embedded).
+        """
+
+        # we do the action-normalisation (the the env bounds) here
+        actions = utl.squash_action(actions, self.args)
+
+        ha = self.action_encoder(actions)
+        hs = self.state_encoder(state)
+        h = torch.cat((hs, ha), dim=-1)
+
+        return F.linear(h, first_layer(self).weight[:, self.latent_dim:])
+
+    def forward_embedded(self, latent_state, input_embedding):
+        """ Same as forward, with the state/actions given by their embedding (see embed_inputs) """
+        return forward_embedded(self, latent_state, input_embedding)
+
 
 class RewardDecoder(nn.Module):
     def __init__(self,
@@ -70,6 +90,7 @@ class RewardDecoder(nn.Module):
         super(RewardDecoder, self).__init__()
 
         self.args = args
+        self.latent_dim = latent_dim
 
         self.pred_type = pred_type
         self.multi_head = multi_head
@@ -129,6 +150,31 @@ class RewardDecoder(nn.Module):
 
         return self.fc_out(h)
 
+    def embed_inputs(self, next_state, prev_state=None, actions=None):
+        """
+        Returns the contribution of the states/actions to the first layer (without bias), see StateTransitionDecoder.
+        Not used for the multi-head decoder (which only gets the latent).
+        """
+        assert not self.multi_head
+
+        # we do the action-normalisation (the the env bounds) here
+        if actions is not None:
+            actions = utl.squash_action(actions, self.args)
+
+        h = self.state_encoder(next_state)
+        if self.input_action:
+            ha = self.action_encoder(actions)
+            h = torch.cat((h, ha), dim=-1)
+        if self.input_prev_state:
+            hps = self.state_encoder(prev_state)
+            h = torch.cat((h, hps), dim=-1)
+
+        return F.linear(h, first_layer(self).weight[:, self.latent_dim:])
+
+    def forward_embedded(self, latent_state, input_embedding):
+        """ Same as forward, with the states/actions given by their embedding (see embed_inputs) """
+        return forward_embedded(self, latent_state, input_embedding)
+
 
 class TaskDecoder(nn.Module):
     def __init__(self,
@@ -160,3 +206,27 @@ class TaskDecoder(nn.Module):
             h = F.relu(self.fc_layers[i](h))
 
         return self.fc_out(h)
+
+
+def first_layer(decoder):
+    """ The layer that gets the concatenated [latent, state/action features] as input """
+    return decoder.fc_layers[0] if len(decoder.fc_layers) > 0 else decoder.fc_out
+
+
+def forward_embedded(decoder, latent_state, input_embedding):
+    """
+    Forward pass of a decoder, where the state/action part of the first layer has been precomputed.
+    Since the first layer is linear, this is the same as concatenating the inputs;
+    latent_state and input_embedding are broadcast against each other.
+    """
+
+    layer = first_layer(decoder)
+    h = F.linear(latent_state, layer.weight[:, :decoder.latent_dim], layer.bias) + input_embedding
+    if len(decoder.fc_layers) == 0:
+        return h
+
+    h = F.relu(h)
+    for i in range(1, len(decoder.fc_layers)):
+        h = F.relu(decoder.fc_layers[i](h))
+
+    return decoder.fc_out(h)
@@ -3,6 +3,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
+from torch.nn.utils.rnn import PackedSequence, pad_packed_sequence
 
 from utils import helpers as utl
 
@@ -118,8 +119,13 @@ class RNNEncoder(nn.Module):
         For one-step predictions, sequence_len=1 and hidden_state!=None.
         For feeding in entire trajectories, sequence_len>1 and hidden_state=None.
         In the latter case, we return embeddings of length sequence_len+1 since they include the prior.
+        Trajectories of different lengths can also be given as PackedSequences (see forward_packed).
         """
 
+        if isinstance(actions, PackedSequence):
+            assert hidden_state is None and detach_every is None
+            return self.forward_packed(actions, states, rewards, return_prior, sample)
+
         # we do the action-normalisation (the the env bounds) here
         actions = utl.squash_action(actions, self.args)
 
@@ -182,3 +188,54 @@ class RNNEncoder(nn.Module):
             latent_sample, latent_mean, latent_logvar = latent_sample[0], latent_mean[0], latent_logvar[0]
 
         return latent_sample, latent_mean, latent_logvar, output
+
+    def forward_packed(self, actions, states, rewards, return_prior, sample=True):
+        """
+        Encodes entire trajectories of different lengths, given as PackedSequences (packed with the same lengths),
+        starting from the prior. The feature extractors and the GRU only run on the actual (unpadded) timesteps.
+        Outputs are zero-padded to the longest trajectory: (1+max_sequence_len) * batch_size * dim if return_prior,
+        and are meaningless beyond the length of each trajectory.
+        """
+
+        # we do the action-normalisation (the the env bounds) here
+        action_data = utl.squash_action(actions.data, self.args)
+
+        # extract features for states, actions, rewards (shape: total number of timesteps x dim)
+        ha = self.action_encoder(action_data)
+        hs = self.state_encoder(states.data)
+        hr = self.reward_encoder(rewards.data)
+        h = torch.cat((ha, hs, hr), dim=-1)
+
+        # forward through fully connected layers before GRU
+        for i in range(len(self.fc_before_gru)):
+            h = F.relu(self.fc_before_gru[i](h))
+
+        # start with the prior
+        batch_size = actions.batch_sizes[0].item()
+        prior_sample, prior_mean, prior_logvar, prior_hidden_state = self.prior(batch_size)
+
+        # GRU cell (only steps through the timesteps that are there)
+        h = PackedSequence(h, actions.batch_sizes, actions.sorted_indices, actions.unsorted_indices)
+        output, _ = self.gru(h, prior_hidden_state.clone())
+        output, _ = pad_packed_sequence(output)
+        gru_h = output.clone()
+
+        # forward through fully connected layers after GRU
+        for i in range(len(self.fc_after_gru)):
+            gru_h = F.relu(self.fc_after_gru[i](gru_h))
+
+        # outputs
+        latent_mean = self.fc_mu(gru_h)
+        latent_logvar = self.fc_logvar(gru_h)
+        if sample:
+            latent_sample = self.reparameterise(latent_mean, latent_logvar)
+        else:
+            latent_sample = latent_mean
+
+        if return_prior:
+            latent_sample = torch.cat((prior_sample, latent_sample))
+            latent_mean = torch.cat((prior_mean, latent_mean))
+            latent_logvar = torch.cat((prior_logvar, latent_logvar))
+            output = torch.cat((prior_hidden_state, output))
+
+        return latent_sample, latent_mean, latent_logvar, output
@@ -0,0 +1,525 @@
+"""
+Benchmarks for the hot paths of the rollouts and updates (online storages, returns, PPO updates, encoder, VAE storage).
+Each benchmark is run for every combination of the given rollout lens / num processes / latent and hidden sizes,
+with metaworld shaped inputs (39 dim observations + done flag, 4 dim actions), and the timings are written to json.
+Compare against the json of an earlier commit with --compare to find regressions.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import sys
+import time
+import warnings
+from copy import deepcopy
+
+import numpy as np
+import torch
+from gym.spaces import Box
+
+from algorithms.custom_ppo import CustomPPO, BiHemPPO
+from algorithms.custom_storage import CustomOnlineStorage, BiHemOnlineStorage
+from models.combined_actor_critic import ActorCritic, BiHemActorCritic
+from models.encoder import RNNEncoder
+from models.policy import Policy
+from utils.custom_helpers import get_args_from_config, freeze_parameters
+from utils.helpers import get_commit
+from utils.storage_vae import RolloutStorageVAE
+
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+## metaworld shapes: the done flag is added to the observations
+STATE_DIM = 40
+ACTION_SPACE = Box(low=-1., high=1., shape=(4,), dtype=np.float32)
+
+
+def synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def time_function(function, setup=None, repeats=10, warmup=2):
+    """
+    Times function(context), where context is what setup() returns (setup is run before every call, and not timed).
+    Returns the timings in milliseconds.
+    """
+    times = []
+    for i in range(warmup + repeats):
+        context = setup() if setup is not None else None
+        synchronize()
+        start = time.perf_counter()
+        function(context)
+        synchronize()
+        if i >= warmup:
+            times.append(1000 * (time.perf_counter() - start))
+    return times
+
+
+## networks / agents / storages as created by the ContinualLearner
+
+def make_networks(config, latent_dim, hidden_size):
+    args = deepcopy(config)
+    args.latent_dim = latent_dim
+    args.encoder_gru_hidden_size = hidden_size
+
+    policy = Policy(
+        args=args,
+        pass_state_to_policy=args.pass_state_to_policy,
+        pass_latent_to_policy=args.pass_latent_to_policy,
+        pass_belief_to_policy=args.pass_belief_to_policy,
+        pass_task_to_policy=args.pass_task_to_policy,
+        dim_state=STATE_DIM,
+        dim_latent=args.latent_dim * 2,
+        dim_belief=0,
+        dim_task=0,
+        hidden_layers=args.policy_layers,
+        activation_function=args.policy_activation_function,
+        policy_initialisation=args.policy_initialisation,
+        action_space=ACTION_SPACE,
+        init_std=args.policy_init_std
+    ).to(device)
+
+    encoder = RNNEncoder(
+        args=args,
+        layers_before_gru=args.encoder_layers_before_gru,
+        hidden_size=args.encoder_gru_hidden_size,
+        layers_after_gru=args.encoder_layers_after_gru,
+        latent_dim=args.latent_dim,
+        action_dim=ACTION_SPACE.shape[0],
+        action_embed_dim=args.action_embedding_size,
+        state_dim=STATE_DIM,
+        state_embed_dim=args.state_embedding_size,
+        reward_size=1,
+        reward_embed_size=args.reward_embedding_size,
+    ).to(device)
+
+    return policy, encoder
+
+
+def make_agent(args, params, bicameral=False):
+    """ Returns the agent and its (empty) online storage """
+    config = get_args_from_config(args.run_folder)
+    left_policy, left_encoder = make_networks(config, params['latent_dim'], params['hidden_size'])
+    ppo_args = dict(
+        value_loss_coef=1.,
+        entropy_coef=5e-3,
+        policy_optimiser='adam',
+        lr=5e-4,
+        eps=1e-8,
+        clip_param=0.2,
+        ppo_epoch=args.ppo_epoch,
+        num_mini_batch=args.num_mini_batch,
+        use_huber_loss=False,
+        use_clipped_value_loss=False,
+        context_window=None
+    )
+
+    if not bicameral:
+        agent = CustomPPO(actor_critic=ActorCritic(left_policy, left_encoder), **ppo_args)
+        storage = CustomOnlineStorage(
+            params['rollout_len'],
+            params['num_processes'],
+            STATE_DIM,
+            0,
+            0,
+            ACTION_SPACE,
+            agent.actor_critic.encoder.hidden_size,
+            agent.actor_critic.encoder.latent_dim,
+            True
+        )
+        return agent, storage
+
+    ## the right hemisphere is the (frozen) meta-trained network, so it keeps the sizes from the config
+    right_policy, right_encoder = make_networks(config, config.latent_dim, config.encoder_gru_hidden_size)
+    freeze_parameters(right_policy)
+    freeze_parameters(right_encoder)
+    ac = BiHemActorCritic(
+        left_policy, left_encoder,
+        right_policy, right_encoder,
+        STATE_DIM,
+        ACTION_SPACE.shape[0],
+        init_std=0.5
+    ).to(device)
+    agent = BiHemPPO(actor_critic=ac, use_gating_penalty=True, gating_alpha=0.75, gating_beta=0.1, **ppo_args)
+    storage = BiHemOnlineStorage(
+        params['rollout_len'],
+        params['num_processes'],
+        STATE_DIM,
+        0,
+        0,
+        ACTION_SPACE,
+        gate_hidden_size=ac.gating_network.hidden_size,
+        left_hidden_size=ac.left_actor_critic.encoder.hidden_size,
+        right_hidden_size=ac.right_actor_critic.encoder.hidden_size,
+        gate_latent_dim=ac.gating_network.latent_dim,
+        left_latent_dim=ac.left_actor_critic.encoder.latent_dim,
+        right_latent_dim=ac.right_actor_critic.encoder.latent_dim,
+        normalise_rewards=True
+    )
+    return agent, storage
+
+
+def collect_rollout(agent, storage, bicameral=False):
+    """
+    Fills the storage like ContinualLearner.train does (incl. the returns),
+    with random observations / rewards instead of env steps. All processes are done at the end of the rollout.
+    Returns the storage.
+    """
+    num_steps, num_processes = storage.num_steps, storage.num_processes
+    storage.after_update()
+
+    with torch.no_grad():
+        latent, hidden_state = agent.get_prior(num_processes)
+        if bicameral:
+            storage.gate_hidden_states[:1].copy_(hidden_state[0])
+            storage.left_hidden_states[:1].copy_(hidden_state[1])
+            storage.right_hidden_states[:1].copy_(hidden_state[2])
+            storage.gate_latent.append(latent[0])
+            storage.left_latent.append(latent[1])
+            storage.right_latent.append(latent[2])
+        else:
+            storage.hidden_states[:1].copy_(hidden_state)
+            storage.latent.append(latent)
+
+    obs = torch.randn(num_processes, STATE_DIM, device=device)
+    for step in range(num_steps):
+        with torch.no_grad():
+            if bicameral:
+                (value, left_value, right_value), action, gate_values = agent.act(obs.unsqueeze(0), latent, None, None)
+            else:
+                value, action = agent.act(obs, latent, None, None)
+
+        next_obs = torch.randn(num_processes, STATE_DIM, device=device)
+        rew_raw = torch.randn(1, num_processes, 1, device=device)
+        done = np.full(num_processes, step == num_steps - 1)
+        masks_done = torch.FloatTensor([[0.0] if _done else [1.0] for _done in done]).to(device)
+
+        with torch.no_grad():
+            if bicameral:
+                value_errors = (rew_raw - left_value, rew_raw - right_value)
+                latent, hidden_state = agent.get_latent(
+                    action, next_obs, rew_raw, value_errors, gate_values, hidden_state, return_prior=False)
+            else:
+                latent, hidden_state = agent.get_latent(action, next_obs, rew_raw, hidden_state, return_prior=False)
+
+        storage.next_state[step] = next_obs.clone()
+        storage.insert(
+            state=next_obs.squeeze(),
+            belief=None,
+            task=None,
+            actions=action.double(),
+            rewards_raw=rew_raw.squeeze(0),
+            rewards_normalised=rew_raw.squeeze(0),
+            value_preds=(value.squeeze(0), left_value.squeeze(0), right_value.squeeze(0)) if bicameral else value.squeeze(0),
+            masks=masks_done.squeeze(0),
+            done=torch.from_numpy(done)[:, None].float(),
+            hidden_states=hidden_state if bicameral else hidden_state.squeeze(),
+            latent=latent,
+        )
+        obs = next_obs
+
+    with torch.no_grad():
+        if bicameral:
+            value, _, _ = agent.get_value(obs.unsqueeze(0), latent, None, None)
+        else:
+            value = agent.get_value(obs.unsqueeze(0), latent, None, None)
+    storage.compute_returns(next_value=value.detach(), use_gae=True, gamma=0.99, tau=0.95,
+                            use_proper_time_limits=False)
+    return storage
+
+
+def get_advantages(storage):
+    advantages = storage.returns[:-1] - storage.value_preds[:-1]
+    return (advantages - advantages.mean()) / (advantages.std() + 1e-5)
+
+
+## benchmarks: each takes the runner args and the parameters, and returns the timings (ms)
+
+def bench_storage_insert(args, params):
+    """ CustomOnlineStorage.insert, for a whole rollout """
+    agent, storage = make_agent(args, params)
+    num_steps, num_processes = params['rollout_len'], params['num_processes']
+    with torch.no_grad():
+        latent, hidden_state = agent.get_prior(num_processes)
+        _, action = agent.act(torch.zeros(num_processes, STATE_DIM, device=device), latent, None, None)
+        latent, hidden_state = agent.get_latent(
+            action, torch.zeros(num_processes, STATE_DIM, device=device),
+            torch.zeros(1, num_processes, 1, device=device), hidden_state)
+    inputs = dict(
+        state=torch.randn(num_processes, STATE_DIM, device=device),
+        belief=None,
+        task=None,
+        actions=action.double(),
+        rewards_raw=torch.randn(num_processes, 1, device=device),
+        rewards_normalised=torch.randn(num_processes, 1, device=device),
+        value_preds=torch.randn(num_processes, 1, device=device),
+        masks=torch.ones(num_processes, 1, device=device),
+        done=torch.zeros(num_processes, 1),
+        hidden_states=hidden_state.squeeze(),
+        latent=latent,
+    )
+
+    def insert_rollout(_):
+        for _ in range(num_steps):
+            storage.insert(**inputs)
+
+    return time_function(insert_rollout, setup=storage.after_update, repeats=args.repeats, warmup=args.warmup)
+
+
+def bench_feed_forward_generator(args, params):
+    """ CustomOnlineStorage.feed_forward_generator, one epoch of minibatches """
+    agent, storage = make_agent(args, params)
+    collect_rollout(agent, storage)
+    with torch.no_grad():
+        storage.before_update(agent.actor_critic)
+    advantages = get_advantages(storage)
+
+    def epoch(_):
+        for _ in storage.feed_forward_generator(advantages, args.num_mini_batch):
+            pass
+
+    return time_function(epoch, repeats=args.repeats, warmup=args.warmup)
+
+
+def bench_compute_returns(args, params):
+    """ CustomOnlineStorage.compute_returns (GAE) """
+    agent, storage = make_agent(args, params)
+    collect_rollout(agent, storage)
+    next_value = torch.randn(params['num_processes'], 1, device=device)
+
+    def compute_returns(_):
+        storage.compute_returns(next_value=next_value, use_gae=True, gamma=0.99, tau=0.95,
+                                use_proper_time_limits=False)
+
+    return time_function(compute_returns, repeats=args.repeats, warmup=args.warmup)
+
+
+def bench_recompute_embeddings(args, params):
+    """ CustomPPO._recompute_embeddings, over the whole rollout """
+    agent, storage = make_agent(args, params)
+    collect_rollout(agent, storage)
+
+    def recompute(_):
+        agent._recompute_embeddings(storage, sample=False, update_idx=1, detach_every=None)
+
+    return time_function(recompute, repeats=args.repeats, warmup=args.warmup)
+
+
+def bench_ppo_update(args, params):
+    """ CustomPPO.update (all epochs) on a fresh rollout """
+    agent, storage = make_agent(args, params)
+    return time_function(agent.update, setup=lambda: collect_rollout(agent, storage),
+                         repeats=args.update_repeats, warmup=1)
+
+
+def bench_bihem_ppo_update(args, params):
+    """ BiHemPPO.update (all epochs) on a fresh rollout """
+    agent, storage = make_agent(args, params, bicameral=True)
+    return time_function(agent.update, setup=lambda: collect_rollout(agent, storage, bicameral=True),
+                         repeats=args.update_repeats, warmup=1)
+
+
+def make_encoder(args, params):
+    config = get_args_from_config(args.run_folder)
+    _, encoder = make_networks(config, params['latent_dim'], params['hidden_size'])
+    return encoder
+
+
+def bench_encoder_step(args, params):
+    """ RNNEncoder forward for a single step of all processes (as during the rollouts, no gradients) """
+    encoder = make_encoder(args, params)
+    num_processes = params['num_processes']
+    actions = torch.randn(1, num_processes, ACTION_SPACE.shape[0], device=device)
+    states = torch.randn(1, num_processes, STATE_DIM, device=device)
+    rewards = torch.randn(1, num_processes, 1, device=device)
+    hidden_state = torch.zeros(1, num_processes, params['hidden_size'], device=device)
+
+    def step(_):
+        with torch.no_grad():
+            encoder(actions, states, rewards, hidden_state, return_prior=False, sample=False)
+
+    return time_function(step, repeats=args.repeats, warmup=args.warmup)
+
+
+def bench_encoder_sequence(args, params):
+    """ RNNEncoder forward for whole trajectories starting from the prior (as in the updates, with gradients) """
+    encoder = make_encoder(args, params)
+    num_steps, num_processes = params['rollout_len'], params['num_processes']
+    actions = torch.randn(num_steps, num_processes, ACTION_SPACE.shape[0], device=device)
+    states = torch.randn(num_steps, num_processes, STATE_DIM, device=device)
+    rewards = torch.randn(num_steps, num_processes, 1, device=device)
+
+    def sequence(_):
+        encoder(actions, states, rewards, None, return_prior=True, sample=False)
+
+    return time_function(sequence, repeats=args.repeats, warmup=args.warmup)
+
+
+def make_vae_storage(args, params):
+    return RolloutStorageVAE(
+        num_processes=params['num_processes'],
+        max_trajectory_len=params['rollout_len'],
+        zero_pad=True,
+        max_num_rollouts=args.vae_buffer_size,
+        state_dim=STATE_DIM,
+        action_dim=ACTION_SPACE.shape[0],
+        vae_buffer_add_thresh=1,
+        task_dim=None
+    )
+
+
+def vae_inputs(params):
+    num_processes = params['num_processes']
+    return (torch.randn(num_processes, STATE_DIM, device=device),
+            torch.randn(num_processes, ACTION_SPACE.shape[0], device=device),
+            torch.randn(num_processes, STATE_DIM, device=device),
+            torch.randn(num_processes, 1, device=device))
+
+
+def insert_vae_trajectory(vae_storage, params, inputs):
+    not_done, done = torch.zeros(params['num_processes']), torch.ones(params['num_processes'])
+    for step in range(params['rollout_len']):
+        vae_storage.insert(*inputs, done if step == params['rollout_len'] - 1 else not_done, None)
+
+
+def bench_vae_storage_insert(args, params):
+    """ RolloutStorageVAE.insert, for a whole trajectory (incl. moving it into the buffer) """
+    vae_storage = make_vae_storage(args, params)
+    inputs = vae_inputs(params)
+    return time_function(lambda _: insert_vae_trajectory(vae_storage, params, inputs),
+                         repeats=args.repeats, warmup=args.warmup)
+
+
+def bench_vae_storage_get_batch(args, params):
+    """ RolloutStorageVAE.get_batch from a filled buffer """
+    vae_storage = make_vae_storage(args, params)
+    inputs = vae_inputs(params)
+    while len(vae_storage) < args.vae_batch_num_trajs:
+        insert_vae_trajectory(vae_storage, params, inputs)
+    return time_function(lambda _: vae_storage.get_batch(batchsize=args.vae_batch_num_trajs),
+                         repeats=args.repeats, warmup=args.warmup)
+
+
+## name: (benchmark, parameters it depends on)
+BENCHMARKS = {
+    'storage_insert': (bench_storage_insert, ('rollout_len', 'num_processes', 'latent_dim', 'hidden_size')),
+    'feed_forward_generator': (bench_feed_forward_generator, ('rollout_len', 'num_processes', 'latent_dim')),
+    'compute_returns': (bench_compute_returns, ('rollout_len', 'num_processes')),
+    'recompute_embeddings': (bench_recompute_embeddings, ('rollout_len', 'num_processes', 'latent_dim', 'hidden_size')),
+    'ppo_update': (bench_ppo_update, ('rollout_len', 'num_processes', 'latent_dim', 'hidden_size')),
+    'bihem_ppo_update': (bench_bihem_ppo_update, ('rollout_len', 'num_processes', 'latent_dim', 'hidden_size')),
+    'encoder_step': (bench_encoder_step, ('num_processes', 'latent_dim', 'hidden_size')),
+    'encoder_sequence': (bench_encoder_sequence, ('rollout_len', 'num_processes', 'latent_dim', 'hidden_size')),
+    'vae_storage_insert': (bench_vae_storage_insert, ('rollout_len', 'num_processes')),
+    'vae_storage_get_batch': (bench_vae_storage_get_batch, ('rollout_len', 'num_processes')),
+}
+
+
+def result_key(result):
+    return result['name'], tuple(sorted(result['params'].items()))
+
+
+def summarise(name, params, times):
+    return {
+        'name': name,
+        'params': params,
+        'repeats': len(times),
+        'mean_ms': float(np.mean(times)),
+        'std_ms': float(np.std(times)),
+        'min_ms': float(np.min(times)),
+        'median_ms': float(np.median(times)),
+    }
+
+
+def compare(results, previous_path, threshold):
+    """ Prints the change in median time w.r.t. a previous run, returns the benchmarks that got slower than threshold """
+    with open(previous_path) as f:
+        previous = {result_key(result): result for result in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        if result_key(result) not in previous:
+            continue
+        ratio = result['median_ms'] / previous[result_key(result)]['median_ms']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(result)
+            flag = '  <- REGRESSION'
+        print(f"{result['name']} {result['params']}: {ratio:.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmarks', type=str, nargs='+', default=list(BENCHMARKS.keys()), choices=list(BENCHMARKS.keys()),
+                        help='benchmarks to run (default: all)')
+    parser.add_argument('--rollout_len', type=int, nargs='+', default=[100, 500], help='rollout lens to benchmark')
+    parser.add_argument('--num_processes', type=int, nargs='+', default=[4, 20], help='numbers of processes to benchmark')
+    parser.add_argument('--latent_dim', type=int, nargs='+', default=[256], help='latent dims (of the left hemisphere) to benchmark')
+    parser.add_argument('--hidden_size', type=int, nargs='+', default=[128], help='encoder gru hidden sizes (of the left hemisphere) to benchmark')
+    parser.add_argument('--run_folder', type=str, default='rl2_baseline/rl2_bicameral_baseline',
+                        help='folder with the config.json the networks are created from (the latent / hidden sizes are overwritten)')
+    parser.add_argument('--ppo_epoch', type=int, default=16, help='PPO update epochs')
+    parser.add_argument('--num_mini_batch', type=int, default=4, help='num minibatches per update')
+    parser.add_argument('--vae_buffer_size', type=int, default=1000, help='number of trajectories in the VAE buffer')
+    parser.add_argument('--vae_batch_num_trajs', type=int, default=10, help='number of trajectories in a VAE batch')
+    parser.add_argument('--repeats', type=int, default=20, help='timed repeats per benchmark')
+    parser.add_argument('--update_repeats', type=int, default=3, help='timed repeats for the (slow) PPO update benchmarks')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed runs before the timed repeats')
+    parser.add_argument('--num_threads', type=int, default=None, help='torch threads (default: torch default)')
+    parser.add_argument('--seed', type=int, default=73)
+    parser.add_argument('--output', type=str, default=None, help='json file to write the results to (default: benchmarks_<date>.json)')
+    parser.add_argument('--compare', type=str, default=None, help='json of a previous run to compare against')
+    parser.add_argument('--regression_threshold', type=float, default=1.1,
+                        help='with --compare, a benchmark whose median time grew by more than this factor is a regression (exit code 1)')
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    grid = [dict(zip(('rollout_len', 'num_processes', 'latent_dim', 'hidden_size'), values))
+            for values in itertools.product(args.rollout_len, args.num_processes, args.latent_dim, args.hidden_size)]
+
+    results = []
+    done = set()
+    for name in args.benchmarks:
+        benchmark, param_names = BENCHMARKS[name]
+        for full_params in grid:
+            params = {param: full_params[param] for param in param_names}
+            key = (name, tuple(sorted(params.items())))
+            # benchmarks that don't depend on all parameters only run once per setting of theirs
+            if key in done:
+                continue
+            done.add(key)
+
+            torch.manual_seed(args.seed)
+            np.random.seed(args.seed)
+            ## (e.g. the check of the recomputed embeddings in the updates)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                times = benchmark(args, {**full_params, **params})
+            results.append(summarise(name, params, times))
+            print(f"{name} {params}: {results[-1]['median_ms']:.3f} ms (median of {len(times)})")
+
+    output = args.output or 'benchmarks_{}.json'.format(datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': get_commit(),
+            'date': datetime.datetime.now().isoformat(),
+            'torch': torch.__version__,
+            'device': str(device),
+            'num_threads': torch.get_num_threads(),
+            'settings': vars(args),
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare is not None:
+        regressions = compare(results, args.compare, args.regression_threshold)
+        if len(regressions) > 0:
+            print(f"{len(regressions)} benchmark(s) got slower by more than {args.regression_threshold}x")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,9 @@
-import metaworld
 import argparse
 import datetime
 import json
 import os
 import torch
 
-from continualworld_utils.constants import TASK_SEQS
 from continuallearner import ContinualLearner
 
 from utils.helpers import boolean_argument
@@ -21,6 +19,7 @@ def main():
     parser.add_argument('--algorithm', type = str, default='left_only', help='type of algorithm to run, choose: left_only, right_only, bicameral')
     parser.add_argument('--run_folder', help = 'folder from which to load a network - requires config.json if left_only or bicameral, requires policy and encoder networks if right_only')
     parser.add_argument('--log_folder', default='./logs/continual_learning/')
+    parser.add_argument('--resume_from', type = str, default = None, help = 'training_state.pt (or the log folder containing it) of a previous run to resume from (logs into that folder, after dropping the results logged after the checkpoint)')
     parser.add_argument('--env_name', type = str, default = 'push-v2',
                         help='tasks to train on - choose one of: ["push-v2", "reach-v2", "pick-place-v2", "door-open-v2", "button-press-v2", "faucet-open-v2", "reach-wall-v2", "push-wall-v2", "bin-picking-v2"]')
 
@@ -31,6 +30,13 @@ def main():
     parser.add_argument('--randomization', type=str, default='deterministic', help='randomisation setting for CW must be one of: deterministic, random_init_all, random_init_fixed20, random_init_small_box')
     parser.add_argument('--task_set', type=str, default='test', help='run on training or testing tasks for ML3 - default is test')
 
+    ## synthetic env (no MuJoCo / MetaWorld needed), e.g. to benchmark the learner
+    parser.add_argument('--synthetic_env', type=boolean_argument, default=False, help="use synthetic MetaWorld-shaped envs (deterministic dynamics, dense reward, success info) instead of MetaWorld")
+    parser.add_argument('--synthetic_obs_dim', type=int, default=39, help="observation dim of the synthetic envs (the done flag is appended, as for MetaWorld)")
+    parser.add_argument('--synthetic_action_dim', type=int, default=4, help="action dim of the synthetic envs")
+    parser.add_argument('--synthetic_episode_len', type=int, default=500, help="episode length of the synthetic envs")
+    parser.add_argument('--synthetic_step_latency', type=float, default=0., help="seconds each synthetic env step takes, to mimic the simulation cost")
+
     ## Arguments for bicameral algorithm
     ##NOTE: There are some parameter settings here that conflict - add checks?
     parser.add_argument('--init_std', type = float, default=0.5, help = 'standard deviation for bicameral action dist')
@@ -68,6 +74,13 @@ def main():
     ## admin stuff
     parser.add_argument('--seed', type=int, default=73, help="set the seed for maximum reproducibility")
     parser.add_argument('--eval_every', type=int, default=10, help="logging frequency where integer value is number of updates")
+    parser.add_argument('--background_eval', type=boolean_argument, default=False, help="evaluate in a separate process (on snapshots of the agent) instead of pausing training")
+    parser.add_argument('--quantile_sketch_size', type=int, default=200, help="size of the streaming sketches used for the reward / gating quantiles (exact up to about this many values per episode)")
+    parser.add_argument('--results_formats', type=str, nargs='+', default=['csv'], help="formats to write the results in, any of csv, parquet, arrow (the latter two need pyarrow)")
+    parser.add_argument('--results_flush_every', type=int, default=100, help="number of result rows to buffer before writing them to disk")
+    parser.add_argument('--memory_report_every', type=int, default=0, help="log the memory held by the storage / models / autograd graph / env workers to tensorboard every n updates (0: never). The report is always printed at the start and after the first update")
+    parser.add_argument('--metrics_every', type=int, default=10, help="log throughput / latency metrics (env fps, policy forward, encoder update, update and eval durations, worker idle fraction) to tensorboard every n updates (0: never)")
+    parser.add_argument('--time_env_workers', type=boolean_argument, default=False, help="have the env workers time their steps, for the worker idle fraction / step duration in the throughput metrics")
 
     args, rest_args = parser.parse_known_args()
 
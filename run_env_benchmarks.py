@@ -0,0 +1,189 @@
+"""
+Env throughput benchmark: steps / sec and step latency (p50 / p99) of the vec-envs as the number of processes grows,
+for the continual learning envs (prepare_parallel_envs) or the meta-learning envs (make_vec_envs).
+For parallel envs, a second pass has the workers time their env steps, which splits each step into the simulation
+time (of the slowest worker) and the overhead of the communication / serialisation.
+"""
+import argparse
+import datetime
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from environments.custom_env_utils import prepare_parallel_envs, prepare_base_envs, prepare_synthetic_envs
+from environments.env_utils.vec_env.subproc_vec_env import SubprocVecEnv
+from environments.parallel_envs import make_vec_envs
+from utils.helpers import boolean_argument, get_commit
+
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+
+def default_num_processes():
+    """ 1, 2, 4, ... up to the number of cores """
+    num_cores = os.cpu_count()
+    num_processes = [2 ** i for i in range(int(np.log2(num_cores)) + 1)]
+    if num_processes[-1] != num_cores:
+        num_processes.append(num_cores)
+    return num_processes
+
+
+def make_envs(args, num_processes):
+    if args.vec_env == 'continual':
+        if args.synthetic_env:
+            base_envs = prepare_synthetic_envs(
+                args.tasks,
+                obs_dim=args.synthetic_obs_dim,
+                action_dim=args.synthetic_action_dim,
+                max_episode_steps=args.synthetic_episode_len,
+                step_latency=args.synthetic_step_latency,
+                seed=args.seed)
+        else:
+            from environments.custom_metaworld_benchmark import ML3
+            base_envs = prepare_base_envs(args.tasks, benchmark=ML3(), task_set=args.task_set,
+                                          randomization=args.randomization)
+        # (the continual env never moves on to the next task during the benchmark)
+        return prepare_parallel_envs(
+            envs=base_envs,
+            steps_per_env=10 ** 9,
+            num_processes=num_processes,
+            seed=args.seed,
+            gamma=0.99,
+            normalise_rew=True,
+            device=device
+        )
+
+    return make_vec_envs(
+        env_name=args.env_name,
+        seed=args.seed,
+        num_processes=num_processes,
+        gamma=0.99,
+        device=device,
+        episodes_per_task=args.episodes_per_task,
+        normalise_rew=True,
+        ret_rms=None,
+        tasks=None,
+        batched=args.batched_env
+    )
+
+
+def sample_actions(envs):
+    actions = np.array([envs.action_space.sample() for _ in range(envs.num_envs)])
+    return torch.from_numpy(actions).reshape(envs.num_envs, -1)
+
+
+def step(envs):
+    """ Steps all envs with random actions, resets those that are done. Returns the step latency """
+    actions = sample_actions(envs)
+    start = time.perf_counter()
+    _, _, done, _ = envs.step(actions)
+    latency = time.perf_counter() - start
+
+    done_indices = np.argwhere(np.asarray(done).reshape(-1)).reshape(-1)
+    if len(done_indices) == envs.num_envs:
+        envs.reset()
+    elif len(done_indices) > 0:
+        envs.reset(indices=done_indices.tolist())
+    return latency
+
+
+def percentiles_ms(times):
+    return {'p50_ms': float(1000 * np.percentile(times, 50)), 'p99_ms': float(1000 * np.percentile(times, 99))}
+
+
+def benchmark(args, num_processes):
+    envs = make_envs(args, num_processes)
+    envs.reset()
+    vec_env = envs.unwrapped
+    timed_workers = isinstance(vec_env, SubprocVecEnv)
+
+    for _ in range(args.warmup):
+        step(envs)
+
+    start = time.perf_counter()
+    latencies = np.array([step(envs) for _ in range(args.num_steps)])
+    total_time = time.perf_counter() - start
+
+    result = {
+        'num_processes': num_processes,
+        'vec_env': vec_env.__class__.__name__,
+        'steps_per_sec': num_processes * args.num_steps / total_time,
+        'step_latency': percentiles_ms(latencies),
+    }
+    if timed_workers:
+        # the workers only keep the total of their step times: collect them after every step
+        # (outside of the step latency, in a separate pass so the throughput above isn't affected)
+        vec_env.set_timing(True)
+        latencies, sim_times = [], []
+        for _ in range(args.num_steps):
+            latencies.append(step(envs))
+            step_times, _ = vec_env.pop_timing()
+            sim_times.append(step_times.max())
+        vec_env.set_timing(False)
+        latencies, sim_times = np.array(latencies), np.array(sim_times)
+        # the step waits for the slowest worker, everything on top of its env step is overhead
+        result['sim_time'] = percentiles_ms(sim_times)
+        result['overhead_time'] = percentiles_ms(latencies - sim_times)
+        result['sim_fraction'] = float(sim_times.sum() / latencies.sum())
+
+    envs.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vec_env', type=str, default='continual', choices=['continual', 'varibad'],
+                        help='benchmark the continual learning envs (prepare_parallel_envs) or the meta-learning envs (make_vec_envs)')
+    parser.add_argument('--num_processes', type=int, nargs='+', default=None,
+                        help='numbers of processes to benchmark (default: 1, 2, 4, ... up to the number of cores)')
+    parser.add_argument('--num_steps', type=int, default=2000, help='timed steps (of all processes) per number of processes')
+    parser.add_argument('--warmup', type=int, default=100, help='untimed steps before the timed ones')
+    parser.add_argument('--seed', type=int, default=73)
+
+    ## continual envs
+    parser.add_argument('--tasks', type=str, nargs='+', default=['push-v2'], help='tasks of the continual env')
+    parser.add_argument('--randomization', type=str, default='random_init_fixed20', help='randomisation setting for CW')
+    parser.add_argument('--task_set', type=str, default='test', help='run on training or testing tasks for ML3')
+    parser.add_argument('--synthetic_env', type=boolean_argument, default=True, help="use the synthetic MetaWorld-shaped envs instead of MetaWorld")
+    parser.add_argument('--synthetic_obs_dim', type=int, default=39, help="observation dim of the synthetic envs")
+    parser.add_argument('--synthetic_action_dim', type=int, default=4, help="action dim of the synthetic envs")
+    parser.add_argument('--synthetic_episode_len', type=int, default=500, help="episode length of the synthetic envs")
+    parser.add_argument('--synthetic_step_latency', type=float, default=0., help="seconds each synthetic env step takes, to mimic the simulation cost")
+
+    ## meta-learning envs
+    parser.add_argument('--env_name', type=str, default='PointEnv-v0', help='env for make_vec_envs')
+    parser.add_argument('--episodes_per_task', type=int, default=2, help='episodes per task (BAMDP)')
+    parser.add_argument('--batched_env', type=boolean_argument, default=False, help='use the batched implementation of the env if there is one')
+
+    parser.add_argument('--output', type=str, default=None, help='json file to write the results to (default: env_benchmarks_<date>.json)')
+    args = parser.parse_args()
+
+    results = []
+    for num_processes in (args.num_processes or default_num_processes()):
+        result = benchmark(args, num_processes)
+        results.append(result)
+        summary = f"{num_processes} processes: {result['steps_per_sec']:.0f} steps/s, " \
+                  f"latency p50 {result['step_latency']['p50_ms']:.3f} ms / p99 {result['step_latency']['p99_ms']:.3f} ms"
+        if 'sim_time' in result:
+            summary += f", overhead p50 {result['overhead_time']['p50_ms']:.3f} ms ({100 * (1 - result['sim_fraction']):.0f}% of the step time)"
+        print(summary)
+
+    best = max(results, key=lambda result: result['steps_per_sec'])
+    print(f"Highest throughput with {best['num_processes']} processes")
+
+    output = args.output or 'env_benchmarks_{}.json'.format(datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': get_commit(),
+            'date': datetime.datetime.now().isoformat(),
+            'num_cores': os.cpu_count(),
+            'settings': vars(args),
+            'results': results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
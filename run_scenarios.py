@@ -1,11 +1,17 @@
-import subprocess
 import argparse
+import multiprocessing
+import os
+import sys
+
+from utils.run_scheduler import RunScheduler
 
 
 SCRIPT = './run_continual_learner.py'
 parser = argparse.ArgumentParser()
 
-parser.add_argument('--algorithm', type = str, default = 'random', help = 'Give a name to your run for ease of logging')
+parser.add_argument('--algorithm', type = str, nargs='+', default = ['random'], help = 'algorithm(s) to run')
+parser.add_argument('--seed', type = str, nargs='+', default = None, help = 'seed(s) to run - default is the seed of run_continual_learner.py')
+parser.add_argument('--envs', type = str, nargs='+', default = None, help = 'environments to run - default is all')
 parser.add_argument('--steps_per_env', type=str, default='1000000', help = 'number of iters')
 parser.add_argument('--log_folder', type=str, default='logs/baselines/random_agent', help = 'where to save results')
 parser.add_argument('--randomization', type=str, default='random_init_fixed20', help = 'whether env randomises on reset')
@@ -13,6 +19,11 @@ parser.add_argument('--run_folder', type=str, default='rl2_baseline/bicameral_rl
 parser.add_argument('--num_processes', type=str, default='8')
 parser.add_argument('--task_set', type=str, default='test', help='run on training or testing tasks for ML3 - default is test')
 
+## scheduling
+parser.add_argument('--max_cores', type=int, default=multiprocessing.cpu_count(), help='number of cores to pack the runs onto')
+parser.add_argument('--retries', type=int, default=1, help='how often to rerun a failed run')
+parser.add_argument('--sweep_state', type=str, default=None, help='json file tracking the sweep, to resume it - default is in the log folder')
+
 
 args, _ = parser.parse_known_args()
 envs = [
@@ -26,23 +37,48 @@ envs = [
     'button-press-v2', 
     'faucet-open-v2'
 ]
+if args.envs is not None:
+    envs = args.envs
 
 base_args = [
     '--run_folder', args.run_folder,
     '--randomization', args.randomization,
-    '--algorithm', args.algorithm, 
     '--steps_per_env', args.steps_per_env,
     '--log_folder', args.log_folder,
     '--num_processes', args.num_processes,
     '--task_set', args.task_set
 ]
 
-for env in envs:
-    print(f"RUNNING: {env}")
-    additional_args = [
-        '--env_name', env, 
-        '--run_name', f'baseline_{args.randomization}_{env}',
-        ]
-    command = ["python", SCRIPT] + additional_args + base_args
-    subprocess.run(command)
-    
\ No newline at end of file
+## one run per env x algorithm x seed, each needs its env workers + the main process
+jobs = []
+for algorithm in args.algorithm:
+    for seed in (args.seed if args.seed is not None else [None]):
+        for env in envs:
+            additional_args = [
+                '--env_name', env, 
+                '--run_name', f'baseline_{args.randomization}_{env}',
+                '--algorithm', algorithm,
+                ]
+            name = f'{algorithm}_{env}'
+            if seed is not None:
+                additional_args += ['--seed', seed]
+                name += f'_{seed}'
+            jobs.append({
+                'name': name,
+                'command': [sys.executable, SCRIPT] + additional_args + base_args,
+                # (a run that needs more than the machine has is run on its own)
+                'cores': min(int(args.num_processes) + 1, args.max_cores)
+            })
+
+os.makedirs(args.log_folder, exist_ok=True)
+scheduler = RunScheduler(
+    jobs,
+    max_cores=args.max_cores,
+    state_path=args.sweep_state if args.sweep_state is not None else os.path.join(args.log_folder, 'sweep_state.json'),
+    log_dir=os.path.join(args.log_folder, 'sweep_logs'),
+    retries=args.retries
+)
+failed = scheduler.run()
+if len(failed) > 0:
+    print(f"FAILED RUNS: {failed}")
+    sys.exit(1)
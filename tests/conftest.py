@@ -0,0 +1,93 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+# run from anywhere: the modules are imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.gridworld import args_grid_varibad
+from environments.parallel_envs import make_vec_envs
+
+
+def make_gridworld_args(num_processes=1, **overrides):
+    """
+    Default GridNavi varibad args (4 rollouts per task, so the observations include the done flag),
+    completed with the env dimensions the same way MetaLearner does. Returns the args and the envs.
+    """
+    args = args_grid_varibad.get_args([])
+    args.seed = 73
+    args.num_processes = num_processes
+    args.load_model_from_checkpoint = None
+    for name, value in overrides.items():
+        setattr(args, name, value)
+
+    envs = make_vec_envs(env_name=args.env_name, seed=args.seed, num_processes=num_processes,
+                         gamma=args.policy_gamma, device='cpu',
+                         episodes_per_task=args.max_rollouts_per_task,
+                         normalise_rew=args.norm_rew_for_policy, ret_rms=None, tasks=None)
+    args.max_trajectory_len = envs._max_episode_steps * args.max_rollouts_per_task
+    args.state_dim = envs.observation_space.shape[0]
+    args.task_dim = envs.task_dim
+    args.belief_dim = envs.belief_dim
+    args.num_states = envs.num_states
+    args.action_space = envs.action_space
+    args.action_dim = 1
+    return args, envs
+
+
+def collect_trajectories(envs, num_steps):
+    """ Steps the envs with random actions, returns prev_obs, next_obs, actions, rewards ([num_steps] x [num_envs] x [dim]) """
+    prev_obs, next_obs, actions, rewards = [], [], [], []
+    obs = envs.reset()
+    for _ in range(num_steps):
+        action = torch.randint(envs.action_space.n, (envs.num_envs, 1))
+        new_obs, (rew_raw, _), done, _ = envs.step(action)
+        prev_obs.append(obs)
+        next_obs.append(new_obs)
+        actions.append(action.float())
+        rewards.append(rew_raw)
+        obs = new_obs
+    return torch.stack(prev_obs), torch.stack(next_obs), torch.stack(actions), torch.stack(rewards)
+
+
+def make_vae_batch(trajectory_lens, num_cells=5, num_actions=5):
+    """
+    A random GridNavi VAE batch in the format of RolloutStorageVAE.get_batch
+    ([max trajectory len] x [num trajectories] x [dim], zero-padded after each trajectory's length)
+    """
+    max_len, num_trajectories = max(trajectory_lens), len(trajectory_lens)
+
+    def observations():
+        cells = torch.randint(num_cells, (max_len, num_trajectories, 2)).float()
+        done_flags = torch.randint(2, (max_len, num_trajectories, 1)).float()
+        return torch.cat((cells, done_flags), dim=-1)
+
+    prev_obs, next_obs = observations(), observations()
+    actions = torch.randint(num_actions, (max_len, num_trajectories, 1)).float()
+    # GridNavi rewards are 1 at the goal and -0.1 elsewhere
+    rewards = (torch.rand(max_len, num_trajectories, 1) < 0.2).float() * 1.1 - 0.1
+    for i, trajectory_len in enumerate(trajectory_lens):
+        for tensor in [prev_obs, next_obs, actions, rewards]:
+            tensor[trajectory_len:, i] = 0
+    return prev_obs, next_obs, actions, rewards, None, np.array(trajectory_lens)
+
+
+def vae_loss_and_gradients(vae, batch, seed=1):
+    """ The VAE loss of a fixed batch (with fixed latent samples) and its gradients w.r.t. the encoder / decoders """
+    vae.get_batch = lambda: batch
+    torch.manual_seed(seed)
+    loss = vae.compute_vae_loss(update=False)
+    params = [p for group in vae.optimiser_vae.param_groups for p in group['params']]
+    gradients = torch.autograd.grad(loss, params, allow_unused=True)
+    return loss.detach(), [torch.zeros_like(p) if g is None else g for p, g in zip(params, gradients)]
+
+
+@pytest.fixture
+def gridworld():
+    torch.manual_seed(0)
+    args, envs = make_gridworld_args()
+    yield args, envs
+    envs.close()
@@ -0,0 +1,130 @@
+import numpy as np
+import pytest
+import torch
+from gym.wrappers import TimeLimit
+
+import environments  # registers the envs
+from environments.navigation.batched_gridworld import BatchedGridNavi
+from environments.navigation.batched_point_robot import BatchedPointEnv, BatchedSparsePointEnv
+from environments.navigation.gridworld import GridNavi
+from environments.navigation.point_robot import PointEnv, SparsePointEnv
+from environments.parallel_envs import make_vec_envs
+from environments.wrappers import TimeLimitMask, VariBadWrapper
+
+
+def step_references(references, actions):
+    obs, rewards, dones, infos = zip(*[env.step(action) for env, action in zip(references, actions)])
+    return np.stack(obs), np.array(rewards), np.array(dones), infos
+
+
+def assert_same_step(batched_step, reference_step, keys=('done_mdp', 'bad_transition')):
+    """ Compares the results of a batched step with the steps of the single envs """
+    obs, rewards, dones, infos = batched_step
+    ref_obs, ref_rewards, ref_dones, ref_infos = reference_step
+    assert np.allclose(obs, ref_obs)
+    assert np.allclose(rewards, ref_rewards)
+    assert np.array_equal(dones, ref_dones)
+    for info, ref_info in zip(infos, ref_infos):
+        assert np.allclose(info['task'], ref_info['task'])
+        for key in keys:
+            assert info.get(key) == ref_info.get(key)
+        assert ('start_state' in info) == ('start_state' in ref_info)
+        if 'start_state' in info:
+            assert np.allclose(info['start_state'], ref_info['start_state'])
+
+
+def test_batched_gridnavi_matches_gridnavi():
+    tasks = [[0, 0], [4, 4], [2, 1], [0, 3]]
+    batched = BatchedGridNavi(num_processes=len(tasks), episodes_per_task=4, seed=0)
+    references = [VariBadWrapper(GridNavi(num_cells=5, num_steps=15), episodes_per_task=4) for _ in tasks]
+
+    assert np.array_equal(batched.reset(task=tasks), np.stack([env.reset(task) for env, task in zip(references, tasks)]))
+    assert np.array_equal(batched.get_task(), tasks)
+    assert np.allclose(batched.get_belief(), np.stack([env.get_belief() for env in references]))
+
+    rng = np.random.RandomState(0)
+    found_goal = np.zeros(len(tasks), dtype=bool)
+    for _ in range(4 * 15):
+        # walk towards the goals more often than not, so the goals are found
+        actions = rng.choice(5, size=len(tasks), p=[0.1, 0.3, 0.3, 0.15, 0.15])
+        batched_step = batched.step(actions)
+        reference_step = step_references(references, [int(a) for a in actions])
+        assert_same_step(batched_step, reference_step)
+
+        # the beliefs are the same until the goal is found (the hint then includes a random wrong goal)
+        on_goal = reference_step[1] == 1.0
+        found_goal |= on_goal
+        for i, (info, ref_info) in enumerate(zip(batched_step[3], reference_step[3])):
+            task_id = ref_info['task_id'].item()
+            assert info['task_id'].item() == task_id
+            if on_goal[i]:
+                assert info['belief'][task_id] == 0.5
+                assert sorted(info['belief'][info['belief'] > 0]) == [0.5, 0.5]
+            elif not found_goal[i]:
+                assert np.allclose(info['belief'], ref_info['belief'])
+
+    assert found_goal.any()
+    assert batched_step[2].all()
+
+
+def test_batched_gridnavi_sampled_tasks_are_seeded():
+    tasks = [BatchedGridNavi(num_processes=8, episodes_per_task=4, seed=3).get_task() for _ in range(2)]
+    assert np.array_equal(tasks[0], tasks[1])
+    other_seed = BatchedGridNavi(num_processes=8, episodes_per_task=4, seed=4).get_task()
+    assert not np.array_equal(tasks[0], other_seed)
+
+
+def test_batched_gridnavi_through_make_vec_envs():
+    kwargs = dict(env_name='GridNavi-v0', seed=0, num_processes=2, gamma=0.99, device='cpu', episodes_per_task=4,
+                  normalise_rew=False, ret_rms=None, tasks=None)
+    batched, per_env = make_vec_envs(batched=True, **kwargs), make_vec_envs(batched=False, **kwargs)
+    try:
+        tasks = [[1, 2], [3, 0]]
+        assert torch.equal(batched.reset(task=tasks), per_env.reset(task=tasks))
+        for _ in range(20):
+            actions = torch.randint(5, (2, 1))
+            obs, (rew_raw, _), done, _ = batched.step(actions)
+            ref_obs, (ref_rew_raw, _), ref_done, _ = per_env.step(actions)
+            assert torch.allclose(obs, ref_obs)
+            assert torch.allclose(rew_raw, ref_rew_raw)
+            assert np.array_equal(np.asarray(done), np.asarray(ref_done))
+    finally:
+        batched.close()
+        per_env.close()
+
+
+@pytest.mark.parametrize('batched_class, make_env', [
+    (BatchedPointEnv, lambda: PointEnv(max_episode_steps=100)),
+    (BatchedSparsePointEnv, lambda: SparsePointEnv(goal_radius=0.2, max_episode_steps=100)),
+], ids=['dense', 'sparse'])
+def test_batched_point_env_matches_point_env(batched_class, make_env):
+    tasks = [[1., 0.], [0., 1.], [-0.6, 0.8], [0.05, 0.05]]
+    batched = batched_class(num_processes=len(tasks), episodes_per_task=2, seed=0)
+    # wrapped like make_env wraps the registered env (which has a time limit)
+    references = [VariBadWrapper(TimeLimitMask(TimeLimit(make_env(), 100)), episodes_per_task=2) for _ in tasks]
+
+    assert np.allclose(batched.reset(task=tasks), np.stack([env.reset(task) for env, task in zip(references, tasks)]))
+    assert np.allclose(batched.get_task(), tasks)
+
+    rng = np.random.RandomState(0)
+    for _ in range(2 * 100):
+        # (out of the action space, to check the clipping)
+        actions = rng.uniform(-1.5, 1.5, size=(len(tasks), 2)).astype(np.float32)
+        batched_step = batched.step(actions)
+        reference_step = step_references(references, actions)
+        assert_same_step(batched_step, reference_step, keys=('done_mdp', 'bad_transition', 'TimeLimit.truncated'))
+        if batched_class is BatchedSparsePointEnv:
+            for info, ref_info in zip(batched_step[3], reference_step[3]):
+                assert np.isclose(info['sparse_reward'], ref_info['sparse_reward'])
+                assert np.isclose(info['dense_reward'], ref_info['dense_reward'])
+
+    assert batched_step[2].all()
+
+
+def test_batched_point_env_sampled_goals_are_seeded():
+    goals = [BatchedPointEnv(num_processes=8, episodes_per_task=2, seed=3).get_task() for _ in range(2)]
+    assert np.array_equal(goals[0], goals[1])
+    # on the upper half of the unit circle
+    assert np.allclose(np.linalg.norm(goals[0], axis=1), 1)
+    assert (goals[0][:, 1] >= 0).all()
+    assert not np.array_equal(goals[0], BatchedPointEnv(num_processes=8, episodes_per_task=2, seed=4).get_task())
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+import torch
+import torch.nn as nn
+
+from utils.checkpoint_writer import AsyncCheckpointWriter
+
+
+def test_saves_modules_whole(tmp_path):
+    writer = AsyncCheckpointWriter()
+    model = nn.Sequential(nn.Linear(3, 4), nn.ReLU(), nn.Linear(4, 2))
+    expected = {k: v.clone() for k, v in model.state_dict().items()}
+
+    writer.save(model, str(tmp_path / 'model.pt'))
+    # training continues to change the weights while the checkpoint is written
+    with torch.no_grad():
+        for param in model.parameters():
+            param.add_(1)
+    writer.save(model, str(tmp_path / 'model_next.pt'))
+    writer.close()
+
+    loaded = torch.load(str(tmp_path / 'model.pt'))
+    assert isinstance(loaded, nn.Sequential)
+    for k, v in loaded.state_dict().items():
+        assert torch.equal(v, expected[k])
+    loaded_next = torch.load(str(tmp_path / 'model_next.pt'))
+    for k, v in loaded_next.state_dict().items():
+        assert torch.equal(v, expected[k] + 1)
+
+
+def test_saves_nested_state_dicts(tmp_path):
+    writer = AsyncCheckpointWriter()
+    model = nn.Linear(3, 2)
+    optimiser = torch.optim.Adam(model.parameters())
+    model(torch.randn(5, 3)).sum().backward()
+    optimiser.step()
+
+    state = {'eps': 3, 'model': model.state_dict(), 'optimiser': optimiser.state_dict()}
+    writer.save(state, str(tmp_path / 'state.pt'))
+    writer.close()
+
+    loaded = torch.load(str(tmp_path / 'state.pt'))
+    assert loaded['eps'] == 3
+    for k, v in model.state_dict().items():
+        assert torch.equal(loaded['model'][k], v)
+    optimiser.load_state_dict(loaded['optimiser'])
+
+
+def test_keeps_last_checkpoints_per_group(tmp_path):
+    writer = AsyncCheckpointWriter(keep_last=2)
+    model = nn.Linear(3, 2)
+    for i in range(4):
+        writer.save(model, str(tmp_path / f'policy{i}.pt'), group='policy')
+    writer.save(model, str(tmp_path / 'policy.pt'))
+    writer.close()
+    assert sorted(os.listdir(str(tmp_path))) == ['policy.pt', 'policy2.pt', 'policy3.pt']
+
+
+def test_write_errors_are_raised(tmp_path):
+    writer = AsyncCheckpointWriter()
+    writer.save(nn.Linear(3, 2), str(tmp_path / 'missing_dir' / 'model.pt'))
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    # the error is only raised once, the writer keeps working
+    writer.save(nn.Linear(3, 2), str(tmp_path / 'model.pt'))
+    writer.close()
+    assert os.path.exists(str(tmp_path / 'model.pt'))
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+import torch
+
+from utils.quantile_sketch import QuantileSketch
+
+
+QUANTILES = [i / 10 for i in range(1, 10)]
+
+
+def rank_errors(values, estimates, qs):
+    """ Difference between the rank (fraction of values below) of each estimated quantile and the quantile """
+    values = np.sort(values)
+    return np.abs(np.searchsorted(values, estimates, side='right') / len(values) - np.asarray(qs))
+
+
+def test_exact_until_full():
+    values = np.random.RandomState(0).normal(size=150)
+    sketch = QuantileSketch(k=200, seed=0)
+    sketch.update(torch.from_numpy(values[:100]))
+    sketch.update(values[100:].reshape(5, 10))
+
+    assert np.allclose(sketch.quantiles(QUANTILES), torch.quantile(torch.from_numpy(values), torch.tensor(QUANTILES)))
+    assert sketch.count == 150
+    assert sketch.mean() == pytest.approx(values.mean())
+
+
+@pytest.mark.parametrize('batch_size', [1, 37, 1000, 100000])
+@pytest.mark.parametrize('distribution', ['uniform', 'normal'])
+def test_rank_error_is_bounded(distribution, batch_size):
+    rng = np.random.RandomState(1)
+    values = rng.uniform(size=100000) if distribution == 'uniform' else rng.normal(size=100000)
+    sketch = QuantileSketch(k=200, seed=0)
+    for start in range(0, len(values), batch_size):
+        sketch.update(values[start:start + batch_size])
+
+    estimates = sketch.quantiles(QUANTILES)
+    # the rank error is roughly 1.7 / k
+    assert rank_errors(values, estimates, QUANTILES).max() < 0.02
+    if distribution == 'uniform':
+        assert np.abs(np.array(estimates) - np.quantile(values, QUANTILES)).max() < 0.02
+    assert sketch.count == len(values)
+    assert sketch.mean() == pytest.approx(values.mean())
+
+
+def test_memory_is_bounded():
+    sketch = QuantileSketch(k=50, seed=0)
+    rng = np.random.RandomState(2)
+    for _ in range(200):
+        sketch.update(rng.uniform(size=500))
+
+    # the compactors are not reallocated, and the number of items kept doesn't grow with the number of values
+    assert all(len(c) == 100 for c in sketch.compactors)
+    assert sum(sketch.sizes) < 5 * 50
+    assert len(sketch.compactors) < np.log2(100000)
@@ -0,0 +1,140 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from utils.results_writer import BufferedResultsWriter, truncate_results
+
+
+HEADERS = ['training_task', 'reward_mean', 'frame']
+
+
+def read_csv(path):
+    with open(path + '.csv', 'r') as f:
+        return list(csv.reader(f, delimiter=','))
+
+
+def write_results(path, frames, formats=('csv',), append=False):
+    writer = BufferedResultsWriter(path, HEADERS, flush_every=3, formats=formats, append=append)
+    for frame in frames:
+        writer.add(['reach', frame / 10, frame])
+    writer.close()
+
+
+def test_truncate_drops_rows_after_max_value(tmp_path):
+    path = str(tmp_path / 'train_results')
+    write_results(path, [100, 200, 300, 400])
+
+    truncate_results(path, 'frame', 200)
+
+    rows = read_csv(path)
+    assert rows[0] == HEADERS
+    assert [int(row[2]) for row in rows[1:]] == [100, 200]
+    assert not os.path.exists(path + '.csv.tmp')
+
+
+def test_truncate_drops_partly_written_rows(tmp_path):
+    path = str(tmp_path / 'train_results')
+    write_results(path, [100, 200])
+    # a row cut off when the run was killed
+    with open(path + '.csv', 'a') as f:
+        f.write('reach,30')
+
+    truncate_results(path, 'frame', 1000)
+
+    assert [int(row[2]) for row in read_csv(path)[1:]] == [100, 200]
+
+
+def test_resumed_run_continues_truncated_results(tmp_path):
+    path = str(tmp_path / 'train_results')
+    write_results(path, [100, 200, 300])
+    truncate_results(path, 'frame', 200)
+    write_results(path, [300, 400], append=True)
+
+    assert [int(row[2]) for row in read_csv(path)[1:]] == [100, 200, 300, 400]
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_truncate_and_append_columnar_results(tmp_path, fmt):
+    pytest.importorskip('pyarrow')
+    from utils.results_writer import read_table
+
+    path = str(tmp_path / 'train_results')
+    write_results(path, [100, 200, 300, 400], formats=(fmt,))
+    truncate_results(path, 'frame', 200, formats=(fmt,))
+    assert read_table(path + '.' + fmt).column('frame').to_pylist() == [100, 200]
+
+    write_results(path, [300], formats=(fmt,), append=True)
+    assert read_table(path + '.' + fmt).column('frame').to_pylist() == [100, 200, 300]
+
+
+def test_csv_has_header_and_rows(tmp_path):
+    path = str(tmp_path / 'test_results')
+    write_results(path, [100, 200])
+
+    assert read_csv(path) == [HEADERS, ['reach', '10.0', '100'], ['reach', '20.0', '200']]
+
+
+def test_rows_are_buffered_until_flush_every(tmp_path):
+    path = str(tmp_path / 'test_results')
+    writer = BufferedResultsWriter(path, HEADERS, flush_every=3)
+    writer.add(['reach', 1.0, 100])
+    writer.add(['reach', 2.0, 200])
+    assert read_csv(path) == [HEADERS]
+
+    writer.add(['reach', 3.0, 300])
+    assert len(read_csv(path)) == 4
+
+    writer.add(['reach', 4.0, 400])
+    writer.close()
+    assert len(read_csv(path)) == 5
+
+
+def test_numpy_and_torch_scalars_are_written_as_numbers(tmp_path):
+    path = str(tmp_path / 'test_results')
+    writer = BufferedResultsWriter(path, HEADERS)
+    writer.add(['reach', np.float32(0.5), torch.tensor(100)])
+    writer.close()
+
+    assert read_csv(path)[1] == ['reach', '0.5', '100']
+
+
+def test_append_keeps_existing_csv(tmp_path):
+    path = str(tmp_path / 'test_results')
+    write_results(path, [100])
+    write_results(path, [200], append=True)
+    write_results(path, [300], append=False)
+
+    assert read_csv(path) == [HEADERS, ['reach', '30.0', '300']]
+
+
+def test_append_creates_missing_csv(tmp_path):
+    path = str(tmp_path / 'test_results')
+    write_results(path, [100], append=True)
+
+    assert read_csv(path) == [HEADERS, ['reach', '10.0', '100']]
+
+
+def test_wrong_row_length_and_unknown_format_are_rejected(tmp_path):
+    path = str(tmp_path / 'test_results')
+    with pytest.raises(ValueError):
+        BufferedResultsWriter(path, HEADERS, formats=('csv', 'xlsx'))
+    writer = BufferedResultsWriter(path, HEADERS)
+    with pytest.raises(AssertionError):
+        writer.add(['reach', 100])
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow'])
+def test_columnar_results_match_csv(tmp_path, fmt):
+    pytest.importorskip('pyarrow')
+    from utils.results_writer import read_table
+
+    path = str(tmp_path / 'test_results')
+    write_results(path, [100, 200, 300, 400, 500], formats=('csv', fmt))
+
+    table = read_table(path + '.' + fmt)
+    assert table.column_names == HEADERS
+    assert table.column('frame').to_pylist() == [int(row[2]) for row in read_csv(path)[1:]]
+    assert table.column('reward_mean').to_pylist() == [float(row[1]) for row in read_csv(path)[1:]]
@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+
+import pytest
+
+from utils.run_scheduler import RunScheduler
+
+
+def python_job(name, code, cores=1):
+    return {'name': name, 'command': [sys.executable, '-c', code], 'cores': cores}
+
+
+def make_scheduler(tmp_path, jobs, max_cores=2, retries=1):
+    return RunScheduler(jobs, max_cores, str(tmp_path / 'sweep_state.json'), str(tmp_path / 'logs'),
+                        retries=retries, poll_interval=0.05)
+
+
+def read_state(tmp_path):
+    with open(tmp_path / 'sweep_state.json') as f:
+        return json.load(f)
+
+
+def test_runs_all_jobs(tmp_path):
+    jobs = [python_job(f'job_{i}', f"print('hello from job {i}')") for i in range(3)]
+
+    assert make_scheduler(tmp_path, jobs).run() == []
+
+    state = read_state(tmp_path)
+    for i in range(3):
+        assert state[f'job_{i}'] == {'status': 'done', 'attempts': 1}
+        with open(tmp_path / 'logs' / f'job_{i}.log') as f:
+            assert f.read().strip() == f'hello from job {i}'
+
+
+def test_failed_jobs_are_retried(tmp_path):
+    jobs = [python_job('fails', 'import sys; sys.exit(3)'), python_job('works', 'pass')]
+
+    assert make_scheduler(tmp_path, jobs, retries=2).run() == ['fails']
+
+    state = read_state(tmp_path)
+    assert state['fails'] == {'status': 'failed', 'attempts': 3}
+    assert state['works'] == {'status': 'done', 'attempts': 1}
+
+
+def test_jobs_do_not_oversubscribe_cores(tmp_path):
+    # each job fails if another one holds the lock file while it runs
+    lock = str(tmp_path / 'lock')
+    code = (f"import os, sys, time\n"
+            f"try:\n"
+            f"    fd = os.open({lock!r}, os.O_CREAT | os.O_EXCL)\n"
+            f"except FileExistsError:\n"
+            f"    sys.exit(1)\n"
+            f"time.sleep(0.3)\n"
+            f"os.close(fd)\n"
+            f"os.remove({lock!r})\n")
+    jobs = [python_job(f'big_{i}', code, cores=2) for i in range(3)]
+
+    assert make_scheduler(tmp_path, jobs, max_cores=3, retries=0).run() == []
+
+
+def test_resume_skips_finished_jobs(tmp_path):
+    marker = tmp_path / 'marker'
+    jobs = [python_job(name, f"open({str(marker) + '_' + name!r}, 'w').close()") for name in ['done', 'failed', 'running']]
+    with open(tmp_path / 'sweep_state.json', 'w') as f:
+        json.dump({
+            'done': {'status': 'done', 'attempts': 1},
+            'failed': {'status': 'failed', 'attempts': 2},
+            'running': {'status': 'running', 'attempts': 1},
+        }, f)
+
+    assert make_scheduler(tmp_path, jobs).run() == []
+
+    assert not os.path.exists(str(marker) + '_done')
+    assert os.path.exists(str(marker) + '_failed')
+    assert os.path.exists(str(marker) + '_running')
+    state = read_state(tmp_path)
+    assert state['done'] == {'status': 'done', 'attempts': 1}
+    assert state['failed'] == {'status': 'done', 'attempts': 1}
+
+
+def test_rejects_jobs_bigger_than_the_machine(tmp_path):
+    with pytest.raises(ValueError):
+        make_scheduler(tmp_path, [python_job('huge', 'pass', cores=4)], max_cores=2)
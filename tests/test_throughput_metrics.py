@@ -0,0 +1,46 @@
+import numpy as np
+import torch
+
+from conftest import make_gridworld_args
+from utils.throughput_metrics import ThroughputMetrics
+
+
+def run_and_log(envs, metrics, num_steps):
+    logged = {}
+    envs.reset()
+    for _ in range(num_steps):
+        envs.step(torch.randint(envs.action_space.n, (envs.num_envs, 1)))
+        metrics.add_frames(envs.num_envs)
+    metrics.log(lambda name, value, x_pos: logged.__setitem__(name, value), 0)
+    return logged
+
+
+def test_workers_are_only_timed_if_asked_to():
+    _, envs = make_gridworld_args(num_processes=2)
+    try:
+        logged = run_and_log(envs, ThroughputMetrics(envs), 10)
+        assert logged['throughput/fps'] > 0
+        assert not any(name.startswith('throughput/worker') for name in logged)
+
+        step_times, num_steps = envs.unwrapped.pop_timing()
+        assert all(step_time is None for step_time in step_times)
+        assert np.array_equal(num_steps, [0, 0])
+    finally:
+        envs.close()
+
+
+def test_timed_workers_keep_totals():
+    _, envs = make_gridworld_args(num_processes=2)
+    try:
+        metrics = ThroughputMetrics(envs, time_workers=True)
+        logged = run_and_log(envs, metrics, 10)
+        assert 0 <= logged['throughput/worker_idle_fraction'] <= logged['throughput/worker_idle_fraction_max'] <= 1
+        assert logged['throughput/worker_step_ms'] > 0
+
+        # the totals start over after every pop
+        envs.step(torch.zeros((2, 1), dtype=torch.long))
+        step_times, num_steps = envs.unwrapped.pop_timing()
+        assert np.array_equal(num_steps, [1, 1])
+        assert (step_times > 0).all()
+    finally:
+        envs.close()
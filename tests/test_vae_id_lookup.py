@@ -0,0 +1,65 @@
+import itertools
+
+import numpy as np
+import torch
+
+from conftest import collect_trajectories
+from environments.navigation.gridworld import GridNavi
+from vae import VaribadVAE
+
+
+def make_vae(args):
+    return VaribadVAE(args, logger=None, get_iter_idx=lambda: 1)
+
+
+def test_lookup_matches_env_task_to_id(gridworld):
+    args, _ = gridworld
+    vae = make_vae(args)
+    env = GridNavi(num_cells=5, num_steps=15)
+
+    cells = torch.tensor(list(itertools.product(range(5), repeat=2))).float()
+    assert torch.equal(vae.task_to_id(cells).cpu(), env.task_to_id(cells))
+    # batched shapes, as in the losses
+    assert torch.equal(vae.task_to_id(cells.reshape(5, 5, 2)).cpu(), env.task_to_id(cells.reshape(5, 5, 2)))
+    # a single state gives ids of shape [1], like the env
+    assert torch.equal(vae.task_to_id(cells[7]).cpu(), env.task_to_id(cells[7]))
+
+
+def test_lookup_ignores_done_flag(gridworld):
+    args, _ = gridworld
+    assert args.state_dim == 3
+    vae = make_vae(args)
+    env = GridNavi(num_cells=5, num_steps=15)
+
+    cells = torch.tensor(list(itertools.product(range(5), repeat=2))).float()
+    for done_flag in [0., 1.]:
+        wrapped = torch.cat((cells, torch.full((len(cells), 1), done_flag)), dim=-1)
+        assert torch.equal(vae.task_to_id(wrapped).cpu(), env.task_to_id(cells))
+
+
+def test_reward_loss_on_wrapped_observations(gridworld):
+    args, envs = gridworld
+    vae = make_vae(args)
+    prev_obs, next_obs, actions, rewards = collect_trajectories(envs, num_steps=20)
+    assert next_obs.shape[-1] == 3
+
+    latent = torch.randn(next_obs.shape[0], next_obs.shape[1], args.latent_dim)
+    loss = vae.compute_rew_reconstruction_loss(latent, prev_obs, next_obs, actions, rewards)
+    assert loss.shape == next_obs.shape[:2]
+    assert torch.isfinite(loss).all()
+
+
+def test_vae_update_on_wrapped_observations(gridworld):
+    args, envs = gridworld
+    vae = make_vae(args)
+    prev_obs, next_obs, actions, rewards = collect_trajectories(envs, num_steps=args.max_trajectory_len)
+    done = torch.zeros(args.num_processes, 1)
+    for t in range(args.max_trajectory_len):
+        if t == args.max_trajectory_len - 1:
+            done = torch.ones(args.num_processes, 1)
+        vae.rollout_storage.insert(prev_obs[t], actions[t], next_obs[t], rewards[t], done, None)
+
+    for decode_chunk_size in [None, 10]:
+        vae.decode_chunk_size = decode_chunk_size
+        loss = vae.compute_vae_loss(update=True)
+        assert np.isfinite(loss.item())
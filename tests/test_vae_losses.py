@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from conftest import make_vae_batch, vae_loss_and_gradients
+from vae import VaribadVAE
+
+
+def assert_same_loss_and_gradients(first, second):
+    (first_loss, first_gradients), (second_loss, second_gradients) = first, second
+    assert torch.allclose(first_loss, second_loss, rtol=1e-5, atol=1e-6)
+    for first_gradient, second_gradient in zip(first_gradients, second_gradients):
+        assert torch.allclose(first_gradient, second_gradient, rtol=1e-4, atol=1e-6)
+
+
+@pytest.mark.parametrize('trajectory_lens', [[60, 60, 60], [60, 41, 17, 3]])
+def test_packed_matches_padded(gridworld, trajectory_lens):
+    args, _ = gridworld
+    vae = VaribadVAE(args, logger=None, get_iter_idx=lambda: 1)
+    batch = make_vae_batch(trajectory_lens)
+
+    vae.pack_sequences = False
+    padded = vae_loss_and_gradients(vae, batch)
+    vae.pack_sequences = True
+    packed = vae_loss_and_gradients(vae, batch)
+
+    assert_same_loss_and_gradients(padded, packed)
+
+
+def test_packed_rejects_tbptt(gridworld):
+    args, _ = gridworld
+    args.vae_pack_sequences = True
+    args.tbptt_stepsize = 10
+    with pytest.raises(AssertionError):
+        VaribadVAE(args, logger=None, get_iter_idx=lambda: 1)
+
+
+@pytest.mark.parametrize('overrides', [
+    {},
+    {'vae_avg_elbo_terms': True, 'vae_avg_reconstruction_terms': True},
+    {'multihead_for_reward': False, 'rew_pred_type': 'deterministic', 'decode_state': True},
+])
+@pytest.mark.parametrize('trajectory_lens', [[60, 60, 60], [60, 41, 17, 3]])
+def test_chunked_matches_unchunked(gridworld, overrides, trajectory_lens):
+    args, _ = gridworld
+    for name, value in overrides.items():
+        setattr(args, name, value)
+    vae = VaribadVAE(args, logger=None, get_iter_idx=lambda: 1)
+    batch = make_vae_batch(trajectory_lens)
+
+    vae.decode_chunk_size = None
+    unchunked = vae_loss_and_gradients(vae, batch)
+    # (a chunk size that doesn't divide the number of ELBO terms)
+    vae.decode_chunk_size = 7
+    chunked = vae_loss_and_gradients(vae, batch)
+
+    assert_same_loss_and_gradients(unchunked, chunked)
+
+
+def test_chunked_falls_back_for_unsupported_likelihoods(gridworld):
+    args, _ = gridworld
+    args.vae_decode_chunk_size = 7
+    args.decode_state = True
+    args.state_pred_type = 'gaussian'
+    with pytest.warns(UserWarning):
+        vae = VaribadVAE(args, logger=None, get_iter_idx=lambda: 1)
+    assert vae.decode_chunk_size is None
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import torch
+
+from conftest import make_gridworld_args
+
+
+@pytest.fixture(params=[1, 2], ids=['dummy', 'subproc'])
+def gridworld_envs(request):
+    """ GridNavi envs from make_vec_envs: a DummyVecEnv with 1 process, a SubprocVecEnv with 2 """
+    torch.manual_seed(0)
+    _, envs = make_gridworld_args(num_processes=request.param)
+    yield envs
+    envs.close()
+
+
+def test_set_env_attr_on_wrapper(gridworld_envs):
+    # episodes_per_task is an attribute of the VariBadWrapper around GridNavi: with 1 episode per task,
+    # the envs are done at the end of the first episode (15 steps) instead of the fourth
+    gridworld_envs.set_env_attr('episodes_per_task', 1)
+    gridworld_envs.reset()
+    for step in range(15):
+        _, _, done, _ = gridworld_envs.step(torch.zeros((gridworld_envs.num_envs, 1), dtype=torch.long))
+        assert done.all() == (step == 14)
+
+
+def test_set_env_attr_on_unwrapped_env(gridworld_envs):
+    gridworld_envs.set_env_attr('_goal', np.array([3, 4]), unwrapped=True)
+    assert np.array_equal(gridworld_envs.get_env_attr('_goal'), [3, 4])
+
+
+def env_tasks(envs):
+    # (DummyVecEnv.get_task only returns the task of the first env)
+    return np.reshape(envs.get_task(), (envs.num_envs, -1))
+
+
+def test_reset_one_env_with_task(gridworld_envs):
+    gridworld_envs.reset()
+    tasks_before = env_tasks(gridworld_envs)
+    index = gridworld_envs.num_envs - 1
+
+    obs = gridworld_envs.reset(index=index, task=[3, 4])
+
+    tasks = env_tasks(gridworld_envs)
+    assert np.array_equal(tasks[index], [3, 4])
+    assert np.array_equal(tasks[:index], tasks_before[:index])
+    # the start state, with the done flag
+    assert torch.equal(obs, torch.zeros(3))
+
+
+def test_reset_all_envs_with_tasks(gridworld_envs):
+    tasks = [[i, 4 - i] for i in range(gridworld_envs.num_envs)]
+
+    gridworld_envs.reset(task=tasks)
+
+    assert np.array_equal(env_tasks(gridworld_envs), tasks)
+
+
+def worker_extras(envs):
+    """ The tasks / beliefs queried from the workers, bypassing the extras sent with the replies """
+    subproc_envs = envs.unwrapped
+    extras_valid, subproc_envs.extras_valid = subproc_envs.extras_valid, False
+    tasks, beliefs = subproc_envs.get_task(), subproc_envs.get_belief()
+    subproc_envs.extras_valid = extras_valid
+    return tasks, beliefs
+
+
+def test_subproc_extras_stay_up_to_date():
+    _, envs = make_gridworld_args(num_processes=2)
+    try:
+        envs.set_step_extras(['task', 'belief'])
+        envs.reset(task=[[0, 1], [2, 3]])
+        for _ in range(3):
+            envs.step(torch.randint(envs.action_space.n, (envs.num_envs, 1)))
+
+        for reset in [lambda: envs.reset_mdp(index=1), lambda: envs.reset_mdp(),
+                      lambda: envs.reset_task([[4, 4], [1, 0]]), lambda: envs.reset(index=0, task=[2, 2])]:
+            reset()
+            tasks, beliefs = worker_extras(envs)
+            assert np.array_equal(envs.get_task(), tasks)
+            assert np.array_equal(envs.get_belief(), beliefs)
+        assert np.array_equal(envs.get_task(), [[2, 2], [1, 0]])
+    finally:
+        envs.close()
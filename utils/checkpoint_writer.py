@@ -0,0 +1,117 @@
+import copy
+import os
+import queue
+import threading
+import weakref
+from collections import defaultdict, deque
+
+import torch
+import torch.nn as nn
+
+
+class AsyncCheckpointWriter:
+    def __init__(self, keep_last=None):
+        """
+        Writes checkpoints to disk on a background thread, so training doesn't block on disk.
+        save() only copies the tensors on the calling thread (detached CPU copies of the state dict, so training
+        can continue changing the weights); the thread writes the snapshot to a temp file which is then renamed,
+        so a checkpoint file is never half-written.
+        If writing a checkpoint fails, the error is raised by the next call to save / flush / close.
+        :param keep_last: for checkpoints saved with a group, only keep the last keep_last files (None keeps all)
+        """
+
+        self.keep_last = keep_last
+        # files written so far, per group (for the retention of the last keep_last checkpoints)
+        self.written_files = defaultdict(deque)
+        # modules are still saved whole (so the files can be loaded with torch.load as before): the worker loads
+        # the state dict into a copy of the module that is made once, on the first save of that module
+        self.templates = weakref.WeakKeyDictionary()
+        self.error = None
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def save(self, obj, path, group=None):
+        """
+        Schedules saving obj (a module, or e.g. a dict of state dicts / tensors) to path.
+        :param group: name of a series of checkpoints (e.g., intermediate models) to apply keep_last to
+        """
+        self.raise_error()
+        if isinstance(obj, nn.Module):
+            job = (self.template(obj), snapshot(obj.state_dict()), path, group)
+        else:
+            job = (None, snapshot(obj), path, group)
+        self.queue.put(job)
+
+    def template(self, module):
+        if module not in self.templates:
+            template = copy.deepcopy(module)
+            # (the gradients are not part of the checkpoint)
+            for param in template.parameters():
+                param.grad = None
+            self.templates[module] = template
+        return self.templates[module]
+
+    def worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self.write(*job)
+            except Exception as e:
+                # keep the first error, it is raised on the training thread
+                if self.error is None:
+                    self.error = RuntimeError(f'Could not write checkpoint {job[2]}: {e}')
+                    self.error.__cause__ = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, template, data, path, group):
+        if template is not None:
+            template.load_state_dict(data)
+            data = template
+        tmp_path = path + '.tmp'
+        torch.save(data, tmp_path)
+        os.replace(tmp_path, path)
+
+        if group is not None and self.keep_last is not None:
+            written_files = self.written_files[group]
+            if path not in written_files:
+                written_files.append(path)
+            while len(written_files) > self.keep_last:
+                old_path = written_files.popleft()
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def flush(self):
+        """ Blocks until all scheduled checkpoints are written """
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        """ Writes the remaining checkpoints and stops the background thread """
+        self.queue.put(None)
+        self.thread.join()
+        self.raise_error()
+
+
+def snapshot(value):
+    """ Copy of value with all tensors replaced by detached CPU copies (nested dicts / lists / tuples are copied too) """
+    if torch.is_tensor(value):
+        return value.detach().to('cpu', copy=True)
+    if isinstance(value, dict):
+        # (a shallow copy keeps the type and attributes, e.g. the version info of state dicts)
+        copied = copy.copy(value)
+        for k, v in value.items():
+            copied[k] = snapshot(v)
+        return copied
+    if type(value) in (list, tuple):
+        return type(value)(snapshot(v) for v in value)
+    return copy.deepcopy(value)
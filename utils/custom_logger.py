@@ -1,29 +1,42 @@
 import datetime
 import json
 import os
-import csv
 
 import torch
 from torch.utils.tensorboard import SummaryWriter
 
+from utils.checkpoint_writer import AsyncCheckpointWriter
+from utils.results_writer import BufferedResultsWriter, truncate_results
+
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 
 class CustomLogger:
-    def __init__(self, log_dir,  logging_quantiles, args = None, left_args = None, right_args = None):
+    def __init__(self, log_dir,  logging_quantiles, args = None, left_args = None, right_args = None, run_dir = None, purge_step = None):
+        """
+        run_dir: log into this existing run folder instead of creating a new one (e.g. from an evaluation process,
+        or when resuming a run); the csvs and configs are then left as they are
+        purge_step: tensorboard hides the events of earlier sessions in the folder from this step onwards
+        (when resuming a run, the steps after the checkpoint are logged again)
+        """
 
         self.args = args
         self.left_args = left_args
         self.right_args = right_args
 
-        self.log_dir = os.path.join(
-            log_dir,
-            self.args.run_name + '_' + str(self.args.seed) + '_' + self.args.algorithm + datetime.datetime.now().strftime('_%d%m_%H%M%S')
-        )
+        if run_dir is None:
+            self.log_dir = os.path.join(
+                log_dir,
+                self.args.run_name + '_' + str(self.args.seed) + '_' + self.args.algorithm + datetime.datetime.now().strftime('_%d%m_%H%M%S')
+            )
+        else:
+            self.log_dir = run_dir
 
-        self.writer = SummaryWriter(log_dir=self.log_dir)
+        self.writer = SummaryWriter(log_dir=self.log_dir, purge_step=purge_step)
 
         self.network_dir = self.log_dir + '/actor_critic.pt'
+        # networks are written to disk in the background
+        self.checkpoint_writer = AsyncCheckpointWriter()
 
         print('logging under', self.log_dir)
 
@@ -42,16 +55,25 @@ class CustomLogger:
             'frame'
         ]
 
-        ## create csvs with headers
-        self.train_csv_dir = self.log_dir + '/train_results.csv'
-        self.init_result_csv(self.train_csv_dir)
-        self.test_csv_dir = self.log_dir + '/test_results.csv'
-        self.init_result_csv(self.test_csv_dir)
-
+        ## results are buffered in memory and written in batches (as csv, and optionally parquet / arrow)
+        self.results_formats = getattr(self.args, 'results_formats', ['csv'])
+        self.results_flush_every = getattr(self.args, 'results_flush_every', 100)
+        self.result_paths = {
+            'train': self.log_dir + '/train_results',
+            'test': self.log_dir + '/test_results',
+        }
         # if logging bicameral agent, 
         if (self.args is not None) and (self.args.algorithm=='bicameral'):
-            self.left_csv_dir = self.log_dir + '/left_eval_results.csv'
-            self.init_result_csv(self.left_csv_dir)
+            self.result_paths['left'] = self.log_dir + '/left_eval_results'
+        self.train_csv_dir = self.result_paths['train'] + '.csv'
+        self.test_csv_dir = self.result_paths['test'] + '.csv'
+
+        ## create csvs with headers (when attaching to an existing run folder, only once something is logged)
+        self.result_writers = {}
+        if run_dir is not None:
+            return
+        for csv_to_do in self.result_paths.keys():
+            self.init_result_writer(csv_to_do)
 
 
         ### save out args if supplied to continual learner - otherwise ignore
@@ -78,31 +100,44 @@ class CustomLogger:
         self.writer.add_scalars(name, value_dict, x_pos)
 
     def add_csv(self, row, csv_to_do):
-        if csv_to_do == 'train':
-            csv_dir = self.train_csv_dir
-        elif csv_to_do == 'left':
-            csv_dir = self.left_csv_dir
-        elif csv_to_do == 'test':
-            csv_dir = self.test_csv_dir
-        else:
+        if csv_to_do not in self.result_paths:
             raise ValueError(f"No csv for {csv_to_do}")
+        if csv_to_do not in self.result_writers:
+            self.init_result_writer(csv_to_do, append=True)
+        self.result_writers[csv_to_do].add(row)
+
+    def init_result_writer(self, csv_to_do, append=False):
+        self.result_writers[csv_to_do] = BufferedResultsWriter(
+            self.result_paths[csv_to_do],
+            self.result_log_headers,
+            flush_every=self.results_flush_every,
+            formats=self.results_formats,
+            append=append
+        )
 
-        assert len(row) == len(self.result_log_headers), 'You have not passed sufficient values to logger'
-        with open(csv_dir, 'a') as f:
-            csv_writer = csv.writer(f, delimiter=',')
-            csv_writer.writerow(
-                row
-            )
+    def drop_results_after(self, frame, csvs=None):
+        """
+        Drops the results logged after frame from the csvs (all by default), e.g. when resuming a run from a checkpoint.
+        Only for the results on disk: call it before logging anything.
+        """
+        for csv_to_do in (self.result_paths.keys() if csvs is None else csvs):
+            assert csv_to_do not in self.result_writers, 'Results were already logged'
+            truncate_results(self.result_paths[csv_to_do], 'frame', frame, self.results_formats)
+
+    def flush(self):
+        # write out all buffered results
+        for result_writer in self.result_writers.values():
+            result_writer.flush()
 
-    def init_result_csv(self, csv_dir):
-        with open(csv_dir, 'w') as f:
-            csv_writer = csv.writer(f, delimiter=',')
-            csv_writer.writerow(
-                self.result_log_headers
-            )
-        
     def save_network(self, network):
-        torch.save(network, self.network_dir)
+        self.checkpoint_writer.save(network, self.network_dir)
+
+    def close(self):
+        # make sure all results and networks have been written
+        for result_writer in self.result_writers.values():
+            result_writer.close()
+        self.checkpoint_writer.close()
+        self.writer.close()
 
     def log_args(self, args, path):
         
@@ -44,6 +44,8 @@ def evaluate(args,
                          ret_rms=ret_rms,
                          tasks=tasks,
                          add_done_info=args.max_rollouts_per_task > 1,
+                         step_extras=utl.get_step_extras(args),
+                         batched=args.batched_env if hasattr(args, 'batched_env') else False,
                          )
     num_steps = envs._max_episode_steps
 
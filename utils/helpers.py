@@ -2,6 +2,7 @@ import os
 import pickle
 # import pickle5 as pickle
 import random
+import subprocess
 import warnings
 from distutils.util import strtobool
 
@@ -48,11 +49,11 @@ def reset_env(env, args, indices=None, state=None):
     # reset all environments
     if (indices is None) or (len(indices) == args.num_processes):
         state = env.reset().float().to(device)
-    # reset only the ones given by indices
+    # reset only the ones given by indices (in one batch)
     else:
         assert state is not None
-        for i in indices:
-            state[i] = env.reset(index=i)
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        state[indices.to(state.device)] = env.reset(indices=indices.tolist()).to(state.device)
 
     belief = torch.from_numpy(env.get_belief()).float().to(device) if args.pass_belief_to_policy else None
     task = torch.from_numpy(env.get_task()).float().to(device) if args.pass_task_to_policy else None
@@ -60,6 +61,18 @@ def reset_env(env, args, indices=None, state=None):
     return state, belief, task
 
 
+def get_step_extras(args):
+    """ What reset_env / env_step query from the envs, if the envs should send it along with each step (otherwise None) """
+    if not (args.fold_task_into_step if hasattr(args, 'fold_task_into_step') else False):
+        return None
+    extras = []
+    if args.pass_belief_to_policy:
+        extras.append('belief')
+    if args.pass_task_to_policy or args.decode_task:
+        extras.append('task')
+    return extras
+
+
 def squash_action(action, args):
     if args.norm_actions_post_sampling:
         return torch.tanh(action)
@@ -300,6 +313,14 @@ def boolean_argument(value):
     return bool(strtobool(value))
 
 
+def get_commit():
+    """ Current git commit (e.g. to stamp benchmark results with), None if it can't be determined """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
 def get_task_dim(args):
     env = make_vec_envs(env_name=args.env_name, seed=args.seed, num_processes=args.num_processes,
                         gamma=args.policy_gamma, device=device,
@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# latent lists of the online storages, and their latent dims
+LATENT_LISTS = {
+    'latent': 'latent_dim',
+    'gate_latent': 'gate_latent_dim',
+    'left_latent': 'left_latent_dim',
+    'right_latent': 'right_latent_dim',
+}
+
+
+def tensor_bytes(tensor):
+    return tensor.element_size() * tensor.nelement()
+
+
+def field_bytes(value):
+    """ Bytes held (in memory) by a tensor / numpy array, or a list / tuple of those; 0 for anything else """
+    if torch.is_tensor(value):
+        return tensor_bytes(value)
+    if isinstance(value, np.memmap):
+        # lives on disk
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(field_bytes(v) for v in value)
+    return 0
+
+
+def storage_memory(storage):
+    """ Bytes held by each tensor (or list of tensors) field of a rollout storage """
+    memory = {}
+    for name, value in vars(storage).items():
+        size = field_bytes(value)
+        if size > 0:
+            memory[name] = size
+    return memory
+
+
+def projected_latent_memory(storage):
+    """
+    Bytes the latent lists of an online storage hold at the end of a rollout (num_steps + 1 latents of float32);
+    they are emptied after every update, so at start-up storage_memory doesn't show them.
+    """
+    memory = {}
+    for name, dim_name in LATENT_LISTS.items():
+        if hasattr(storage, name) and hasattr(storage, dim_name):
+            # the encoders' latents are mean and logvar, the gating network's is used as is
+            dim = getattr(storage, dim_name) * (1 if name == 'gate_latent' else 2)
+            memory[name] = (storage.num_steps + 1) * storage.num_processes * dim * 4
+    return memory
+
+
+def latent_tensors(storage):
+    return [latent for name in LATENT_LISTS.keys() for latent in getattr(storage, name, [])]
+
+
+def graph_memory(tensors, exclude=()):
+    """
+    Size of the autograd graph that the tensors keep alive: returns the number of nodes and the bytes of the
+    tensors saved for the backward pass (not counting the tensors in exclude, e.g. the model parameters).
+    Saved tensors are only exposed from torch 1.10 on, with older versions the bytes are None
+    (see estimate_graph_memory).
+    """
+    excluded = {tensor.data_ptr() for tensor in exclude}
+    saved = {}
+    exposes_saved = False
+    seen = set()
+    nodes = [tensor.grad_fn for tensor in tensors if tensor.grad_fn is not None]
+    while len(nodes) > 0:
+        node = nodes.pop()
+        if (node is None) or (node in seen):
+            continue
+        seen.add(node)
+        for attr in dir(node):
+            if not attr.startswith('_saved_'):
+                continue
+            exposes_saved = True
+            try:
+                value = getattr(node, attr)
+            except RuntimeError:
+                # freed by a backward pass
+                continue
+            for tensor in (value if isinstance(value, (list, tuple)) else [value]):
+                if torch.is_tensor(tensor) and (tensor.data_ptr() not in excluded):
+                    saved[tensor.data_ptr()] = max(saved.get(tensor.data_ptr(), 0), tensor_bytes(tensor))
+        nodes.extend(next_node for next_node, _ in node.next_functions)
+    return len(seen), (sum(saved.values()) if exposes_saved else None)
+
+
+def recurrent_encoders(model):
+    """ The (trainable) recurrent encoders of a model, i.e. the submodules with a GRU """
+    return [module for module in model.modules()
+            if isinstance(getattr(module, 'gru', None), nn.GRU) and any(p.requires_grad for p in module.parameters())]
+
+
+def estimate_graph_memory(encoders, num_steps, num_processes):
+    """
+    Estimated bytes of the tensors the autograd graph saves when the encoders are run over a rollout of num_steps
+    (for torch < 1.10, where graph_memory can't see them): per step and process, the input and output of each
+    linear layer and the GRU's input, previous hidden state and its three gates, in float32.
+    """
+    floats = 0
+    for encoder in encoders:
+        for module in encoder.modules():
+            if isinstance(module, nn.Linear):
+                floats += module.in_features + module.out_features
+            elif isinstance(module, nn.GRU):
+                floats += module.input_size + 4 * module.hidden_size
+    return floats * num_steps * num_processes * 4
+
+
+def model_memory(model, optimiser=None):
+    """ Bytes of the parameters, their gradients (once allocated by a backward pass) and the optimiser state """
+    params = list(model.parameters())
+    memory = {
+        'parameters': sum(tensor_bytes(p) for p in params),
+        'gradients': sum(tensor_bytes(p.grad) for p in params if p.grad is not None),
+    }
+    if optimiser is not None:
+        memory['optimiser_state'] = optimiser_memory(optimiser)
+    return memory
+
+
+def optimiser_memory(optimiser):
+    """ Bytes of the optimiser state (e.g. Adam's moments, once allocated by the first step) """
+    return sum(field_bytes(list(state.values())) for state in optimiser.state.values())
+
+
+def process_rss(pid):
+    """ Resident memory of a process in bytes (None if it can't be read) """
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_memory(envs=None):
+    """ Resident memory of this process and of the env workers (if envs is / wraps a SubprocVecEnv) """
+    memory = {f'main (pid {os.getpid()})': process_rss(os.getpid())}
+    vec_env = envs.unwrapped if envs is not None else None
+    if hasattr(vec_env, 'worker_pids'):
+        for i, pid in enumerate(vec_env.worker_pids()):
+            memory[f'worker {i} (pid {pid})'] = process_rss(pid)
+    return memory
+
+
+def format_bytes(size):
+    if size is None:
+        return 'n/a'
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+def report_totals(report):
+    """ Total bytes per section of a memory report (sections: dicts of name -> bytes or None) """
+    return {section: sum(size for size in fields.values() if size is not None) for section, fields in report.items()}
+
+
+def format_memory_report(report):
+    lines = ['Memory report:']
+    totals = report_totals(report)
+    for section, fields in report.items():
+        lines.append(f'  {section}: {format_bytes(totals[section])}')
+        for name, size in fields.items():
+            lines.append(f'    {name}: {format_bytes(size)}')
+    return '\n'.join(lines)
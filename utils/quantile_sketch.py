@@ -0,0 +1,92 @@
+import numpy as np
+import torch
+
+
+class QuantileSketch:
+    """
+    Streaming quantile sketch (KLL), to get quantiles of a stream of values in bounded memory
+    instead of keeping all of them until the end of the episode.
+    Values are kept in compactors (one per level), an item at level h stands for 2**h values.
+    When a compactor is full, it is sorted and every other item (random offset) moves one level up.
+    As long as nothing was compacted the quantiles are exact (and match torch.quantile).
+    Also keeps the count / mean of the values.
+    """
+
+    def __init__(self, k=200, seed=None):
+        """
+        :param k: size of the largest compactor, the rank error is roughly 1.7 / k
+        """
+        self.k = k
+        self.rng = np.random.RandomState(seed)
+        # the compactors are preallocated (no compactor ever holds more than 2 * k items), filled up to self.sizes
+        self.compactors = [np.empty(2 * k)]
+        self.sizes = [0]
+        self.count = 0
+        self.sum = 0.
+
+    def capacity(self, level):
+        # lower levels get smaller compactors
+        depth = len(self.compactors) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        """ Adds a batch of values (any shape) """
+        if torch.is_tensor(values):
+            values = values.detach().cpu().numpy()
+        values = np.asarray(values, dtype=np.float64).ravel()
+
+        self.count += values.size
+        self.sum += values.sum()
+        # add the values in chunks that fit into the lowest compactor
+        start = 0
+        while start < values.size:
+            n = min(values.size - start, self.capacity(0) - self.sizes[0])
+            if n > 0:
+                self.compactors[0][self.sizes[0]:self.sizes[0] + n] = values[start:start + n]
+                self.sizes[0] += n
+                start += n
+            self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.compactors):
+            size = self.sizes[level]
+            if size >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(2 * self.k))
+                    self.sizes.append(0)
+                items = np.sort(self.compactors[level][:size])
+                # with an odd number of items, one stays at this level
+                if size % 2 == 1:
+                    self.compactors[level][0] = items[-1]
+                    self.sizes[level] = 1
+                    items = items[:-1]
+                else:
+                    self.sizes[level] = 0
+                offset = self.rng.randint(2)
+                promoted = items[offset::2]
+                next_size = self.sizes[level + 1]
+                self.compactors[level + 1][next_size:next_size + len(promoted)] = promoted
+                self.sizes[level + 1] += len(promoted)
+            level += 1
+
+    def mean(self):
+        return self.sum / self.count
+
+    def quantiles(self, qs):
+        """ Returns the (approximate) quantiles qs of all values seen so far, as a list """
+        qs = np.asarray(qs, dtype=np.float64)
+
+        compactors = [c[:size] for c, size in zip(self.compactors, self.sizes)]
+        if len(compactors) == 1:
+            # nothing was compacted yet
+            return np.quantile(compactors[0], qs).tolist()
+
+        items = np.concatenate(compactors)
+        weights = np.concatenate([np.full(len(c), 2. ** level) for level, c in enumerate(compactors)])
+        order = np.argsort(items)
+        items, weights = items[order], weights[order]
+        # interpolate between the midpoints of the items' weight
+        cum_weights = np.cumsum(weights)
+        positions = (cum_weights - weights / 2) / cum_weights[-1]
+        return np.interp(qs, positions, items).tolist()
@@ -0,0 +1,160 @@
+import csv
+import os
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # only needed for parquet / arrow results
+    pa, pq = None, None
+
+
+class BufferedResultsWriter:
+    """
+    Collects result rows in memory and writes them in batches (every flush_every rows, and at close),
+    instead of opening the file for every row.
+    Writes <path>.csv, and optionally <path>.parquet and/or <path>.arrow (needs pyarrow),
+    which are much faster to load for analysis.
+    """
+
+    def __init__(self, path, headers, flush_every=100, formats=('csv',), append=False):
+        """
+        :param path: path of the results file without extension
+        :param formats: any of 'csv', 'parquet', 'arrow'
+        :param append: append to existing results files (e.g. from another process, or of a resumed run)
+                       instead of starting new ones
+        """
+        self.path = path
+        self.headers = list(headers)
+        self.flush_every = flush_every
+        self.formats = list(formats)
+        for fmt in self.formats:
+            if fmt not in ['csv', 'parquet', 'arrow']:
+                raise ValueError(f"Unknown results format {fmt}")
+        if (pa is None) and (('parquet' in self.formats) or ('arrow' in self.formats)):
+            raise ImportError('Writing parquet / arrow results requires pyarrow')
+
+        self.rows = []
+        # the parquet / arrow writers are opened with the first batch (once the column types are known)
+        self.parquet_writer = None
+        self.arrow_writer = None
+        self.arrow_sink = None
+        self.schema = None
+        # the rows already in parquet / arrow files we append to (they are rewritten with the first batch)
+        self.previous_tables = {}
+        if append:
+            for fmt in ['parquet', 'arrow']:
+                if (fmt in self.formats) and os.path.exists(self.path + '.' + fmt):
+                    self.previous_tables[fmt] = read_table(self.path + '.' + fmt)
+                    self.schema = self.previous_tables[fmt].schema
+
+        if ('csv' in self.formats) and not (append and os.path.exists(self.path + '.csv')):
+            with open(self.path + '.csv', 'w') as f:
+                csv.writer(f, delimiter=',').writerow(self.headers)
+
+    def add(self, row):
+        assert len(row) == len(self.headers), 'You have not passed sufficient values to logger'
+        self.rows.append([self._to_python(value) for value in row])
+        if len(self.rows) >= self.flush_every:
+            self.flush()
+
+    @staticmethod
+    def _to_python(value):
+        # numpy / torch scalars are written as plain numbers
+        if hasattr(value, 'item') and np.size(value) == 1:
+            return value.item()
+        return value
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+
+        if 'csv' in self.formats:
+            with open(self.path + '.csv', 'a') as f:
+                csv.writer(f, delimiter=',').writerows(self.rows)
+
+        if ('parquet' in self.formats) or ('arrow' in self.formats):
+            columns = list(zip(*self.rows))
+            # the column types are taken from the first batch (or from the files we append to)
+            if self.schema is None:
+                table = pa.table({header: list(column) for header, column in zip(self.headers, columns)})
+                self.schema = table.schema
+            else:
+                table = pa.table({header: list(column) for header, column in zip(self.headers, columns)},
+                                 schema=self.schema)
+            if 'parquet' in self.formats:
+                if self.parquet_writer is None:
+                    self.parquet_writer = pq.ParquetWriter(self.path + '.parquet', self.schema)
+                    if 'parquet' in self.previous_tables:
+                        self.parquet_writer.write_table(self.previous_tables.pop('parquet'))
+                self.parquet_writer.write_table(table)
+            if 'arrow' in self.formats:
+                if self.arrow_writer is None:
+                    self.arrow_sink = pa.OSFile(self.path + '.arrow', 'wb')
+                    self.arrow_writer = pa.ipc.new_file(self.arrow_sink, self.schema)
+                    if 'arrow' in self.previous_tables:
+                        self.arrow_writer.write_table(self.previous_tables.pop('arrow'))
+                self.arrow_writer.write_table(table)
+
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+            self.arrow_sink.close()
+            self.arrow_writer = None
+
+
+
+def read_table(path):
+    """ Reads a parquet / arrow results file (as written by BufferedResultsWriter) into a pyarrow table """
+    if path.endswith('.parquet'):
+        return pq.read_table(path)
+    with pa.OSFile(path, 'rb') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def write_table(table, path):
+    """ Writes a pyarrow table to a parquet / arrow results file (through a temp file, so it's never half-written) """
+    tmp_path = path + '.tmp'
+    if path.endswith('.parquet'):
+        pq.write_table(table, tmp_path)
+    else:
+        sink = pa.OSFile(tmp_path, 'wb')
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+        sink.close()
+    os.replace(tmp_path, path)
+
+
+def truncate_results(path, column, max_value, formats=('csv',)):
+    """
+    Drops the rows of the results files at path (without extension) whose column is above max_value,
+    e.g. the rows logged after the checkpoint that a run is resumed from.
+    Rows that were only partly written (if the run was killed while writing the csv) are dropped too.
+    """
+    if ('csv' in formats) and os.path.exists(path + '.csv'):
+        with open(path + '.csv', 'r') as f:
+            rows = list(csv.reader(f, delimiter=','))
+        if len(rows) > 0:
+            headers = rows[0]
+            idx = headers.index(column)
+            rows = [row for row in rows[1:] if (len(row) == len(headers)) and (float(row[idx]) <= max_value)]
+            with open(path + '.csv.tmp', 'w') as f:
+                writer = csv.writer(f, delimiter=',')
+                writer.writerow(headers)
+                writer.writerows(rows)
+            os.replace(path + '.csv.tmp', path + '.csv')
+
+    for fmt in ['parquet', 'arrow']:
+        if (fmt in formats) and os.path.exists(path + '.' + fmt):
+            table = read_table(path + '.' + fmt)
+            keep = np.array(table.column(column).to_pylist()) <= max_value
+            write_table(table.filter(pa.array(keep)), path + '.' + fmt)
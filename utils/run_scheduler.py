@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+import time
+
+
+class RunScheduler:
+    """
+    Runs a set of jobs (commands) concurrently on this machine, packing them onto the available cores
+    according to the number of cores each job declares it needs.
+    The state of the sweep (done / failed jobs, attempts) is kept in a json file, so a partially
+    finished sweep can be resumed: finished jobs are skipped, failed / interrupted ones are run again.
+    """
+
+    def __init__(self, jobs, max_cores, state_path, log_dir, retries=1, poll_interval=5):
+        """
+        :param jobs: list of dicts with a unique 'name', the 'command' (list) and the 'cores' it needs
+        :param retries: how often to rerun a failed job
+        :param log_dir: where the output of each job is written (<name>.log)
+        """
+        self.jobs = {job['name']: job for job in jobs}
+        self.max_cores = max_cores
+        self.state_path = state_path
+        self.log_dir = log_dir
+        self.retries = retries
+        self.poll_interval = poll_interval
+
+        for job in jobs:
+            if job['cores'] > max_cores:
+                raise ValueError(f"Job {job['name']} needs {job['cores']} cores, only {max_cores} available")
+
+        self.state = self.load_state()
+        # jobs that failed or were still running when a previous sweep stopped are run again
+        for name in self.jobs.keys():
+            if self.state.setdefault(name, {'status': 'pending', 'attempts': 0})['status'] != 'done':
+                self.state[name] = {'status': 'pending', 'attempts': 0}
+        self.save_state()
+
+        self.running = {}
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {}
+
+    def save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def free_cores(self):
+        return self.max_cores - sum(self.jobs[name]['cores'] for name in self.running.keys())
+
+    def pending(self):
+        # biggest jobs first, so they don't wait for the cores to free up behind many small ones
+        pending = [name for name in self.jobs.keys() if self.state[name]['status'] == 'pending']
+        return sorted(pending, key=lambda name: -self.jobs[name]['cores'])
+
+    def launch(self, name):
+        job = self.jobs[name]
+        log_file = open(os.path.join(self.log_dir, name + '.log'), 'a')
+        process = subprocess.Popen(job['command'], stdout=log_file, stderr=subprocess.STDOUT)
+        self.running[name] = (process, log_file)
+        self.state[name]['status'] = 'running'
+        self.state[name]['attempts'] += 1
+        print(f"RUNNING: {name} ({job['cores']} cores, attempt {self.state[name]['attempts']})")
+
+    def collect(self):
+        """ Updates the state of the jobs that finished """
+        for name, (process, log_file) in list(self.running.items()):
+            return_code = process.poll()
+            if return_code is None:
+                continue
+            log_file.close()
+            del self.running[name]
+            if return_code == 0:
+                self.state[name]['status'] = 'done'
+                print(f"DONE: {name}")
+            elif self.state[name]['attempts'] <= self.retries:
+                self.state[name]['status'] = 'pending'
+                print(f"FAILED: {name} (exit code {return_code}), retrying")
+            else:
+                self.state[name]['status'] = 'failed'
+                print(f"FAILED: {name} (exit code {return_code})")
+
+    def run(self):
+        """ Runs all jobs that aren't done yet, returns the names of the jobs that failed """
+        os.makedirs(self.log_dir, exist_ok=True)
+        try:
+            while True:
+                self.collect()
+                # start whatever fits into the free cores
+                for name in self.pending():
+                    if self.jobs[name]['cores'] <= self.free_cores():
+                        self.launch(name)
+                self.save_state()
+
+                if len(self.running) == 0 and len(self.pending()) == 0:
+                    break
+                time.sleep(self.poll_interval)
+        finally:
+            for process, log_file in self.running.values():
+                process.terminate()
+                process.wait()
+                log_file.close()
+
+        return [name for name in self.jobs.keys() if self.state[name]['status'] == 'failed']
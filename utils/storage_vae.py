@@ -1,3 +1,9 @@
+import json
+import os
+import queue
+import threading
+import time
+
 import numpy as np
 import torch
 
@@ -6,10 +12,13 @@ device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 class RolloutStorageVAE(object):
     def __init__(self, num_processes, max_trajectory_len, zero_pad, max_num_rollouts,
-                 state_dim, action_dim, vae_buffer_add_thresh, task_dim):
+                 state_dim, action_dim, vae_buffer_add_thresh, task_dim, buffer_dir=None, flush_interval=60):
         """
         Store everything that is needed for the VAE update
         :param num_processes:
+        :param buffer_dir: if given, completed rollouts are kept in memory-mapped files in this folder
+                           (instead of in RAM); an existing buffer in that folder is re-used
+        :param flush_interval: seconds between flushes of the memory-mapped buffer to disk (see checkpoint)
         """
 
         self.obs_dim = state_dim
@@ -20,14 +29,20 @@ class RolloutStorageVAE(object):
         self.max_buffer_size = max_num_rollouts  # maximum buffer len (number of trajectories)
         self.insert_idx = 0  # at which index we're currently inserting new data
         self.buffer_len = 0  # how much of the buffer has been filled
+        self.lock = threading.Lock()  # guards the permanent buffer (in case batches are sampled on another thread)
 
         # how long a trajectory can be at max (horizon)
         self.max_traj_len = max_trajectory_len
         # whether to zero-pad to maximum length (zero's at the end!)
         self.zero_pad = zero_pad
 
-        # buffers for completed rollouts (stored on CPU)
-        if self.max_buffer_size > 0:
+        # buffers for completed rollouts (stored on CPU, or on disk if we have a buffer_dir)
+        self.buffer_dir = buffer_dir
+        self.flush_interval = flush_interval
+        self.last_flush_time = time.time()
+        if (self.max_buffer_size > 0) and (self.buffer_dir is not None):
+            self.init_memmap_buffer(state_dim, action_dim, task_dim)
+        elif self.max_buffer_size > 0:
             self.prev_state = torch.zeros((self.max_traj_len, self.max_buffer_size, state_dim))
             self.next_state = torch.zeros((self.max_traj_len, self.max_buffer_size, state_dim))
             self.actions = torch.zeros((self.max_traj_len, self.max_buffer_size, action_dim))
@@ -40,6 +55,7 @@ class RolloutStorageVAE(object):
 
         # storage for each running process (stored on GPU)
         self.num_processes = num_processes
+        self.process_idx = torch.arange(num_processes).to(device)  # used to write each process' current step at once
         self.curr_timestep = torch.zeros((num_processes)).long()  # count environment steps so we know where to insert
         self.running_prev_state = torch.zeros((self.max_traj_len, num_processes, state_dim)).to(device)  # for each episode will have obs 0...N-1
         self.running_next_state = torch.zeros((self.max_traj_len, num_processes, state_dim)).to(device)  # for each episode will have obs 1...N
@@ -50,6 +66,66 @@ class RolloutStorageVAE(object):
         else:
             self.running_tasks = None
 
+    def init_memmap_buffer(self, state_dim, action_dim, task_dim):
+        """
+        Creates (or re-opens) the buffers for completed rollouts as memory-mapped files.
+        Here the trajectories are along dim=0 so that each sampled trajectory is one contiguous read.
+        """
+
+        if not os.path.exists(self.buffer_dir):
+            os.makedirs(self.buffer_dir)
+
+        shapes = {
+            'prev_state': (self.max_buffer_size, self.max_traj_len, state_dim),
+            'next_state': (self.max_buffer_size, self.max_traj_len, state_dim),
+            'actions': (self.max_buffer_size, self.max_traj_len, action_dim),
+            'rewards': (self.max_buffer_size, self.max_traj_len, 1),
+            'trajectory_lens': (self.max_buffer_size,),
+        }
+        if task_dim is not None:
+            shapes['tasks'] = (self.max_buffer_size, task_dim)
+
+        # re-use the buffer on disk if it was created with the same settings
+        meta = self.load_memmap_meta()
+        reuse = (meta is not None) and (meta['shapes'] == {k: list(v) for k, v in shapes.items()})
+        if reuse:
+            self.insert_idx = meta['insert_idx']
+            self.buffer_len = meta['buffer_len']
+            print(f'Re-using VAE buffer with {self.buffer_len} trajectories from {self.buffer_dir}')
+        mode = 'r+' if reuse else 'w+'
+
+        for name, shape in shapes.items():
+            dtype = np.int64 if name == 'trajectory_lens' else np.float32
+            setattr(self, name, np.memmap(os.path.join(self.buffer_dir, f'{name}.dat'),
+                                          dtype=dtype, mode=mode, shape=shape))
+        if task_dim is None:
+            self.tasks = None
+        self.shapes = shapes
+
+    def load_memmap_meta(self):
+        meta_file = os.path.join(self.buffer_dir, 'buffer_meta.json')
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file, 'rt') as f:
+            return json.load(f)
+
+    def save_memmap_meta(self):
+        """
+        Flushes the memory-mapped buffers and records how far they are filled (so we can resume from them).
+        The meta data is only written after the flush, so it never points past what is on disk.
+        """
+        for name in self.shapes.keys():
+            getattr(self, name).flush()
+        meta = {
+            'shapes': {k: list(v) for k, v in self.shapes.items()},
+            'insert_idx': self.insert_idx,
+            'buffer_len': self.buffer_len,
+        }
+        meta_file = os.path.join(self.buffer_dir, 'buffer_meta.json')
+        with open(meta_file + '.tmp', 'wt') as f:
+            json.dump(meta, f)
+        os.replace(meta_file + '.tmp', meta_file)
+
     def get_running_batch(self):
         """
         Returns the batch of data from the current running environments
@@ -61,104 +137,91 @@ class RolloutStorageVAE(object):
     def insert(self, prev_state, actions, next_state, rewards, done, task):
 
         # add to temporary buffer
+        # (each process writes at its own current timestep, so this also works if they are out of sync)
+        timestep = self.curr_timestep.to(device)
+        self.running_prev_state[timestep, self.process_idx] = prev_state
+        self.running_next_state[timestep, self.process_idx] = next_state
+        self.running_rewards[timestep, self.process_idx] = rewards
+        self.running_actions[timestep, self.process_idx] = actions.float()
+        if (self.running_tasks is not None) and (task is not None):
+            self.running_tasks.copy_(task.reshape(self.running_tasks.shape))
+        self.curr_timestep += 1
 
-        already_inserted = False
-        if len(np.unique(self.curr_timestep)) == 1:
-            self.running_prev_state[self.curr_timestep[0]] = prev_state
-            self.running_next_state[self.curr_timestep[0]] = next_state
-            self.running_rewards[self.curr_timestep[0]] = rewards
-            self.running_actions[self.curr_timestep[0]] = actions
-            if task is not None:
-                self.running_tasks = task
-            self.curr_timestep += 1
-            already_inserted = True
-
-        already_reset = False
-        if done.sum() == self.num_processes:  # check if we can process the entire batch at once
-
-            # add to permanent (up to max_buffer_len) buffer
-            if self.max_buffer_size > 0:
-                if self.vae_buffer_add_thresh >= np.random.uniform(0, 1):
-                    # check where to insert data
-                    if self.insert_idx + self.num_processes > self.max_buffer_size:
-                        # keep track of how much we filled the buffer (for sampling from it)
-                        self.buffer_len = self.insert_idx
-                        # this will keep some entries at the end of the buffer without overwriting them,
-                        # but the buffer is large enough to make this negligible
-                        self.insert_idx = 0
-                    else:
-                        self.buffer_len = max(self.buffer_len, self.insert_idx)
-                    # add; note: num trajectories are along dim=1,
-                    # trajectory length along dim=0, to match pytorch RNN interface
-                    self.prev_state[:, self.insert_idx:self.insert_idx + self.num_processes] = self.running_prev_state
-                    self.next_state[:, self.insert_idx:self.insert_idx + self.num_processes] = self.running_next_state
-                    self.actions[:, self.insert_idx:self.insert_idx+self.num_processes] = self.running_actions
-                    self.rewards[:, self.insert_idx:self.insert_idx+self.num_processes] = self.running_rewards
-                    if (self.tasks is not None) and (self.running_tasks is not None):
-                        insert_shape = self.tasks[self.insert_idx:self.insert_idx+self.num_processes].shape
-                        self.tasks[self.insert_idx:self.insert_idx+self.num_processes] = self.running_tasks.reshape(insert_shape)
-                    self.trajectory_lens[self.insert_idx:self.insert_idx+self.num_processes] = self.curr_timestep.clone()
-                    self.insert_idx += self.num_processes
-
-            # empty running buffer
-            self.running_prev_state *= 0
-            self.running_next_state *= 0
-            self.running_rewards *= 0
-            self.running_actions *= 0
-            if self.running_tasks is not None:
-                self.running_tasks *= 0
-            self.curr_timestep *= 0
-
-            already_reset = True
-
-        if (not already_inserted) or (not already_reset):
-
-            for i in range(self.num_processes):
-
-                if not already_inserted:
-                    self.running_prev_state[self.curr_timestep[i], i] = prev_state[i]
-                    self.running_next_state[self.curr_timestep[i], i] = next_state[i]
-                    self.running_rewards[self.curr_timestep[i], i] = rewards[i]
-                    self.running_actions[self.curr_timestep[i], i] = actions[i]
-                    if self.running_tasks is not None:
-                        self.running_tasks[i] = task[i]
-                    self.curr_timestep[i] += 1
-
-                if not already_reset:
-                    # if we are at the end of a task, dump the data into the larger buffer
-                    if done[i]:
-
-                        # add to permanent (up to max_buffer_len) buffer
-                        if self.max_buffer_size > 0:
-                            if self.vae_buffer_add_thresh >= np.random.uniform(0, 1):
-                                # check where to insert data
-                                if self.insert_idx + 1 > self.max_buffer_size:
-                                    # keep track of how much we filled the buffer (for sampling from it)
-                                    self.buffer_len = self.insert_idx
-                                    # this will keep some entries at the end of the buffer without overwriting them,
-                                    # but the buffer is large enough to make this negligible
-                                    self.insert_idx = 0
-                                else:
-                                    self.buffer_len = max(self.buffer_len, self.insert_idx)
-                                # add; note: num trajectories are along dim=1,
-                                # trajectory length along dim=0, to match pytorch RNN interface
-                                self.prev_state[:, self.insert_idx] = self.running_prev_state[:, i].to('cpu')
-                                self.next_state[:, self.insert_idx] = self.running_next_state[:, i].to('cpu')
-                                self.actions[:, self.insert_idx] = self.running_actions[:, i].to('cpu')
-                                self.rewards[:, self.insert_idx] = self.running_rewards[:, i].to('cpu')
-                                if self.tasks is not None:
-                                    self.tasks[self.insert_idx] = self.running_tasks[i].to('cpu')
-                                self.trajectory_lens[self.insert_idx] = self.curr_timestep[i].clone()
-                                self.insert_idx += 1
-
-                        # empty running buffer
-                        self.running_prev_state[:, i] *= 0
-                        self.running_next_state[:, i] *= 0
-                        self.running_rewards[:, i] *= 0
-                        self.running_actions[:, i] *= 0
-                        if self.running_tasks is not None:
-                            self.running_tasks[i] *= 0
-                        self.curr_timestep[i] = 0
+        # if we are at the end of a task, dump the data into the larger buffer
+        done_indices = torch.nonzero(done.view(-1).cpu()).view(-1)
+        if len(done_indices) == 0:
+            return
+
+        # add to permanent (up to max_buffer_len) buffer
+        if self.max_buffer_size > 0:
+            # decide for each finished trajectory whether we add it
+            add_mask = torch.from_numpy(np.random.uniform(0, 1, len(done_indices)) <= self.vae_buffer_add_thresh)
+            insert_indices = done_indices[add_mask]
+            if len(insert_indices) > 0:
+                self.add_to_buffer(insert_indices)
+
+        # empty running buffer
+        reset_indices = done_indices.to(device)
+        self.running_prev_state[:, reset_indices] = 0
+        self.running_next_state[:, reset_indices] = 0
+        self.running_rewards[:, reset_indices] = 0
+        self.running_actions[:, reset_indices] = 0
+        if self.running_tasks is not None:
+            self.running_tasks[reset_indices] = 0
+        self.curr_timestep[done_indices] = 0
+
+    def add_to_buffer(self, insert_indices):
+        """ Copies the running trajectories of the given processes to the permanent buffer, in one batched copy """
+        # (the buffer might be read by a batch prefetcher at the same time)
+        with self.lock:
+            self._add_to_buffer(insert_indices)
+
+    def _add_to_buffer(self, insert_indices):
+        num_insert = len(insert_indices)
+        # check where to insert data
+        if self.insert_idx + num_insert > self.max_buffer_size:
+            # keep track of how much we filled the buffer (for sampling from it)
+            self.buffer_len = self.insert_idx
+            # this will keep some entries at the end of the buffer without overwriting them,
+            # but the buffer is large enough to make this negligible
+            self.insert_idx = 0
+        else:
+            self.buffer_len = max(self.buffer_len, self.insert_idx)
+        # add; note: num trajectories are along dim=1,
+        # trajectory length along dim=0, to match pytorch RNN interface
+        buffer_slice = slice(self.insert_idx, self.insert_idx + num_insert)
+        running_indices = insert_indices.to(device)
+        if self.buffer_dir is not None:
+            # memory-mapped buffers are trajectory-major
+            self.prev_state[buffer_slice] = self.running_prev_state[:, running_indices].transpose(0, 1).cpu().numpy()
+            self.next_state[buffer_slice] = self.running_next_state[:, running_indices].transpose(0, 1).cpu().numpy()
+            self.actions[buffer_slice] = self.running_actions[:, running_indices].transpose(0, 1).cpu().numpy()
+            self.rewards[buffer_slice] = self.running_rewards[:, running_indices].transpose(0, 1).cpu().numpy()
+            if (self.tasks is not None) and (self.running_tasks is not None):
+                self.tasks[buffer_slice] = self.running_tasks[running_indices].cpu().numpy()
+            self.trajectory_lens[buffer_slice] = self.curr_timestep[insert_indices].numpy()
+        else:
+            self.prev_state[:, buffer_slice] = self.running_prev_state[:, running_indices].to('cpu')
+            self.next_state[:, buffer_slice] = self.running_next_state[:, running_indices].to('cpu')
+            self.actions[:, buffer_slice] = self.running_actions[:, running_indices].to('cpu')
+            self.rewards[:, buffer_slice] = self.running_rewards[:, running_indices].to('cpu')
+            if (self.tasks is not None) and (self.running_tasks is not None):
+                self.tasks[buffer_slice] = self.running_tasks[running_indices].to('cpu')
+            self.trajectory_lens[buffer_slice] = self.curr_timestep[insert_indices].tolist()
+        self.insert_idx += num_insert
+        if (self.buffer_dir is not None) and (time.time() - self.last_flush_time >= self.flush_interval):
+            self.save_memmap_meta()
+            self.last_flush_time = time.time()
+
+    def checkpoint(self):
+        """ Flushes the memory-mapped buffer (if we have one) to disk, e.g. when saving the models """
+        if (self.max_buffer_size > 0) and (self.buffer_dir is not None):
+            with self.lock:
+                self.save_memmap_meta()
+                self.last_flush_time = time.time()
+
+    def close(self):
+        self.checkpoint()
 
     def ready_for_update(self):
         return len(self) > 0
@@ -166,25 +229,164 @@ class RolloutStorageVAE(object):
     def __len__(self):
         return self.buffer_len
 
-    def get_batch(self, batchsize=5, replace=False):
+    def get_batch(self, batchsize=5, replace=False, to_device=True):
+        """
+        Samples a batch of trajectories from the buffer.
+        With to_device=False, the batch stays on the CPU (used by the VAEBatchPrefetcher).
+        """
         # TODO: check if we can get rid of num_enc_len and num_rollouts (call it batchsize instead)
 
-        batchsize = min(self.buffer_len, batchsize)
+        with self.lock:
+
+            batchsize = min(self.buffer_len, batchsize)
 
-        # select the indices for the processes from which we pick
-        rollout_indices = np.random.choice(range(self.buffer_len), batchsize, replace=replace)
-        # trajectory length of the individual rollouts we picked
-        trajectory_lens = np.array(self.trajectory_lens)[rollout_indices]
+            # select the indices for the processes from which we pick
+            rollout_indices = np.random.choice(range(self.buffer_len), batchsize, replace=replace)
+            # trajectory length of the individual rollouts we picked
+            trajectory_lens = np.asarray(self.trajectory_lens)[rollout_indices]
+
+            if self.buffer_dir is not None:
+                batch = self.get_memmap_batch(rollout_indices, trajectory_lens)
+            else:
+                # select the rollouts we want
+                prev_obs = self.prev_state[:, rollout_indices, :]
+                next_obs = self.next_state[:, rollout_indices, :]
+                actions = self.actions[:, rollout_indices, :]
+                rewards = self.rewards[:, rollout_indices, :]
+                tasks = self.tasks[rollout_indices] if self.tasks is not None else None
+                batch = prev_obs, next_obs, actions, rewards, tasks, trajectory_lens
 
-        # select the rollouts we want
-        prev_obs = self.prev_state[:, rollout_indices, :]
-        next_obs = self.next_state[:, rollout_indices, :]
-        actions = self.actions[:, rollout_indices, :]
-        rewards = self.rewards[:, rollout_indices, :]
+        if not to_device:
+            return batch
+
+        prev_obs, next_obs, actions, rewards, tasks, trajectory_lens = batch
+        if tasks is not None:
+            tasks = tasks.to(device)
+
+        return prev_obs.to(device), next_obs.to(device), actions.to(device), \
+               rewards.to(device), tasks, trajectory_lens
+
+    def get_memmap_batch(self, rollout_indices, trajectory_lens):
+        """
+        Reads only the sampled trajectories from disk
+        and returns them (on the CPU) in the same format as get_batch (trajectory length along dim=0).
+        """
+
+        # reading in file order avoids seeking back and forth
+        order = np.argsort(rollout_indices)
+        rollout_indices = rollout_indices[order]
+        trajectory_lens = trajectory_lens[order]
+
+        def _read(buffer):
+            return torch.from_numpy(np.ascontiguousarray(buffer[rollout_indices])).transpose(0, 1)
+
+        prev_obs = _read(self.prev_state)
+        next_obs = _read(self.next_state)
+        actions = _read(self.actions)
+        rewards = _read(self.rewards)
         if self.tasks is not None:
-            tasks = self.tasks[rollout_indices].to(device)
+            tasks = torch.from_numpy(np.ascontiguousarray(self.tasks[rollout_indices]))
         else:
             tasks = None
 
-        return prev_obs.to(device), next_obs.to(device), actions.to(device), \
-               rewards.to(device), tasks, trajectory_lens
+        return prev_obs, next_obs, actions, rewards, tasks, trajectory_lens
+
+
+class VAEBatchPrefetcher(object):
+    def __init__(self, rollout_storage, batchsize, num_batches):
+        """
+        Samples the next VAE mini-batches from the rollout storage on a background thread
+        (into pinned memory if we are on the GPU) while the current VAE update is running.
+        Prefetched batches can be up to num_batches updates older than the newest data in the buffer.
+        :param num_batches: how many batches to prepare ahead of time
+        """
+
+        self.rollout_storage = rollout_storage
+        self.batchsize = batchsize
+        self.pin_memory = torch.cuda.is_available()
+
+        self.queue = queue.Queue(maxsize=num_batches)
+        self.stop_event = threading.Event()
+
+        # keep track of how long it takes to sample a batch (which we would otherwise wait for on the main thread)
+        # and how long we actually wait for a prefetched batch
+        self.sample_time = 0
+        self.wait_time = 0
+        self.num_batches = 0
+
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        while not self.stop_event.is_set():
+
+            if not self.rollout_storage.ready_for_update():
+                time.sleep(0.01)
+                continue
+
+            try:
+                start_time = time.time()
+                batch = list(self.rollout_storage.get_batch(batchsize=self.batchsize, to_device=False))
+                if self.pin_memory:
+                    batch[:5] = [b.pin_memory() if b is not None else None for b in batch[:5]]
+                item = (batch, time.time() - start_time)
+            except Exception as e:
+                # hand the error to the main thread (get_batch re-raises it) and stop
+                item = e
+
+            # wait until there is space in the queue (but check regularly if we should stop)
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if isinstance(item, Exception):
+                return
+
+    def get_batch(self):
+        """ Returns the next batch (on the device), in the same format as RolloutStorageVAE.get_batch """
+
+        start_time = time.time()
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.thread.is_alive():
+                    raise RuntimeError('VAE batch prefetcher thread stopped')
+        if isinstance(item, Exception):
+            raise RuntimeError('VAE batch prefetcher failed') from item
+        batch, sample_time = item
+        prev_obs, next_obs, actions, rewards, tasks, trajectory_lens = batch
+        prev_obs = prev_obs.to(device, non_blocking=True)
+        next_obs = next_obs.to(device, non_blocking=True)
+        actions = actions.to(device, non_blocking=True)
+        rewards = rewards.to(device, non_blocking=True)
+        if tasks is not None:
+            tasks = tasks.to(device, non_blocking=True)
+
+        self.wait_time += time.time() - start_time
+        self.sample_time += sample_time
+        self.num_batches += 1
+
+        return prev_obs, next_obs, actions, rewards, tasks, trajectory_lens
+
+    def pop_timing(self):
+        """
+        Returns the average time (in ms) we waited for a batch and the average time saved per update
+        (compared to sampling synchronously), since the last call.
+        """
+        if self.num_batches == 0:
+            return None
+        wait_time = 1000 * self.wait_time / self.num_batches
+        time_saved = 1000 * (self.sample_time - self.wait_time) / self.num_batches
+        self.sample_time = 0
+        self.wait_time = 0
+        self.num_batches = 0
+        return wait_time, time_saved
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=1)
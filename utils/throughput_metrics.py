@@ -0,0 +1,56 @@
+import time
+from collections import defaultdict
+
+import numpy as np
+
+
+class ThroughputMetrics:
+    """
+    Collects the durations of the parts of the training loop (policy forward, encoder update, update, eval, ...)
+    and the number of env frames, and logs the throughput and mean durations to tensorboard.
+    If the envs are parallel (SubprocVecEnv) and time_workers is set, the workers time their env steps
+    to get the fraction of time they idle.
+    """
+
+    def __init__(self, envs=None, time_workers=False):
+        self.durations = defaultdict(list)
+        self.frames = 0
+        self.start = time.perf_counter()
+
+        vec_env = envs.unwrapped if envs is not None else None
+        self.vec_env = vec_env if (time_workers and hasattr(vec_env, 'pop_timing')) else None
+        if self.vec_env is not None:
+            self.vec_env.set_timing(True)
+
+    def add_duration(self, name, start):
+        """ Adds the time since start (from time.perf_counter) to the durations of name """
+        self.durations[name].append(time.perf_counter() - start)
+
+    def add_frames(self, frames):
+        self.frames += frames
+
+    def log(self, add, x_pos):
+        """
+        Logs the metrics since the last call with add(name, value, x_pos) (e.g. CustomLogger.add_tensorboard):
+        env frames per second (not counting the time spent evaluating), the mean durations in ms and the
+        mean / max fraction of time the env workers were not stepping their env (and their mean step duration).
+        """
+        elapsed = time.perf_counter() - self.start
+        training_time = elapsed - sum(self.durations['eval'])
+        add('throughput/fps', self.frames / training_time, x_pos)
+
+        for name, durations in self.durations.items():
+            if len(durations) > 0:
+                add(f'throughput/{name}_ms', 1000 * np.mean(durations), x_pos)
+
+        if self.vec_env is not None:
+            step_times, num_steps = self.vec_env.pop_timing()
+            idle_fraction = 1 - step_times / elapsed
+            add('throughput/worker_idle_fraction', idle_fraction.mean(), x_pos)
+            add('throughput/worker_idle_fraction_max', idle_fraction.max(), x_pos)
+            if num_steps.sum() > 0:
+                add('throughput/worker_step_ms', 1000 * step_times.sum() / num_steps.sum(), x_pos)
+
+        self.durations = defaultdict(list)
+        self.frames = 0
+        self.start = time.perf_counter()
@@ -1,3 +1,7 @@
+import copy
+import itertools
+import threading
+import time
 import warnings
 
 import gym
@@ -5,11 +9,13 @@ import numpy as np
 import torch
 from torch.nn import functional as F
 import torch.nn as nn
+import torch.utils.checkpoint
+from torch.nn.utils.rnn import pack_padded_sequence
 
 from models.decoder import StateTransitionDecoder, RewardDecoder, TaskDecoder
 from models.encoder import RNNEncoder
 from utils.helpers import get_task_dim, get_num_tasks
-from utils.storage_vae import RolloutStorageVAE
+from utils.storage_vae import RolloutStorageVAE, VAEBatchPrefetcher
 
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
@@ -36,6 +42,9 @@ class VaribadVAE:
         # initialise the decoders (returns None for unused decoders)
         self.state_decoder, self.reward_decoder, self.task_decoder = self.initialise_decoder()
 
+        # lookup table from (grid) states/tasks to ids, for the multi-head reward and task-id losses
+        self.id_lookup, self.id_lookup_offset, self.id_lookup_strides, self.id_env = self.initialise_id_lookup()
+
         # initialise rollout storage for the VAE update
         # (this differs from the data that the on-policy RL algorithm uses)
         self.rollout_storage = RolloutStorageVAE(num_processes=self.args.num_processes,
@@ -45,9 +54,20 @@ class VaribadVAE:
                                                  state_dim=self.args.state_dim,
                                                  action_dim=self.args.action_dim,
                                                  vae_buffer_add_thresh=self.args.vae_buffer_add_thresh,
-                                                 task_dim=self.task_dim
+                                                 task_dim=self.task_dim,
+                                                 buffer_dir=self.args.vae_buffer_dir if hasattr(self.args, 'vae_buffer_dir') else None,
+                                                 flush_interval=self.args.vae_buffer_flush_interval if hasattr(self.args, 'vae_buffer_flush_interval') else 60,
                                                  )
 
+        # optionally sample the next mini-batches in the background while the current VAE update runs
+        num_prefetch_batches = self.args.vae_prefetch_batches if hasattr(self.args, 'vae_prefetch_batches') else 0
+        if num_prefetch_batches is not None and num_prefetch_batches > 0:
+            self.batch_prefetcher = VAEBatchPrefetcher(self.rollout_storage,
+                                                       batchsize=self.args.vae_batch_num_trajs,
+                                                       num_batches=num_prefetch_batches)
+        else:
+            self.batch_prefetcher = None
+
         # initalise optimiser for the encoder and decoders
         decoder_params = []
         if not self.args.disable_decoder:
@@ -58,6 +78,57 @@ class VaribadVAE:
             if self.args.decode_task:
                 decoder_params.extend(self.task_decoder.parameters())
         self.optimiser_vae = torch.optim.Adam([*self.encoder.parameters(), *decoder_params], lr=self.args.lr_vae)
+        # count the updates, so we know how stale encodings computed with an older VAE are
+        self.num_updates = 0
+
+        # the encoder used for the rollouts; if the VAE is trained in the background, this is a copy of the
+        # trained encoder that gets synced whenever new weights were published (every vae_publish_interval updates).
+        # the decoders are copied the same way, so that the main thread (evaluation, saving the models) never
+        # reads weights that the background thread is updating
+        self.train_in_background = self.args.vae_train_in_background if hasattr(self.args, 'vae_train_in_background') else False
+        if self.train_in_background:
+            assert not self.args.rlloss_through_encoder
+            self.rollout_encoder = copy.deepcopy(self.encoder)
+            self.rollout_state_decoder = copy.deepcopy(self.state_decoder)
+            self.rollout_reward_decoder = copy.deepcopy(self.reward_decoder)
+            self.rollout_task_decoder = copy.deepcopy(self.task_decoder)
+        else:
+            self.rollout_encoder = self.encoder
+            self.rollout_state_decoder = self.state_decoder
+            self.rollout_reward_decoder = self.reward_decoder
+            self.rollout_task_decoder = self.task_decoder
+        self.rollout_encoder_version = 0
+        self.published_weights = None
+        self.publish_lock = threading.Lock()
+        self.background_thread = None
+        self.background_error = None
+        self.stop_event = threading.Event()
+
+        # whether to encode the VAE batches as packed sequences (only the actual timesteps of each trajectory);
+        # the packed GRU call runs over the whole trajectories, so it can't truncate the backprop through time
+        self.pack_sequences = self.args.vae_pack_sequences if hasattr(self.args, 'vae_pack_sequences') else False
+        if self.pack_sequences:
+            assert (self.args.tbptt_stepsize if hasattr(self.args, 'tbptt_stepsize') else None) is None, \
+                'vae_pack_sequences does not support truncated backprop (tbptt_stepsize)'
+
+        # how many ELBO terms to decode at once (None decodes all at once)
+        self.decode_chunk_size = self.args.vae_decode_chunk_size if hasattr(self.args, 'vae_decode_chunk_size') else None
+        if (self.decode_chunk_size is not None) and not self.supports_chunked_decoding():
+            warnings.warn(f'Chunked decoding does not support state_pred_type={self.args.state_pred_type} / '
+                          f'rew_pred_type={self.args.rew_pred_type}, decoding all ELBO terms at once instead.')
+            self.decode_chunk_size = None
+
+    def supports_chunked_decoding(self):
+        """ Whether compute_reconstruction_losses_chunked implements the state / reward likelihoods we use """
+        if self.args.disable_decoder:
+            return True
+        if self.args.decode_state and self.args.state_pred_type != 'deterministic':
+            return False
+        if self.args.decode_reward:
+            rew_pred_types = ['categorical', 'bernoulli', 'deterministic'] if self.args.multihead_for_reward \
+                else ['bernoulli', 'deterministic']
+            return self.args.rew_pred_type in rew_pred_types
+        return True
 
     def initialise_encoder(self):
         """ Initialises and returns an RNN encoder """
@@ -142,11 +213,56 @@ class VaribadVAE:
 
         return state_decoder, reward_decoder, task_decoder
 
-    def compute_state_reconstruction_loss(self, latent, prev_obs, next_obs, action, return_predictions=False):
-        """ Compute state reconstruction loss.
+    def initialise_id_lookup(self):
+        """
+        Builds a device-resident table of env.task_to_id for all (discrete) states of the environment,
+        so that the losses don't have to go through the environment.
+        Returns the (flattened) table, the offset and strides to index it, and the env if no table could be built.
+        """
+
+        needs_ids = (self.args.decode_reward and self.args.multihead_for_reward) or \
+                    (self.args.decode_task and self.args.task_pred_type == 'task_id')
+        if self.args.disable_decoder or not needs_ids:
+            return None, None, None, None
+
+        env = gym.make(self.args.env_name)
+        low, high = env.observation_space.low, env.observation_space.high
+        if not (np.all(np.isfinite(low)) and np.all(np.isfinite(high)) and
+                np.all(low == np.round(low)) and np.all(high == np.round(high))):
+            # not a grid: keep the env around and call task_to_id directly
+            return None, None, None, env
+
+        # enumerate all grid cells (in row-major order) and look up their ids once
+        low, high = low.astype(int), high.astype(int)
+        grid_shape = tuple(high - low + 1)
+        cells = np.array(list(itertools.product(*[range(l, h + 1) for l, h in zip(low, high)])))
+        id_lookup = env.task_to_id(cells).reshape(-1).long().to(device)
+        strides = torch.tensor([int(np.prod(grid_shape[i + 1:])) for i in range(len(grid_shape))]).long().to(device)
+        offset = torch.from_numpy(low).long().to(device)
+
+        return id_lookup, offset, strides, None
+
+    def task_to_id(self, tasks):
+        """
+        Maps (grid) states/tasks of shape [... x dim] to their ids, with a single gather from the lookup table.
+        Like env.task_to_id, this only reads the grid coordinates (not e.g. the done flag of the VariBadWrapper)
+        and returns ids of shape [1] for a single state.
+        """
+        if self.id_lookup is None:
+            return self.id_env.task_to_id(tasks).to(device)
+        if tasks.dim() == 1:
+            tasks = tasks.unsqueeze(0)
+        tasks = tasks[..., :self.id_lookup_offset.numel()]
+        flat_indices = ((tasks.long() - self.id_lookup_offset) * self.id_lookup_strides).sum(dim=-1)
+        return self.id_lookup[flat_indices]
+
+    def compute_state_reconstruction_loss(self, latent, prev_obs, next_obs, action, return_predictions=False,
+                                          state_decoder=None):
+        """ Compute state reconstruction loss (with the given decoder, e.g. the rollout copy; default: the trained one).
         (No reduction of loss along batch dimension is done here; sum/avg has to be done outside) """
 
-        state_pred = self.state_decoder(latent, prev_obs, action)
+        state_decoder = self.state_decoder if state_decoder is None else state_decoder
+        state_pred = state_decoder(latent, prev_obs, action)
 
         if self.args.state_pred_type == 'deterministic':
             loss_state = (state_pred - next_obs).pow(2).mean(dim=-1)
@@ -163,19 +279,20 @@ class VaribadVAE:
         else:
             return loss_state
 
-    def compute_rew_reconstruction_loss(self, latent, prev_obs, next_obs, action, reward, return_predictions=False):
-        """ Compute reward reconstruction loss.
+    def compute_rew_reconstruction_loss(self, latent, prev_obs, next_obs, action, reward, return_predictions=False,
+                                        reward_decoder=None):
+        """ Compute reward reconstruction loss (with the given decoder, e.g. the rollout copy; default: the trained one).
         (No reduction of loss along batch dimension is done here; sum/avg has to be done outside) """
 
+        reward_decoder = self.reward_decoder if reward_decoder is None else reward_decoder
         if self.args.multihead_for_reward:
-            rew_pred = self.reward_decoder(latent, None)
+            rew_pred = reward_decoder(latent, None)
             if self.args.rew_pred_type == 'categorical':
                 rew_pred = F.softmax(rew_pred, dim=-1)
             elif self.args.rew_pred_type == 'bernoulli':
                 rew_pred = torch.sigmoid(rew_pred)
 
-            env = gym.make(self.args.env_name)
-            state_indices = env.task_to_id(next_obs).to(device)
+            state_indices = self.task_to_id(next_obs)
             if state_indices.dim() < rew_pred.dim():
                 state_indices = state_indices.unsqueeze(-1)
             rew_pred = rew_pred.gather(dim=-1, index=state_indices)
@@ -187,7 +304,7 @@ class VaribadVAE:
             else:
                 raise NotImplementedError
         else:
-            rew_pred = self.reward_decoder(latent, next_obs, prev_obs, action.float())
+            rew_pred = reward_decoder(latent, next_obs, prev_obs, action.float())
             if self.args.rew_pred_type == 'bernoulli':  # TODO: untested!
                 rew_pred = torch.sigmoid(rew_pred)
                 rew_target = (reward == 1).float()  # TODO: necessary?
@@ -202,15 +319,15 @@ class VaribadVAE:
         else:
             return loss_rew
 
-    def compute_task_reconstruction_loss(self, latent, task, return_predictions=False):
-        """ Compute task reconstruction loss.
+    def compute_task_reconstruction_loss(self, latent, task, return_predictions=False, task_decoder=None):
+        """ Compute task reconstruction loss (with the given decoder, e.g. the rollout copy; default: the trained one).
         (No reduction of loss along batch dimension is done here; sum/avg has to be done outside) """
 
-        task_pred = self.task_decoder(latent)
+        task_decoder = self.task_decoder if task_decoder is None else task_decoder
+        task_pred = task_decoder(latent)
 
         if self.args.task_pred_type == 'task_id':
-            env = gym.make(self.args.env_name)
-            task_target = env.task_to_id(task).to(device)
+            task_target = self.task_to_id(task)
             # expand along first axis (number of ELBO terms)
             task_target = task_target.expand(task_pred.shape[:-1]).reshape(-1)
             loss_task = F.cross_entropy(task_pred.view(-1, task_pred.shape[-1]),
@@ -251,23 +368,149 @@ class VaribadVAE:
 
         return kl_divergences
 
+    def compute_reconstruction_losses_chunked(self, latent_samples, vae_prev_obs, vae_next_obs, vae_actions,
+                                              vae_rewards, elbo_mask=None, decode_mask=None):
+        """
+        Computes the reward/state reconstruction losses (reduced like in compute_loss, when all decodes are used),
+        decoding blocks of decode_chunk_size ELBO terms at a time.
+        The activations of each block are recomputed during the backward pass, so memory doesn't grow with
+        [num elbos] x [num decodes]; the decoder inputs (states/actions) are embedded once per trajectory.
+        """
+
+        num_elbos = latent_samples.shape[0]
+
+        # embed the decoder inputs once
+        if self.args.decode_reward:
+            if self.args.multihead_for_reward:
+                rew_inputs = self.task_to_id(vae_next_obs).unsqueeze(-1)
+            else:
+                rew_inputs = self.reward_decoder.embed_inputs(vae_next_obs, vae_prev_obs, vae_actions.float())
+        if self.args.decode_state:
+            state_inputs = self.state_decoder.embed_inputs(vae_prev_obs, vae_actions.float())
+
+        # sum the losses over the ELBO terms, block by block
+        # shape: [num_reconstruction_terms] x [num_trajectories]
+        rew_reconstruction_loss, state_reconstruction_loss = 0, 0
+        for start in range(0, num_elbos, self.decode_chunk_size):
+            latent_chunk = latent_samples[start:start + self.decode_chunk_size]
+            mask_chunk = None if elbo_mask is None else elbo_mask[start:start + self.decode_chunk_size].unsqueeze(1)
+            if self.args.decode_reward:
+                rew_reconstruction_loss = rew_reconstruction_loss + self.checkpoint(
+                    self.compute_rew_reconstruction_loss_chunk, latent_chunk, rew_inputs, vae_rewards, mask_chunk)
+            if self.args.decode_state:
+                state_reconstruction_loss = state_reconstruction_loss + self.checkpoint(
+                    self.compute_state_reconstruction_loss_chunk, latent_chunk, state_inputs, vae_next_obs, mask_chunk)
+
+        # avg across individual ELBO terms, avg/sum across individual reconstruction terms, average across tasks
+        num_elbo_terms = num_elbos if elbo_mask is None else elbo_mask.sum(dim=0).clamp(min=1)
+        if self.args.decode_reward:
+            if self.args.vae_avg_elbo_terms:
+                rew_reconstruction_loss = rew_reconstruction_loss / num_elbo_terms
+            rew_reconstruction_loss = self.reduce_terms(rew_reconstruction_loss, self.args.vae_avg_reconstruction_terms,
+                                                        decode_mask).mean()
+        if self.args.decode_state:
+            if self.args.vae_avg_elbo_terms:
+                state_reconstruction_loss = state_reconstruction_loss / num_elbo_terms
+            state_reconstruction_loss = self.reduce_terms(state_reconstruction_loss, self.args.vae_avg_reconstruction_terms,
+                                                          decode_mask).mean()
+
+        return rew_reconstruction_loss, state_reconstruction_loss
+
+    def compute_rew_reconstruction_loss_chunk(self, latent, rew_inputs, reward, mask=None):
+        """
+        Reward reconstruction loss of a block of ELBO terms (latent: [num_elbo_terms] x [num_trajectories] x [dim]),
+        decoding the entire trajectory; rew_inputs are the state ids (multi-head) or the embedded decoder inputs.
+        Returns the (masked) loss summed over the ELBO terms: [num_reconstruction_terms] x [num_trajectories]
+        """
+
+        if self.args.multihead_for_reward:
+            # predict the reward of all states once per ELBO term, then pick the visited ones
+            rew_pred = self.reward_decoder(latent, None)
+            if self.args.rew_pred_type == 'categorical':
+                rew_pred = F.softmax(rew_pred, dim=-1)
+            elif self.args.rew_pred_type == 'bernoulli':
+                rew_pred = torch.sigmoid(rew_pred)
+            rew_pred = rew_pred.unsqueeze(1).expand((-1, rew_inputs.shape[0], -1, -1))
+            rew_pred = rew_pred.gather(dim=-1, index=rew_inputs.unsqueeze(0).expand((rew_pred.shape[0], -1, -1, -1)))
+        else:
+            rew_pred = self.reward_decoder.forward_embedded(latent.unsqueeze(1), rew_inputs.unsqueeze(0))
+            if self.args.rew_pred_type == 'bernoulli':
+                rew_pred = torch.sigmoid(rew_pred)
+            elif self.args.rew_pred_type != 'deterministic':
+                raise NotImplementedError
+
+        reward = reward.unsqueeze(0).expand_as(rew_pred)
+        if self.args.rew_pred_type == 'deterministic':
+            loss_rew = (rew_pred - reward).pow(2).mean(dim=-1)
+        elif self.args.rew_pred_type in ['categorical', 'bernoulli']:
+            loss_rew = F.binary_cross_entropy(rew_pred, (reward == 1).float(), reduction='none').mean(dim=-1)
+        else:
+            raise NotImplementedError
+
+        if mask is not None:
+            loss_rew = loss_rew * mask
+        return loss_rew.sum(dim=0)
+
+    def compute_state_reconstruction_loss_chunk(self, latent, state_inputs, next_obs, mask=None):
+        """ Same as compute_rew_reconstruction_loss_chunk, for the state decoder """
+
+        state_pred = self.state_decoder.forward_embedded(latent.unsqueeze(1), state_inputs.unsqueeze(0))
+
+        if self.args.state_pred_type == 'deterministic':
+            loss_state = (state_pred - next_obs.unsqueeze(0)).pow(2).mean(dim=-1)
+        else:
+            raise NotImplementedError
+
+        if mask is not None:
+            loss_state = loss_state * mask
+        return loss_state.sum(dim=0)
+
+    @staticmethod
+    def checkpoint(function, *args):
+        """ Runs the function without keeping its activations for the backward pass (they are recomputed) """
+        if torch.is_grad_enabled():
+            return torch.utils.checkpoint.checkpoint(function, *args)
+        return function(*args)
+
+    @staticmethod
+    def reduce_terms(loss, average, mask=None):
+        """ Averages/sums the loss terms along the first dimension, only counting terms where the mask is 1 """
+        if mask is None:
+            return loss.mean(dim=0) if average else loss.sum(dim=0)
+        loss = (loss * mask).sum(dim=0)
+        if average:
+            loss = loss / mask.sum(dim=0).clamp(min=1)
+        return loss
+
     def compute_loss(self, latent_mean, latent_logvar, vae_prev_obs, vae_next_obs, vae_actions,
                      vae_rewards, vae_tasks, trajectory_lens):
         """
         Computes the VAE loss for the given data.
-        Batches everything together and therefore needs all trajectories to be of the same length.
+        Batches everything together; if trajectories have different lengths, either both ELBO and reconstruction
+        terms are subsampled (within the length of each trajectory), or the terms beyond each trajectory's length
+        are masked out.
         (Important because we need to separate ELBOs and decoding terms so can't collapse those dimensions)
         """
 
         num_unique_trajectory_lens = len(np.unique(trajectory_lens))
 
-        assert (num_unique_trajectory_lens == 1) or (self.args.vae_subsample_elbos and self.args.vae_subsample_decodes)
+        assert (num_unique_trajectory_lens == 1) or (self.args.vae_subsample_elbos and self.args.vae_subsample_decodes) \
+               or (self.args.vae_subsample_elbos is None and self.args.vae_subsample_decodes is None)
         assert not self.args.decode_only_past
 
         # cut down the batch to the longest trajectory length
         # this way we can preserve the structure
         # but we will waste some computation on zero-padded trajectories that are shorter than max_traj_len
         max_traj_len = np.max(trajectory_lens)
+
+        # for different trajectory lengths (and no subsampling), mask out the ELBO/reconstruction terms beyond
+        # the end of each trajectory; shapes: [num_elbos] x [num_trajectories] and [num_decodes] x [num_trajectories]
+        if num_unique_trajectory_lens > 1 and self.args.vae_subsample_elbos is None:
+            lens = torch.as_tensor(trajectory_lens, dtype=torch.long).to(device)
+            elbo_mask = (torch.arange(max_traj_len + 1).to(device).unsqueeze(1) <= lens.unsqueeze(0)).float()
+            decode_mask = (torch.arange(max_traj_len).to(device).unsqueeze(1) < lens.unsqueeze(0)).float()
+        else:
+            elbo_mask, decode_mask = None, None
         latent_mean = latent_mean[:max_traj_len + 1]
         latent_logvar = latent_logvar[:max_traj_len + 1]
         vae_prev_obs = vae_prev_obs[:max_traj_len]
@@ -308,80 +551,74 @@ class VaribadVAE:
         else:
             elbo_indices = None
 
-        # expand the state/rew/action inputs to the decoder (to match size of latents)
-        # shape will be: [num tasks in batch] x [num elbos] x [len trajectory (reconstrution loss)] x [dimension]
-        dec_prev_obs = vae_prev_obs.unsqueeze(0).expand((num_elbos, *vae_prev_obs.shape))
-        dec_next_obs = vae_next_obs.unsqueeze(0).expand((num_elbos, *vae_next_obs.shape))
-        dec_actions = vae_actions.unsqueeze(0).expand((num_elbos, *vae_actions.shape))
-        dec_rewards = vae_rewards.unsqueeze(0).expand((num_elbos, *vae_rewards.shape))
-
-        # subsample reconstruction terms
-        if self.args.vae_subsample_decodes is not None:
-            # shape before: vae_subsample_elbos * num_decodes * batchsize * dim
-            # shape after: vae_subsample_elbos * vae_subsample_decodes * batchsize * dim
-            # (Note that this will always have duplicates given how we set up the code)
-            indices0 = torch.arange(num_elbos).repeat(self.args.vae_subsample_decodes * batchsize)
-            if num_unique_trajectory_lens == 1:
-                indices1 = torch.LongTensor(num_elbos * self.args.vae_subsample_decodes * batchsize).random_(0, num_decodes)
-            else:
-                indices1 = np.concatenate([np.random.choice(range(0, t), num_elbos * self.args.vae_subsample_decodes,
-                                                            replace=True) for t in trajectory_lens])
-            indices2 = torch.arange(batchsize).repeat(num_elbos * self.args.vae_subsample_decodes)
-            dec_prev_obs = dec_prev_obs[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
-            dec_next_obs = dec_next_obs[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
-            dec_actions = dec_actions[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
-            dec_rewards = dec_rewards[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
-            num_decodes = dec_prev_obs.shape[1]
-
-        # expand the latent (to match the number of state/rew/action inputs to the decoder)
-        # shape will be: [num tasks in batch] x [num elbos] x [len trajectory (reconstrution loss)] x [dimension]
-        dec_embedding = latent_samples.unsqueeze(0).expand((num_decodes, *latent_samples.shape)).transpose(1, 0)
-
-        if self.args.decode_reward:
-            # compute reconstruction loss for this trajectory (for each timestep that was encoded, decode everything and sum it up)
-            # shape: [num_elbo_terms] x [num_reconstruction_terms] x [num_trajectories]
-            rew_reconstruction_loss = self.compute_rew_reconstruction_loss(dec_embedding, dec_prev_obs, dec_next_obs,
-                                                                           dec_actions, dec_rewards)
-            # avg/sum across individual ELBO terms
-            if self.args.vae_avg_elbo_terms:
-                rew_reconstruction_loss = rew_reconstruction_loss.mean(dim=0)
-            else:
-                rew_reconstruction_loss = rew_reconstruction_loss.sum(dim=0)
-            # avg/sum across individual reconstruction terms
-            if self.args.vae_avg_reconstruction_terms:
-                rew_reconstruction_loss = rew_reconstruction_loss.mean(dim=0)
-            else:
-                rew_reconstruction_loss = rew_reconstruction_loss.sum(dim=0)
-            # average across tasks
-            rew_reconstruction_loss = rew_reconstruction_loss.mean()
+        if self.decode_chunk_size is not None and self.args.vae_subsample_decodes is None:
+            # decode blocks of ELBO terms at a time, instead of expanding everything to [num elbos] x [num decodes]
+            rew_reconstruction_loss, state_reconstruction_loss = self.compute_reconstruction_losses_chunked(
+                latent_samples, vae_prev_obs, vae_next_obs, vae_actions, vae_rewards, elbo_mask, decode_mask)
         else:
-            rew_reconstruction_loss = 0
+            # expand the state/rew/action inputs to the decoder (to match size of latents)
+            # shape will be: [num tasks in batch] x [num elbos] x [len trajectory (reconstrution loss)] x [dimension]
+            dec_prev_obs = vae_prev_obs.unsqueeze(0).expand((num_elbos, *vae_prev_obs.shape))
+            dec_next_obs = vae_next_obs.unsqueeze(0).expand((num_elbos, *vae_next_obs.shape))
+            dec_actions = vae_actions.unsqueeze(0).expand((num_elbos, *vae_actions.shape))
+            dec_rewards = vae_rewards.unsqueeze(0).expand((num_elbos, *vae_rewards.shape))
+
+            # subsample reconstruction terms
+            if self.args.vae_subsample_decodes is not None:
+                # shape before: vae_subsample_elbos * num_decodes * batchsize * dim
+                # shape after: vae_subsample_elbos * vae_subsample_decodes * batchsize * dim
+                # (Note that this will always have duplicates given how we set up the code)
+                indices0 = torch.arange(num_elbos).repeat(self.args.vae_subsample_decodes * batchsize)
+                if num_unique_trajectory_lens == 1:
+                    indices1 = torch.LongTensor(num_elbos * self.args.vae_subsample_decodes * batchsize).random_(0, num_decodes)
+                else:
+                    indices1 = np.concatenate([np.random.choice(range(0, t), num_elbos * self.args.vae_subsample_decodes,
+                                                                replace=True) for t in trajectory_lens])
+                indices2 = torch.arange(batchsize).repeat(num_elbos * self.args.vae_subsample_decodes)
+                dec_prev_obs = dec_prev_obs[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
+                dec_next_obs = dec_next_obs[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
+                dec_actions = dec_actions[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
+                dec_rewards = dec_rewards[indices0, indices1, indices2, :].reshape((num_elbos, self.args.vae_subsample_decodes, batchsize, -1))
+                num_decodes = dec_prev_obs.shape[1]
+
+            # expand the latent (to match the number of state/rew/action inputs to the decoder)
+            # shape will be: [num tasks in batch] x [num elbos] x [len trajectory (reconstrution loss)] x [dimension]
+            dec_embedding = latent_samples.unsqueeze(0).expand((num_decodes, *latent_samples.shape)).transpose(1, 0)
 
-        if self.args.decode_state:
-            state_reconstruction_loss = self.compute_state_reconstruction_loss(dec_embedding, dec_prev_obs,
-                                                                               dec_next_obs, dec_actions)
-            # avg/sum across individual ELBO terms
-            if self.args.vae_avg_elbo_terms:
-                state_reconstruction_loss = state_reconstruction_loss.mean(dim=0)
+            if self.args.decode_reward:
+                # compute reconstruction loss for this trajectory (for each timestep that was encoded, decode everything and sum it up)
+                # shape: [num_elbo_terms] x [num_reconstruction_terms] x [num_trajectories]
+                rew_reconstruction_loss = self.compute_rew_reconstruction_loss(dec_embedding, dec_prev_obs, dec_next_obs,
+                                                                               dec_actions, dec_rewards)
+                # avg/sum across individual ELBO terms
+                rew_reconstruction_loss = self.reduce_terms(rew_reconstruction_loss, self.args.vae_avg_elbo_terms,
+                                                            None if elbo_mask is None else elbo_mask.unsqueeze(1))
+                # avg/sum across individual reconstruction terms
+                rew_reconstruction_loss = self.reduce_terms(rew_reconstruction_loss, self.args.vae_avg_reconstruction_terms,
+                                                            decode_mask)
+                # average across tasks
+                rew_reconstruction_loss = rew_reconstruction_loss.mean()
             else:
-                state_reconstruction_loss = state_reconstruction_loss.sum(dim=0)
-            # avg/sum across individual reconstruction terms
-            if self.args.vae_avg_reconstruction_terms:
-                state_reconstruction_loss = state_reconstruction_loss.mean(dim=0)
+                rew_reconstruction_loss = 0
+
+            if self.args.decode_state:
+                state_reconstruction_loss = self.compute_state_reconstruction_loss(dec_embedding, dec_prev_obs,
+                                                                                   dec_next_obs, dec_actions)
+                # avg/sum across individual ELBO terms
+                state_reconstruction_loss = self.reduce_terms(state_reconstruction_loss, self.args.vae_avg_elbo_terms,
+                                                              None if elbo_mask is None else elbo_mask.unsqueeze(1))
+                # avg/sum across individual reconstruction terms
+                state_reconstruction_loss = self.reduce_terms(state_reconstruction_loss, self.args.vae_avg_reconstruction_terms,
+                                                              decode_mask)
+                # average across tasks
+                state_reconstruction_loss = state_reconstruction_loss.mean()
             else:
-                state_reconstruction_loss = state_reconstruction_loss.sum(dim=0)
-            # average across tasks
-            state_reconstruction_loss = state_reconstruction_loss.mean()
-        else:
-            state_reconstruction_loss = 0
+                state_reconstruction_loss = 0
 
         if self.args.decode_task:
             task_reconstruction_loss = self.compute_task_reconstruction_loss(latent_samples, vae_tasks)
             # avg/sum across individual ELBO terms
-            if self.args.vae_avg_elbo_terms:
-                task_reconstruction_loss = task_reconstruction_loss.mean(dim=0)
-            else:
-                task_reconstruction_loss = task_reconstruction_loss.sum(dim=0)
+            task_reconstruction_loss = self.reduce_terms(task_reconstruction_loss, self.args.vae_avg_elbo_terms, elbo_mask)
             # sum the elbos, average across tasks
             task_reconstruction_loss = task_reconstruction_loss.sum(dim=0).mean()
         else:
@@ -392,10 +629,7 @@ class VaribadVAE:
             # shape: [num_elbo_terms] x [num_trajectories]
             kl_loss = self.compute_kl_loss(latent_mean, latent_logvar, elbo_indices)
             # avg/sum the elbos
-            if self.args.vae_avg_elbo_terms:
-                kl_loss = kl_loss.mean(dim=0)
-            else:
-                kl_loss = kl_loss.sum(dim=0)
+            kl_loss = self.reduce_terms(kl_loss, self.args.vae_avg_elbo_terms, elbo_mask)
             # average across tasks
             kl_loss = kl_loss.sum(dim=0).mean()
         else:
@@ -522,6 +756,12 @@ class VaribadVAE:
 
         return rew_reconstruction_loss, state_reconstruction_loss, task_reconstruction_loss, kl_loss
 
+    def get_batch(self):
+        """ Returns a VAE mini-batch (prefetched in the background if enabled) """
+        if self.batch_prefetcher is not None:
+            return self.batch_prefetcher.get_batch()
+        return self.rollout_storage.get_batch(batchsize=self.args.vae_batch_num_trajs)
+
     def compute_vae_loss(self, update=False, pretrain_index=None):
         """ Returns the VAE loss """
 
@@ -533,17 +773,28 @@ class VaribadVAE:
 
         # get a mini-batch
         vae_prev_obs, vae_next_obs, vae_actions, vae_rewards, vae_tasks, \
-        trajectory_lens = self.rollout_storage.get_batch(batchsize=self.args.vae_batch_num_trajs)
+        trajectory_lens = self.get_batch()
         # vae_prev_obs will be of size: max trajectory len x num trajectories x dimension of observations
 
         # pass through encoder (outputs will be: (max_traj_len+1) x number of rollouts x latent_dim -- includes the prior!)
-        _, latent_mean, latent_logvar, _ = self.encoder(actions=vae_actions,
-                                                        states=vae_next_obs,
-                                                        rewards=vae_rewards,
-                                                        hidden_state=None,
-                                                        return_prior=True,
-                                                        detach_every=self.args.tbptt_stepsize if hasattr(self.args, 'tbptt_stepsize') else None,
-                                                        )
+        if self.pack_sequences:
+            # only encode the actual timesteps of each trajectory (outputs are padded to the longest trajectory)
+            lengths = torch.as_tensor(trajectory_lens, dtype=torch.long)
+            _, latent_mean, latent_logvar, _ = self.encoder(
+                actions=pack_padded_sequence(vae_actions, lengths, enforce_sorted=False),
+                states=pack_padded_sequence(vae_next_obs, lengths, enforce_sorted=False),
+                rewards=pack_padded_sequence(vae_rewards, lengths, enforce_sorted=False),
+                hidden_state=None,
+                return_prior=True,
+            )
+        else:
+            _, latent_mean, latent_logvar, _ = self.encoder(actions=vae_actions,
+                                                            states=vae_next_obs,
+                                                            rewards=vae_rewards,
+                                                            hidden_state=None,
+                                                            return_prior=True,
+                                                            detach_every=self.args.tbptt_stepsize if hasattr(self.args, 'tbptt_stepsize') else None,
+                                                            )
 
         if self.args.split_batches_by_task:
             raise NotImplementedError
@@ -594,6 +845,9 @@ class VaribadVAE:
                     nn.utils.clip_grad_norm_(self.task_decoder.parameters(), self.args.decoder_max_grad_norm)
             # update
             self.optimiser_vae.step()
+            self.num_updates += 1
+            if not self.train_in_background:
+                self.rollout_encoder_version = self.num_updates
 
         self.log(elbo_loss, rew_reconstruction_loss, state_reconstruction_loss, task_reconstruction_loss, kl_loss,
                  pretrain_index)
@@ -621,3 +875,74 @@ class VaribadVAE:
             if not self.args.disable_kl_term:
                 self.logger.add('vae_losses/kl', kl_loss.mean(), curr_iter_idx)
             self.logger.add('vae_losses/sum', elbo_loss, curr_iter_idx)
+
+            if self.batch_prefetcher is not None:
+                timing = self.batch_prefetcher.pop_timing()
+                if timing is not None:
+                    self.logger.add('vae_timing/batch_wait_ms', timing[0], curr_iter_idx)
+                    self.logger.add('vae_timing/batch_time_saved_ms', timing[1], curr_iter_idx)
+
+    def start_background_training(self):
+        """ Starts updating the VAE continuously on a background thread (while the main thread collects data) """
+        if self.background_thread is None:
+            self.background_thread = threading.Thread(target=self.background_training, daemon=True)
+            self.background_thread.start()
+
+    def background_training(self):
+        publish_interval = self.args.vae_publish_interval if hasattr(self.args, 'vae_publish_interval') else 1
+        try:
+            while not self.stop_event.is_set():
+                if not self.rollout_storage.ready_for_update():
+                    time.sleep(0.01)
+                    continue
+                self.compute_vae_loss(update=True)
+                if self.num_updates % publish_interval == 0:
+                    self.publish_models()
+        except Exception as e:
+            # re-raised on the main thread (in sync_rollout_encoder / close)
+            self.background_error = e
+
+    def check_background_error(self):
+        if self.background_error is not None:
+            raise RuntimeError('Background VAE training failed') from self.background_error
+
+    def rollout_models(self):
+        """ Pairs of (trained model, rollout copy) for the encoder and the decoders in use """
+        models = {
+            'encoder': (self.encoder, self.rollout_encoder),
+            'state_decoder': (self.state_decoder, self.rollout_state_decoder),
+            'reward_decoder': (self.reward_decoder, self.rollout_reward_decoder),
+            'task_decoder': (self.task_decoder, self.rollout_task_decoder),
+        }
+        return {name: pair for name, pair in models.items() if pair[0] is not None}
+
+    def publish_models(self):
+        """ Makes a copy of the current encoder / decoder weights available to the main thread (see sync_rollout_encoder) """
+        weights = {name: {k: v.detach().clone() for k, v in model.state_dict().items()}
+                   for name, (model, _) in self.rollout_models().items()}
+        with self.publish_lock:
+            self.published_weights = weights, self.num_updates
+
+    def sync_rollout_encoder(self):
+        """
+        Loads the most recently published weights into the rollout encoder and decoders (if there are new ones),
+        and raises if the background training failed
+        """
+        self.check_background_error()
+        with self.publish_lock:
+            published_weights, self.published_weights = self.published_weights, None
+        if published_weights is not None:
+            weights, version = published_weights
+            for name, (_, rollout_model) in self.rollout_models().items():
+                rollout_model.load_state_dict(weights[name])
+            self.rollout_encoder_version = version
+
+    def close(self):
+        """ Stops background workers and flushes the VAE buffer """
+        if self.background_thread is not None:
+            self.stop_event.set()
+            self.background_thread.join()
+        if self.batch_prefetcher is not None:
+            self.batch_prefetcher.close()
+        self.rollout_storage.close()
+        self.check_background_error()